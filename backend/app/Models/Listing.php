@@ -6,6 +6,8 @@
 
 use Illuminate\Database\Eloquent\Model;
 use Illuminate\Database\Eloquent\Relations\BelongsTo;
+use Illuminate\Database\Eloquent\Relations\HasMany;
+use Illuminate\Database\Eloquent\Relations\HasOne;
 
 /**
  * 出品情報モデル
@@ -21,6 +23,7 @@ final class Listing extends Model
     protected $casts = [
         'image_urls' => 'array',
         'local_image_paths' => 'array',
+        'local_image_derivatives' => 'array',
         'price' => 'decimal:0',
         'total_price' => 'decimal:0',
         'is_sold_out' => 'boolean',
@@ -49,4 +52,20 @@ public function site(): BelongsTo
     {
         return $this->belongsTo(Site::class);
     }
+
+    /**
+     * 価格・走行距離の変更履歴を取得
+     */
+    public function priceHistories(): HasMany
+    {
+        return $this->hasMany(ListingPriceHistory::class);
+    }
+
+    /**
+     * 詳細ページから補完した情報を取得
+     */
+    public function detail(): HasOne
+    {
+        return $this->hasOne(ListingDetail::class);
+    }
 }
\ No newline at end of file
@@ -0,0 +1,33 @@
+<?php
+
+declare(strict_types=1);
+
+namespace App\Models;
+
+use Illuminate\Database\Eloquent\Model;
+use Illuminate\Database\Eloquent\Relations\BelongsTo;
+
+/**
+ * 出品詳細モデル
+ * 新着の出品について、詳細ページから補完した排気量・車体色・車検・全画像を保持します
+ */
+final class ListingDetail extends Model
+{
+    /**
+     * カラムの型変換（キャスト）設定
+     *
+     * @var array<string, string>
+     */
+    protected $casts = [
+        'image_urls' => 'array',
+        'enriched_at' => 'datetime',
+    ];
+
+    /**
+     * 対象の出品情報を取得
+     */
+    public function listing(): BelongsTo
+    {
+        return $this->belongsTo(Listing::class);
+    }
+}
\ No newline at end of file
@@ -0,0 +1,50 @@
+<?php
+
+declare(strict_types=1);
+
+namespace App\Models;
+
+use Illuminate\Database\Eloquent\Model;
+use Illuminate\Database\Eloquent\Relations\BelongsTo;
+
+/**
+ * 出品価格履歴モデル
+ * スクレイパーが検知した価格・走行距離の変化を追記専用で保持します
+ */
+final class ListingPriceHistory extends Model
+{
+    /**
+     * テーブル名（単数形で作成しているため明示）
+     *
+     * @var string
+     */
+    protected $table = 'listing_price_history';
+
+    /**
+     * 追記専用のため created_at / updated_at は使用しない
+     *
+     * @var bool
+     */
+    public $timestamps = false;
+
+    /**
+     * カラムの型変換（キャスト）設定
+     *
+     * @var array<string, string>
+     */
+    protected $casts = [
+        'price' => 'decimal:0',
+        'total_price' => 'decimal:0',
+        'previous_price' => 'decimal:0',
+        'previous_total_price' => 'decimal:0',
+        'recorded_at' => 'datetime',
+    ];
+
+    /**
+     * 対象の出品情報を取得
+     */
+    public function listing(): BelongsTo
+    {
+        return $this->belongsTo(Listing::class);
+    }
+}
\ No newline at end of file
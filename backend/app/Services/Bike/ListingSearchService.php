@@ -43,26 +43,33 @@ public function search(string $keyword): array
             'store_name' => $item->shop->name ?? '個人出品等',
             'store_address' => $item->shop->prefecture ?? '',
             'url' => $item->source_url,
-            // ストレージに保存されたパスがある場合はURLに変換、なければ空配列
-            'images' => $this->resolveImageUrls($item->local_image_paths),
+            // ストレージに保存されたパスがある場合はURLに変換、なければ空配列（WebP 版があればそちらを使う）
+            'images' => $this->resolveImageUrls($item->local_image_paths, $item->local_image_derivatives, 'webp'),
+            // 検索結果のカード用。サムネイルが未生成の画像は元の画像を使う
+            'thumbnails' => $this->resolveImageUrls($item->local_image_paths, $item->local_image_derivatives, 'thumb'),
         ])->toArray();
     }
 
     /**
      * 保存済みの相対パスを公開URLの配列に変換する
+     * 派生画像 (local_image_derivatives) に指定の種類があれば、元の画像の代わりにそのパスを使う
      * @param array|null $paths
+     * @param array|null $derivatives local_image_paths と同じ並びの ['thumb' => パス, 'webp' => パス]
+     * @param string $kind
      * @return array
      */
-    private function resolveImageUrls(?array $paths): array
+    private function resolveImageUrls(?array $paths, ?array $derivatives, string $kind): array
     {
         if (empty($paths)) {
             return [];
         }
 
-        return array_map(function ($path) {
+        return array_map(function ($path, $index) use ($derivatives, $kind) {
+            $path = $derivatives[$index][$kind] ?? $path;
+
             // storage/app/public/listings 配下に保存されている前提
             // asset() や Storage::url() を使用
             return Storage::disk('public')->url('listings/' . $path);
-        }, $paths);
+        }, $paths, array_keys($paths));
     }
 }
\ No newline at end of file
@@ -0,0 +1,40 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        Schema::create('listing_price_history', function (Blueprint $table) {
+            $table->id();
+            // listingsテーブルへの外部キー
+            $table->foreignId('listing_id')->constrained('listings')->onDelete('cascade')->comment('出品ID');
+            // 変更後の値
+            $table->decimal('price', 12, 0)->nullable()->comment('本体価格');
+            $table->decimal('total_price', 12, 0)->nullable()->comment('支払総額');
+            $table->integer('mileage')->nullable()->comment('走行距離');
+            // 変更前の値（差分の確認用）
+            $table->decimal('previous_price', 12, 0)->nullable()->comment('変更前の本体価格');
+            $table->decimal('previous_total_price', 12, 0)->nullable()->comment('変更前の支払総額');
+            $table->integer('previous_mileage')->nullable()->comment('変更前の走行距離');
+            // 追記専用のため更新日時は持たない
+            $table->timestamp('recorded_at')->useCurrent()->comment('記録日時');
+
+            $table->index(['listing_id', 'recorded_at']);
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('listing_price_history');
+    }
+};
\ No newline at end of file
@@ -0,0 +1,38 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\DB;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        Schema::table('listings', function (Blueprint $table) {
+            // source_url (TEXT) は索引を張れないため、SHA-1 をキーとして保持する
+            $table->char('url_hash', 40)->nullable()->after('source_url')->comment('source_url の SHA-1');
+            // 正規化したカード内容のハッシュ（変更があった出品だけを更新するための比較用）
+            $table->char('fingerprint', 40)->nullable()->after('local_image_paths')->comment('カード内容のフィンガープリント');
+
+            $table->index(['site_id', 'url_hash']);
+        });
+
+        // 既存行の url_hash を埋める（fingerprint は次回の巡回時に設定される）
+        DB::statement('UPDATE listings SET url_hash = SHA1(source_url) WHERE url_hash IS NULL');
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('listings', function (Blueprint $table) {
+            $table->dropIndex(['site_id', 'url_hash']);
+            $table->dropColumn(['url_hash', 'fingerprint']);
+        });
+    }
+};
\ No newline at end of file
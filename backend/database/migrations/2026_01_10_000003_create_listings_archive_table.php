@@ -0,0 +1,51 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // 掲載終了から一定期間が経過した出品の退避先（listings と同じ ID を保持し、復元可能にする）
+        Schema::create('listings_archive', function (Blueprint $table) {
+            $table->unsignedBigInteger('id')->primary()->comment('元の出品ID');
+            $table->unsignedBigInteger('bike_model_id')->nullable();
+            $table->unsignedBigInteger('shop_id')->nullable();
+            $table->unsignedBigInteger('site_id')->comment('取得元サイトID');
+
+            $table->string('title')->nullable()->comment('車両タイトル/キャッチコピー');
+            $table->text('source_url');
+            $table->char('url_hash', 40)->nullable()->comment('source_url の SHA-1');
+            $table->decimal('price', 12, 0)->nullable();
+            $table->decimal('total_price', 12, 0)->nullable();
+            $table->integer('model_year')->nullable();
+            $table->integer('mileage')->nullable();
+            $table->json('image_urls')->nullable();
+            $table->json('local_image_paths')->nullable()->comment('保存済み画像パス');
+            $table->char('fingerprint', 40)->nullable()->comment('カード内容のフィンガープリント');
+            $table->boolean('is_sold_out')->default(true);
+            $table->timestamp('created_at')->nullable()->comment('作成日時');
+            $table->timestamp('updated_at')->nullable()->comment('更新日時');
+
+            // 価格履歴も一緒に退避する（listing_price_history は listings の削除に連動して消えるため）
+            $table->json('price_history')->nullable()->comment('退避した価格履歴');
+            $table->timestamp('archived_at')->useCurrent()->comment('退避日時');
+
+            $table->index(['site_id', 'url_hash']);
+            $table->index('archived_at');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('listings_archive');
+    }
+};
\ No newline at end of file
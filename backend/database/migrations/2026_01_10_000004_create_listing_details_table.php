@@ -0,0 +1,49 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // 詳細ページから補完した情報（新着の出品だけを対象に取得する）
+        Schema::create('listing_details', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('listing_id')->unique()->constrained('listings')->onDelete('cascade')->comment('出品ID');
+            // 取得状態: done=取得済み / failed=失敗（attempts が上限未満なら次回再試行）
+            $table->string('status', 20)->comment('取得状態');
+            $table->unsignedTinyInteger('attempts')->default(0)->comment('取得試行回数');
+            $table->integer('displacement')->nullable()->comment('排気量(cc)');
+            $table->string('color', 50)->nullable()->comment('車体色');
+            $table->string('inspection', 50)->nullable()->comment('車検');
+            $table->json('image_urls')->nullable()->comment('詳細ページの全画像URL');
+            $table->string('error', 255)->nullable()->comment('直近の失敗理由');
+            $table->timestamp('enriched_at')->nullable()->comment('最終取得日時');
+            $table->timestamps();
+
+            $table->index(['status', 'attempts']);
+        });
+
+        // サイトごとの補完済み位置（この出品IDまでは取得を試みた）
+        Schema::create('enrichment_watermarks', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('site_id')->unique()->constrained('sites')->onDelete('cascade')->comment('取得元サイトID');
+            $table->unsignedBigInteger('last_listing_id')->default(0)->comment('補完を試みた最大の出品ID');
+            $table->timestamps();
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('enrichment_watermarks');
+        Schema::dropIfExists('listing_details');
+    }
+};
\ No newline at end of file
@@ -0,0 +1,49 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // コレクターの巡回1回分（--resume で未完了の巡回を再開する）
+        Schema::create('crawl_runs', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('site_id')->constrained('sites')->onDelete('cascade')->comment('取得元サイトID');
+            $table->string('collector', 100)->comment('コレクター名');
+            // 巡回状態: running=実行中または中断 / completed=完了 / abandoned=再開されずに破棄
+            $table->string('status', 20)->comment('巡回状態');
+            $table->timestamp('started_at')->comment('開始日時');
+            $table->timestamp('finished_at')->nullable()->comment('終了日時');
+            $table->timestamps();
+
+            $table->index(['site_id', 'collector', 'status']);
+        });
+
+        // 巡回中に完了した作業単位（メーカー・車種・都道府県・ページ）
+        Schema::create('crawl_units', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('crawl_run_id')->constrained('crawl_runs')->onDelete('cascade')->comment('巡回ID');
+            $table->string('unit_type', 20)->comment('作業単位の種類 (maker / model / prefecture / page)');
+            $table->string('unit_key', 255)->comment('作業単位のキー（URL や識別番号）');
+            $table->json('found_urls')->nullable()->comment('この単位で見つかった出品URL（掲載終了判定に引き継ぐ）');
+            $table->timestamp('completed_at')->comment('完了日時');
+
+            $table->unique(['crawl_run_id', 'unit_type', 'unit_key']);
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('crawl_units');
+        Schema::dropIfExists('crawl_runs');
+    }
+};
\ No newline at end of file
@@ -0,0 +1,36 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // 車種ページの前回巡回時のシグネチャ（在庫台数が変わらない車種は差分巡回で飛ばす）
+        Schema::create('model_crawl_signatures', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('site_id')->constrained('sites')->onDelete('cascade')->comment('取得元サイトID');
+            // サイト固有の車種識別番号 (bike_model_identifiers.identifier)
+            $table->string('identifier', 100)->comment('サイト固有の車種識別番号');
+            $table->integer('stock_count')->nullable()->comment('メーカーページに表示されていた在庫台数');
+            $table->text('top_url')->nullable()->comment('一覧の先頭に表示されていた出品URL');
+            $table->timestamp('last_crawled_at')->comment('最後に一覧ページを巡回した日時');
+            $table->timestamps();
+
+            $table->unique(['site_id', 'identifier']);
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('model_crawl_signatures');
+    }
+};
\ No newline at end of file
@@ -0,0 +1,62 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // データ収集パイプライン (run_all.py) の実行1回分
+        Schema::create('scrape_runs', function (Blueprint $table) {
+            $table->id();
+            $table->string('mode', 20)->comment('実行方式 (subprocess / in-process)');
+            // 実行結果: completed=全ステップ成功 / failed=一部のステップが失敗 / aborted=マスタ作成の失敗で中断
+            $table->string('status', 20)->comment('実行結果');
+            $table->unsignedTinyInteger('max_parallel')->comment('同時実行ステップ数の上限');
+            $table->timestamp('started_at')->comment('開始日時');
+            $table->timestamp('finished_at')->comment('終了日時');
+            $table->double('wall_seconds')->comment('所要時間(秒)');
+            $table->timestamps();
+
+            $table->index('started_at');
+        });
+
+        // 実行ごとのステップのメトリクス（件数は取得できなかった場合 NULL）
+        Schema::create('scrape_run_steps', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('scrape_run_id')->constrained('scrape_runs')->onDelete('cascade')->comment('実行ID');
+            $table->string('script', 100)->comment('ステップのスクリプト');
+            // 結果: success / failed / skipped（中断により未実行）
+            $table->string('status', 20)->comment('結果');
+            $table->integer('returncode')->nullable()->comment('終了コード');
+            $table->double('started_offset')->nullable()->comment('実行開始からの開始時刻(秒)');
+            $table->double('wall_seconds')->nullable()->comment('所要時間(秒)');
+            $table->unsignedInteger('pages_fetched')->nullable()->comment('取得ページ数');
+            $table->unsignedBigInteger('bytes_fetched')->nullable()->comment('取得バイト数');
+            $table->unsignedInteger('rows_inserted')->nullable()->comment('新規登録件数');
+            $table->unsignedInteger('rows_updated')->nullable()->comment('更新件数');
+            $table->unsignedInteger('rows_sold_out')->nullable()->comment('掲載終了にした件数');
+            $table->unsignedInteger('errors')->nullable()->comment('エラー件数');
+            $table->unsignedInteger('retries')->nullable()->comment('リトライ回数');
+            $table->unsignedBigInteger('peak_rss_kb')->nullable()->comment('ピークRSS(KB)');
+            $table->timestamps();
+
+            $table->unique(['scrape_run_id', 'script']);
+            $table->index(['script', 'scrape_run_id']);
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('scrape_run_steps');
+        Schema::dropIfExists('scrape_runs');
+    }
+};
\ No newline at end of file
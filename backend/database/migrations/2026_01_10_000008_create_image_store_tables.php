@@ -0,0 +1,43 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // 内容のハッシュをキーに保存した画像 (storage/app/public/listings/objects/ 配下)
+        Schema::create('image_objects', function (Blueprint $table) {
+            $table->id();
+            $table->char('sha256', 64)->unique()->comment('画像の内容の SHA-256');
+            $table->string('path', 255)->comment('listings/ からの相対パス');
+            $table->unsignedInteger('bytes')->comment('ファイルサイズ');
+            // listings・listings_archive の local_image_paths から参照されている数（0 のものは削除できる）
+            $table->unsignedInteger('ref_count')->default(0)->comment('出品からの参照数');
+            $table->timestamps();
+        });
+
+        // 画像URLと保存済みの内容の対応（既知のURLは再ダウンロードしない）
+        Schema::create('image_sources', function (Blueprint $table) {
+            $table->id();
+            // 画像URL (TEXT) は索引を張れないため、SHA-1 をキーとして保持する
+            $table->char('url_hash', 40)->unique()->comment('画像URLの SHA-1');
+            $table->char('sha256', 64)->index()->comment('画像の内容の SHA-256 (image_objects.sha256)');
+            $table->timestamps();
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('image_sources');
+        Schema::dropIfExists('image_objects');
+    }
+};
\ No newline at end of file
@@ -0,0 +1,33 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // local_image_paths と同じ並びで、画像ごとのサムネイル・WebP 版のパスを保持する（NULL は未生成）
+        foreach (['listings', 'listings_archive'] as $tableName) {
+            Schema::table($tableName, function (Blueprint $table) {
+                $table->json('local_image_derivatives')->nullable()->after('local_image_paths')->comment('保存済み画像の派生画像パス');
+            });
+        }
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        foreach (['listings', 'listings_archive'] as $tableName) {
+            Schema::table($tableName, function (Blueprint $table) {
+                $table->dropColumn('local_image_derivatives');
+            });
+        }
+    }
+};
\ No newline at end of file
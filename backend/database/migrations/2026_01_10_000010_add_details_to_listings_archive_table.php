@@ -0,0 +1,29 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // 詳細ページの補完結果も一緒に退避する（listing_details は listings の削除に連動して消えるため）
+        Schema::table('listings_archive', function (Blueprint $table) {
+            $table->json('details')->nullable()->after('price_history')->comment('退避した詳細ページの補完結果');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('listings_archive', function (Blueprint $table) {
+            $table->dropColumn('details');
+        });
+    }
+};
\ No newline at end of file
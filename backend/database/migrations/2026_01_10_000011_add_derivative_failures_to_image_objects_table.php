@@ -0,0 +1,29 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // 派生画像の生成に失敗した回数（上限に達した画像は作り直さず、派生画像なしとして記録する）
+        Schema::table('image_objects', function (Blueprint $table) {
+            $table->unsignedTinyInteger('derivative_failures')->default(0)->after('ref_count')->comment('派生画像の生成の失敗回数');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('image_objects', function (Blueprint $table) {
+            $table->dropColumn('derivative_failures');
+        });
+    }
+};
\ No newline at end of file
@@ -66,8 +66,8 @@
                                 {{ $bike['source'] }}
                             </div>
                         </div>
-                        @if(!empty($bike['images']) && isset($bike['images'][0]))
-                            <img src="{{ $bike['images'][0] }}" class="bike-img w-full h-full object-cover" alt="{{ $bike['name'] }}" loading="lazy">
+                        @if(!empty($bike['thumbnails']) && isset($bike['thumbnails'][0]))
+                            <img src="{{ $bike['thumbnails'][0] }}" class="bike-img w-full h-full object-cover" alt="{{ $bike['name'] }}" loading="lazy">
                         @else
                             <div class="w-full h-full flex items-center justify-center text-gray-200">
                                 <i data-lucide="image" class="w-12 h-12"></i>
@@ -1,10 +1,10 @@
+import argparse
 import asyncio
 import os
 import datetime
 import re
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
 from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, or_
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
@@ -18,6 +18,11 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.browser import open_browser
+from common import profiling, query_stats, slow_pages
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -66,56 +71,56 @@ async def block_resources(route):
 async def process_category(context, cat_info, base_url, model_cache):
     """特定のカテゴリーページを解析して車種のカテゴリーを更新するタスク"""
     async with semaphore:
-        db = SessionLocal()
-        page = await context.new_page()
-        await page.route("**/*", block_resources)
+        with query_stats.stage("category"):
+            db = SessionLocal()
+            page = await context.new_page()
+            await page.route("**/*", block_resources)
 
-        target_url = f"{base_url}/bike/type/{cat_info['slug']}"
+            target_url = f"{base_url}/bike/type/{cat_info['slug']}"
         
-        try:
-            print(f"  [開始] {cat_info['name']}")
-            await page.goto(target_url, wait_until="domcontentloaded", timeout=60000)
-            
-            # 車種リストの描画を待機
             try:
-                await page.wait_for_selector(".c-search_name_block_text", timeout=10000)
-            except:
-                return
-
-            # ページ内の車種名ブロックを一括取得
-            name_elements = await page.query_selector_all(".c-search_name_block_text")
+                print(f"  [開始] {cat_info['name']}")
+                await slow_pages.goto(page, target_url, wait_until="domcontentloaded", timeout=60000)
+            
+                # 車種リストの描画を待機
+                try:
+                    await page.wait_for_selector(".c-search_name_block_text", timeout=10000)
+                except:
+                    return
+
+                # ページ内の車種名ブロックを一括取得
+                name_elements = await page.query_selector_all(".c-search_name_block_text")
             
-            update_count = 0
-            for name_el in name_elements:
-                full_text = (await name_el.inner_text()).strip()
-                model_name = re.sub(r'\s*[\(\uff08].*', '', full_text).strip()
+                update_count = 0
+                for name_el in name_elements:
+                    full_text = (await name_el.inner_text()).strip()
+                    model_name = re.sub(r'\s*[\(\uff08].*', '', full_text).strip()
                 
-                if not model_name:
-                    continue
+                    if not model_name:
+                        continue
 
-                # キャッシュから該当する車種IDリストを取得
-                targets = model_cache.get(model_name, [])
+                    # キャッシュから該当する車種IDリストを取得
+                    targets = model_cache.get(model_name, [])
                 
-                for t_id in targets:
-                    model_obj = db.query(BikeModel).get(t_id)
-                    if model_obj and (model_obj.category is None or model_obj.category == "不明"):
-                        model_obj.category = cat_info['name']
-                        update_count += 1
+                    for t_id in targets:
+                        model_obj = db.query(BikeModel).get(t_id)
+                        if model_obj and (model_obj.category is None or model_obj.category == "不明"):
+                            model_obj.category = cat_info['name']
+                            update_count += 1
             
-            db.commit()
-            if update_count > 0:
-                print(f"  [完了] {cat_info['name']}: {update_count}件更新")
-        except Exception as e:
-            print(f"  [エラー] {cat_info['name']}: {e}")
-            db.rollback()
-        finally:
-            db.close()
-            await page.close()
+                db.commit()
+                if update_count > 0:
+                    print(f"  [完了] {cat_info['name']}: {update_count}件更新")
+            except Exception as e:
+                print(f"  [エラー] {cat_info['name']}: {e}")
+                db.rollback()
+            finally:
+                db.close()
+                await page.close()
 
 async def collect():
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("BDSカテゴリー同期（セキュア版）を開始します...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -161,7 +166,16 @@ async def collect():
         await asyncio.gather(*tasks)
 
         print("\nBDSカテゴリー同期が完了しました。")
-        await browser.close()
+        await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BDS の車種カテゴリを収集する")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect())
\ No newline at end of file
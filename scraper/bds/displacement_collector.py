@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import os
 import datetime
@@ -5,7 +6,6 @@ import re
 import unicodedata
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
 from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, func, or_
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
@@ -19,6 +19,11 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.browser import open_browser
+from common import profiling, slow_pages
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -83,7 +88,7 @@ async def fetch_model_displacement(context, model_id, model_name, url):
         
         try:
             target_url = url if url.startswith('http') else f"https://www.bds-bikesensor.net{url if url.startswith('/') else '/' + url}"
-            await page.goto(target_url, wait_until="domcontentloaded", timeout=30000)
+            await slow_pages.goto(page, target_url, wait_until="domcontentloaded", timeout=30000)
             
             # 排気量情報の抽出
             status_cols = await page.query_selector_all(".c-search_status_col")
@@ -119,7 +124,7 @@ async def process_manufacturer(context, m_info, model_cache):
     print(f"\n--- {m_info['name']} の巡回開始 ---")
     
     try:
-        await page.goto(m_url, wait_until="domcontentloaded", timeout=60000)
+        await slow_pages.goto(page, m_url, wait_until="domcontentloaded", timeout=60000)
         model_items = await page.query_selector_all(".model_item")
         
         detail_tasks = []
@@ -147,9 +152,8 @@ async def process_manufacturer(context, m_info, model_cache):
         await page.close()
 
 async def collect():
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("BDS排気量コレクター（セキュア版）を起動しています...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -165,7 +169,7 @@ async def collect():
         
         if not model_cache:
             print("更新が必要な車種はありません。")
-            await browser.close()
+            await context.close()
             return
 
         maker_list = [
@@ -203,7 +207,16 @@ async def collect():
             await process_manufacturer(context, m, model_cache)
 
         print("\nすべての排気量同期が完了しました。")
-        await browser.close()
+        await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="排気量が未設定の車種を BDS の詳細ページから補完する")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect())
\ No newline at end of file
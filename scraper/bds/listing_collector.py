@@ -1,12 +1,11 @@
+import argparse
 import asyncio
 import os
 import datetime
-import re
 import random
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
-from sqlalchemy import create_engine, Column, BigInteger, String, Numeric, Integer, Boolean, Text, JSON, DateTime, ForeignKey, select, or_, update
+from sqlalchemy import create_engine, Column, BigInteger, String, Numeric, Integer, Boolean, Text, JSON, DateTime, ForeignKey, select, or_, update, bindparam
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
 # 1. 環境変数の読み込み
@@ -17,6 +16,15 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.listing_snapshot import ListingSnapshot, card_fingerprint, mark_sold_out, url_hash
+from common.crawl_state import CrawlState
+from common.model_signatures import DEFAULT_REFRESH_DAYS, ModelSignatures
+from common.parsers import bds as bds_parser
+from common import profiling, prom_metrics, run_metrics, tracing, slow_pages
+from common.browser import open_browser
+
 def get_env_or_exit(key, default=None, required=True):
     val = os.getenv(key, default)
     if required and val is None:
@@ -47,11 +55,13 @@ class Listing(Base):
     site_id = Column(BigInteger, nullable=False)
     title = Column(String(255), nullable=True)
     source_url = Column(Text, nullable=False)
+    url_hash = Column(String(40), nullable=True)
     price = Column(Numeric(12, 0))
     total_price = Column(Numeric(12, 0), nullable=True)
     model_year = Column(Integer, nullable=True)
     mileage = Column(Integer, nullable=True)
     image_urls = Column(JSON, nullable=True)
+    fingerprint = Column(String(40), nullable=True)
     is_sold_out = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.datetime.now)
     updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
@@ -75,6 +85,11 @@ class Site(Base):
     id = Column(BigInteger, primary_key=True)
     name = Column(String(50))
 
+class BikeModel(Base):
+    __tablename__ = "bike_models"
+    id = Column(BigInteger, primary_key=True)
+    displacement = Column(Integer, nullable=True)
+
 # 同時接続数を制限
 MAX_CONCURRENT_PAGES = 3
 semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
@@ -85,128 +100,138 @@ async def block_resources(route):
     else:
         await route.continue_()
 
-async def process_model_page(context, base_url, model_path, bike_model_id, site_id, shop_cache, known_urls, found_urls):
-    """車種ごとの出品一覧を解析。found_urls に見つけたURLを記録。"""
-    async with semaphore:
-        db = SessionLocal()
-        page = await context.new_page()
-        await page.route("**/*", block_resources)
+def apply_displacements(db, displacement_updates):
+    """収集した排気量を、未設定 (NULL または 0) の車種にだけまとめて反映する"""
+    if not displacement_updates:
+        return 0
+    table = BikeModel.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam('b_id'))
+        .where(or_(table.c.displacement == None, table.c.displacement == 0))
+        .values(displacement=bindparam('b_displacement'))
+    )
+    db.execute(stmt, [{"b_id": model_id, "b_displacement": disp} for model_id, disp in displacement_updates.items()])
+    return len(displacement_updates)
+
+async def process_model_page(context, entry, bike_model_id, site_id, shop_cache, known_urls, found_urls, displacement_targets, displacement_updates, snapshot, crawl, signatures):
+    """車種ごとの出品一覧を解析。found_urls に見つけたURLを記録。
+    既知の車両はカード内容の変化だけを snapshot に記録する。
+    排気量が未設定の車種であれば、カードのスペック欄から排気量も拾って displacement_updates に記録する。
+    次ページがあれば最後までたどり、全ページを処理できた場合は車種の完了を crawl に、在庫台数と先頭URLを signatures に記録し、True を返す。
+    在庫があるはずなのに車両カードが1件も取れなかったページは、取得失敗として扱う。"""
+    model_path = entry.url
+    with tracing.span("model_page", url=model_path, bike_model_id=bike_model_id) as unit:
+        async with tracing.acquire(semaphore, "model_pages"):
+            db = SessionLocal()
+            page = await context.new_page()
+            await page.route("**/*", block_resources)
         
-        target_url = model_path if model_path.startswith('http') else base_url + model_path
-        max_retries = 3
-        retry_count = 0
-        success = False
-
-        while retry_count < max_retries and not success:
-            try:
-                if retry_count > 0:
-                    wait = (retry_count * 3) + random.random()
-                    await asyncio.sleep(wait)
-
-                await page.goto(target_url, wait_until="domcontentloaded", timeout=60000)
-                success = True
-
-                bike_blocks = await page.query_selector_all("li.type_bike, li.type_bike_sp")
-                new_records = 0
-
-                for bike in bike_blocks:
-                    try:
-                        title_el = await bike.query_selector(".c-search_block_title a, .c-search_block_title02 a")
-                        if not title_el: continue
-                        
-                        v_url = base_url + (await title_el.get_attribute("href"))
+            target_url = model_path
+            max_retries = 3
+            retry_count = 0
+            success = False
+            completed = False
 
-                        # 今回の巡回で見つけたURLを記録（重要）
-                        found_urls.add(v_url)
+            while retry_count < max_retries and not success:
+                try:
+                    if retry_count > 0:
+                        run_metrics.count("retries")
+                        wait = (retry_count * 3) + random.random()
+                        await asyncio.sleep(wait)
+
+                    # 次ページがあれば最後までたどる（途中のページの出品を掲載終了と判定しないため）
+                    cards = []
+                    visited = set()
+                    next_url = target_url
+                    while next_url and next_url not in visited:
+                        visited.add(next_url)
+                        with tracing.span("fetch", url=next_url) as fetch_span:
+                            with prom_metrics.timed(prom_metrics.PAGE_FETCH_SECONDS, site="bds", page_type="model"):
+                                await slow_pages.goto(page, next_url, wait_until="domcontentloaded", timeout=60000)
+
+                            # 取得したHTMLは共通パーサー (common/parsers/bds.py) で解析する
+                            html = await page.content()
+                            fetch_span.set(bytes=len(html.encode("utf-8")))
+                        run_metrics.page_fetched(html)
+                        with tracing.span("parse") as parse_span:
+                            with prom_metrics.timed(prom_metrics.PARSE_SECONDS, site="bds", page_type="model"):
+                                listing_page = bds_parser.parse_listing_page(html, page.url)
+                            parse_span.set(cards=len(listing_page.cards))
+                        if not listing_page.cards and (cards or entry.stock_count):
+                            raise ValueError(f"在庫 {entry.stock_count} 台の車種で車両カードが見つかりません: {next_url}")
+                        cards.extend(listing_page.cards)
+                        next_url = listing_page.next_url
+                    # 全ページの解析が終わってから成功とする（解析の失敗は再試行する）
+                    success = True
+                    with tracing.span("persist") as persist_span:
+                        new_records = 0
+                        page_urls = set()
+
+                        for parsed in cards:
+                            try:
+                                v_url = parsed.url
+
+                                # 今回の巡回で見つけたURLを記録（重要）
+                                found_urls.add(v_url)
+                                page_urls.add(v_url)
+
+                                # 排気量の副次収集（既知の車両カードからも拾う）
+                                if bike_model_id in displacement_targets and parsed.displacement:
+                                    displacement_updates[bike_model_id] = parsed.displacement
+                                    displacement_targets.discard(bike_model_id)
+
+                                card = parsed.to_card(shop_cache.get(parsed.shop_identifier))
+
+                                # 既知の車両はカード内容の変化（価格履歴・フィンガープリント）だけを記録してスキップ
+                                if v_url in known_urls:
+                                    snapshot.observe(v_url, card)
+                                    continue
+
+                                # 新規登録
+                                new_listing = Listing(
+                                    bike_model_id=bike_model_id,
+                                    site_id=site_id,
+                                    source_url=v_url,
+                                    url_hash=url_hash(v_url),
+                                    fingerprint=card_fingerprint(card),
+                                    is_sold_out=False,
+                                    **card
+                                )
+                                db.add(new_listing)
+                                db.commit()
+                                known_urls.add(v_url)
+                                snapshot.track(v_url, new_listing.id, card)
+                                new_records += 1
 
-                        if v_url in known_urls:
-                            continue
+                            except Exception:
+                                db.rollback()
 
-                        v_title = (await title_el.inner_text()).strip()
-
-                        # 価格取得
-                        price_val, total_price_val = 0, None
-                        price_items = await bike.query_selector_all(".c-search_block_price")
-                        for p_item in price_items:
-                            label = await p_item.query_selector(".c-search_block_price_title")
-                            value = await p_item.query_selector(".c-search_block_price_text")
-                            if label and value:
-                                l_text = await label.inner_text()
-                                v_text = (await value.inner_text()).replace(',', '').replace('\n', '').strip()
-                                match = re.search(r'(\d+\.?\d*)', v_text)
-                                if match:
-                                    num = int(float(match.group(1)) * 10000)
-                                    if "本体価格" in l_text: price_val = num
-                                    elif "支払総額" in l_text: total_price_val = num
-
-                        # スペック取得
-                        year, mile = None, None
-                        status_cols = await bike.query_selector_all(".c-search_status_col")
-                        for col in status_cols:
-                            h_el = await col.query_selector(".c-search_status_head")
-                            v_el = await col.query_selector(".c-search_status_title01")
-                            if h_el and v_el:
-                                h_txt = await h_el.inner_text()
-                                v_txt = await v_el.inner_text()
-                                if "モデル年" in h_txt and "不明" not in v_txt:
-                                    y_m = re.search(r'(\d{4})', v_txt)
-                                    if y_m: year = int(y_m.group(1))
-                                elif "距離" in h_txt:
-                                    m_m = re.search(r'(\d+)', v_txt.replace(',', ''))
-                                    if m_m: mile = int(m_m.group(1))
-
-                        # 画像取得処理
-                        images = []
-                        img_el = await bike.query_selector(".c-bike_image figure.c-img_cover")
-                        if img_el:
-                            img_src = await img_el.get_attribute("data-src") or await img_el.get_attribute("src")
-                            if img_src and "blank" not in img_src:
-                                images.append(img_src)
-
-                        # 販売店特定
-                        shop_id = None
-                        shop_detail_link_el = await bike.query_selector(".c-search_block_bottom_lead a")
-                        if shop_detail_link_el:
-                            shop_href = await shop_detail_link_el.get_attribute("href")
-                            id_match = re.search(r'client/(\d+)', shop_href)
-                            if id_match:
-                                shop_id = shop_cache.get(id_match.group(1))
-
-                        # 保存
-                        new_listing = Listing(
-                            bike_model_id=bike_model_id,
-                            shop_id=shop_id,
-                            site_id=site_id,
-                            title=v_title,
-                            source_url=v_url,
-                            price=price_val,
-                            total_price=total_price_val,
-                            model_year=year,
-                            mileage=mile,
-                            image_urls=images,
-                            is_sold_out=False
-                        )
-                        db.add(new_listing)
-                        db.commit()
-                        known_urls.add(v_url)
-                        new_records += 1
-
-                    except Exception:
-                        db.rollback()
-
-                if new_records > 0:
-                    print(f"    [完了] {model_path}: {new_records}件の新着を登録")
-
-            except Exception as e:
-                retry_count += 1
-                if retry_count == max_retries:
-                    print(f"    [エラー] 車種ページ取得失敗 ({model_path}): {e}")
-            finally:
-                if success or retry_count == max_retries:
-                    db.close()
-                    await page.close()
-
-async def collect():
+                        if new_records > 0:
+                            print(f"    [完了] {model_path}: {new_records}件の新着を登録")
+
+                        # 車種の完了を記録。価格履歴と変更された出品の更新は、バッチサイズに達した時点でまとめて書き込む
+                        crawl.mark_done("model", model_path, page_urls)
+                        crawl.checkpoint(db, snapshot)
+                        signatures.record(entry, cards[0].url if cards else None)
+                        persist_span.set(rows=new_records)
+                    completed = True
+
+                except Exception as e:
+                    retry_count += 1
+                    unit.set(retries=retry_count)
+                    if retry_count == max_retries:
+                        print(f"    [エラー] 車種ページ取得失敗 ({model_path}): {e}")
+                        run_metrics.count("errors")
+                        unit.set(error=f"{type(e).__name__}: {e}")
+                finally:
+                    if success or retry_count == max_retries:
+                        db.close()
+                        await page.close()
+
+            return completed
+
+async def collect(resume=False, run_id=None, incremental=False, refresh_days=DEFAULT_REFRESH_DAYS):
     db = SessionLocal()
     site = db.query(Site).filter(Site.name == "BDS").first()
     if not site:
@@ -219,18 +244,40 @@ async def collect():
     model_ident_cache = {i.identifier: i.bike_model_id for i in db.query(BikeModelIdentifier).filter(BikeModelIdentifier.site_id == site_id).all()}
     shop_cache = {i.identifier: i.shop_id for i in db.query(ShopIdentifier).filter(ShopIdentifier.site_id == site_id).all()}
     
-    # DBにある「販売中」のBDS車両URLをすべて取得
-    known_urls = {l.source_url for l in db.query(Listing.source_url).filter(Listing.site_id == site_id, Listing.is_sold_out == False).all()}
+    # DBにある「販売中」のBDS車両URLとスナップショットをすべて取得
+    snapshot = ListingSnapshot(site_id)
+    known_urls = snapshot.load(db)
     
-    # 今回の巡回で見つけたURLを保存するセット
-    found_urls_in_this_run = set()
+    # 巡回の進捗（--resume 時は前回の未完了の巡回を引き継ぐ）
+    crawl = CrawlState(site_id, "bds/listing_collector")
+    crawl.start(db, resume=resume, run_id=run_id)
+    if crawl.resumed:
+        print(f"巡回 #{crawl.run_id} を再開します（完了済み {len(crawl.done)} 単位、引き継いだURL {len(crawl.found_urls)} 件）。")
+    else:
+        print(f"巡回 #{crawl.run_id} を開始します。")
+
+    # 今回の巡回で見つけたURLを保存するセット（再開時は完了済みの単位で見つかったURLを含む）
+    found_urls_in_this_run = set(crawl.found_urls)
+
+    # 車種ごとの在庫台数と先頭URL（差分巡回時は台数が変わらない車種を飛ばす）
+    signatures = ModelSignatures(site_id, refresh_days=refresh_days)
+    signatures.load(db)
+    if incremental:
+        print(f"差分巡回: 在庫台数が前回と同じ車種を飛ばします（{refresh_days}日ごとに再巡回）。")
+
+    # 排気量が未設定の車種（一覧カードから補完し、排気量コレクターの巡回対象から外す）
+    displacement_targets = {
+        m.id for m in db.query(BikeModel.id).filter(
+            or_(BikeModel.displacement == None, BikeModel.displacement == 0)
+        ).all()
+    }
+    displacement_updates = {}
     
     print(f"既知の販売中車両を {len(known_urls)} 件ロードしました。")
     db.close()
 
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("BDSリスティングコレクター（完売判定機能付き）を起動しています...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -270,6 +317,10 @@ async def collect():
 
         try:
             for m in maker_list:
+                # 前回の巡回で完了済みのメーカーは飛ばす
+                if crawl.is_done("maker", m['slug']):
+                    continue
+
                 m_url = f"{base_url}/bike/maker/{m['slug']}"
                 print(f"\n--- {m['name']} の出品情報をスキャン中 ---")
                 
@@ -277,64 +328,103 @@ async def collect():
                 await temp_page.route("**/*", block_resources)
                 
                 try:
-                    await temp_page.goto(m_url, wait_until="domcontentloaded", timeout=60000)
-                    model_items = await temp_page.query_selector_all(".model_item")
+                    with prom_metrics.timed(prom_metrics.PAGE_FETCH_SECONDS, site="bds", page_type="maker"):
+                        await slow_pages.goto(temp_page, m_url, wait_until="domcontentloaded", timeout=60000)
+                    # 車種一覧 (.model_item) と在庫台数は共通パーサーで解析する
+                    maker_html = await temp_page.content()
+                    run_metrics.page_fetched(maker_html)
+                    with prom_metrics.timed(prom_metrics.PARSE_SECONDS, site="bds", page_type="maker"):
+                        model_entries = bds_parser.parse_maker_page(maker_html, temp_page.url)
                     
                     process_tasks = []
-                    for item in model_items:
-                        m_input = await item.query_selector("input.model-checkbox")
-                        identifier = await m_input.get_attribute("value") if m_input else None
-                        m_link = await item.query_selector("a.c-bike_image")
-                        href = await m_link.get_attribute("href") if m_link else None
-                        
-                        if identifier and href:
-                            bike_model_id = model_ident_cache.get(identifier)
-                            if bike_model_id:
-                                process_tasks.append(
-                                    process_model_page(context, base_url, href, bike_model_id, site_id, shop_cache, known_urls, found_urls_in_this_run)
-                                )
+                    task_model_ids = []
+                    for entry in model_entries:
+                        bike_model_id = model_ident_cache.get(entry.identifier)
+                        if not bike_model_id or crawl.is_done("model", entry.url):
+                            continue
 
-                    if process_tasks:
-                        await asyncio.gather(*process_tasks)
+                        # 差分巡回: 在庫台数が前回と同じ車種は一覧ページを開かない（排気量を補完したい車種は除く）
+                        # 飛ばした車種は掲載終了判定の対象からも外れる
+                        if incremental and bike_model_id not in displacement_targets and signatures.is_unchanged(entry):
+                            continue
+
+                        task_model_ids.append(bike_model_id)
+                        process_tasks.append(
+                            process_model_page(context, entry, bike_model_id, site_id, shop_cache, known_urls, found_urls_in_this_run, displacement_targets, displacement_updates, snapshot, crawl, signatures)
+                        )
+
+                    results = await asyncio.gather(*process_tasks) if process_tasks else []
+
+                    # 車種ごとの成否を記録し、掲載終了判定の対象を最後まで巡回できた車種に絞る
+                    for bike_model_id, ok in zip(task_model_ids, results):
+                        crawl.model_crawled(bike_model_id, ok)
+
+                    # すべての車種を処理できたメーカーだけを完了とする（失敗した車種は再開時にやり直す）
+                    if all(results):
+                        crawl.mark_done("maker", m['slug'])
+                        db = SessionLocal()
+                        crawl.checkpoint(db, snapshot)
+                        db.close()
                         
                 except Exception as e:
                     print(f"  メーカーページ巡回エラー ({m['name']}): {e}")
+                    run_metrics.count("errors")
                 finally:
                     await temp_page.close()
                     await asyncio.sleep(random.uniform(1, 2))
 
+            db = SessionLocal()
+
+            # --- 価格履歴・変更された出品の書き込み ---
+            snapshot.flush(db)
+            crawl.flush(db)
+            print(f"\n{snapshot.recorded_count} 件の価格変化を履歴に記録し、{snapshot.updated_count} 件の変更された出品を更新しました。")
+
+            # --- 車種シグネチャの保存（価格変化の書き込み後に保存し、中断時に飛ばされる車種が出ないようにする） ---
+            signatures.flush(db)
+            if incremental:
+                print(f"差分巡回: {signatures.skipped_count} 車種の一覧ページを省略しました"
+                      f"（台数が同じまま先頭の出品が入れ替わっていた車種: {signatures.silent_change_count}）。")
+
+            # --- 排気量の一括反映 ---
+            if displacement_updates:
+                updated = apply_displacements(db, displacement_updates)
+                db.commit()
+                print(f"\n一覧カードから {updated} 車種の排気量を補完しました。")
+
             # --- 掲載終了（完売）判定フェーズ ---
             print("\n掲載終了車両の判定を行っています...")
-            db = SessionLocal()
             
-            # DBにあって、今回の巡回で見つからなかったURLを特定
-            missing_urls = known_urls - found_urls_in_this_run
+            # 一覧ページを最後まで巡回できた車種に限り、DBにあって今回見つからなかった出品を掲載終了にする
+            # ※ 取得に失敗したメーカー・車種や、差分巡回で飛ばした車種の出品には触れない
+            scope = crawl.reconciliation_scope()
+            print(f"  対象: {len(scope)} 車種（取得失敗で対象外: {len(crawl.failed_models)} 車種）")
+            total_updated = mark_sold_out(db, site_id, scope, found_urls_in_this_run)
             
-            if missing_urls:
-                missing_list = list(missing_urls)
-                chunk_size = 100
-                total_updated = 0
-                
-                for i in range(0, len(missing_list), chunk_size):
-                    chunk = missing_list[i:i + chunk_size]
-                    db.execute(
-                        update(Listing)
-                        .where(Listing.source_url.in_(chunk))
-                        .where(Listing.site_id == site_id)
-                        .values(is_sold_out=True, updated_at=datetime.datetime.now())
-                    )
-                    total_updated += len(chunk)
-                
-                db.commit()
+            if total_updated:
                 print(f"  -> {total_updated} 件の車両を「掲載終了（完売）」として更新しました。")
             else:
                 print("  -> 掲載終了した車両はありませんでした。")
 
+            crawl.finish(db)
             print("\nBDS出品情報の同期が完了しました。")
             db.close()
 
         finally:
-            await browser.close()
+            await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BDS の出品情報を収集し、掲載終了を判定する")
+    parser.add_argument("--resume", action="store_true", help="直近の未完了の巡回を再開する（完了済みのメーカー・車種を飛ばす）")
+    parser.add_argument("--run-id", type=int, help="再開する巡回ID (crawl_runs.id)")
+    parser.add_argument("--incremental", action="store_true", help="メーカーページの在庫台数が前回と同じ車種の一覧ページを飛ばす")
+    parser.add_argument("--refresh-days", type=int, default=DEFAULT_REFRESH_DAYS, help="差分巡回でも、この日数が経った車種は一覧ページを開き直す")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect(resume=args.resume, run_id=args.run_id, incremental=args.incremental, refresh_days=args.refresh_days))
\ No newline at end of file
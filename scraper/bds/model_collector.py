@@ -1,10 +1,10 @@
+import argparse
 import asyncio
 import os
 import datetime
 import re
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
 from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, ForeignKey, UniqueConstraint, or_
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 from sqlalchemy.exc import IntegrityError
@@ -19,6 +19,11 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.browser import open_browser
+from common import profiling, query_stats, slow_pages
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -92,86 +97,86 @@ async def block_resources(route):
 async def process_maker(context, target, site_id, existing_models, manufacturer_cache):
     """1つのメーカーの車種情報を収集するタスク"""
     async with semaphore:
-        db = SessionLocal()
-        page = await context.new_page()
-        await page.route("**/*", block_resources)
+        with query_stats.stage("maker_models"):
+            db = SessionLocal()
+            page = await context.new_page()
+            await page.route("**/*", block_resources)
 
-        try:
-            print(f"  [開始] {target['name']}")
-            await page.goto(target['url'], wait_until="domcontentloaded", timeout=60000)
+            try:
+                print(f"  [開始] {target['name']}")
+                await slow_pages.goto(page, target['url'], wait_until="domcontentloaded", timeout=60000)
             
-            # 車種ブロックの取得
-            model_blocks = await page.query_selector_all(".model_item")
-            m_record_id = manufacturer_cache.get(target['name'])
+                # 車種ブロックの取得
+                model_blocks = await page.query_selector_all(".model_item")
+                m_record_id = manufacturer_cache.get(target['name'])
             
-            if not m_record_id:
-                return
+                if not m_record_id:
+                    return
 
-            new_models_count = 0
-            for block in model_blocks:
-                m_input = await block.query_selector("input.model-checkbox")
-                identifier_val = await m_input.get_attribute("value") if m_input else None
-                m_link = await block.query_selector("a.c-bike_image")
-                model_name = (await m_link.get_attribute("title") if m_link else "").strip()
+                new_models_count = 0
+                for block in model_blocks:
+                    m_input = await block.query_selector("input.model-checkbox")
+                    identifier_val = await m_input.get_attribute("value") if m_input else None
+                    m_link = await block.query_selector("a.c-bike_image")
+                    model_name = (await m_link.get_attribute("title") if m_link else "").strip()
 
-                if not model_name or not identifier_val: continue
+                    if not model_name or not identifier_val: continue
 
-                # キャッシュで重複チェック
-                model_id = existing_models.get(model_name)
+                    # キャッシュで重複チェック
+                    model_id = existing_models.get(model_name)
                 
-                if not model_id:
-                    db_model = db.query(BikeModel).filter(BikeModel.name == model_name).first()
-                    if db_model:
-                        model_id = db_model.id
-                        existing_models[model_name] = model_id
-                    else:
-                        try:
-                            new_model = BikeModel(
-                                name=model_name,
-                                manufacturer_id=m_record_id,
-                                category="不明",
-                                displacement=None
-                            )
-                            db.add(new_model)
-                            db.flush()
-                            model_id = new_model.id
+                    if not model_id:
+                        db_model = db.query(BikeModel).filter(BikeModel.name == model_name).first()
+                        if db_model:
+                            model_id = db_model.id
                             existing_models[model_name] = model_id
-                            new_models_count += 1
-                        except IntegrityError:
-                            db.rollback()
-                            db_model = db.query(BikeModel).filter(BikeModel.name == model_name).first()
-                            if db_model:
-                                model_id = db_model.id
+                        else:
+                            try:
+                                new_model = BikeModel(
+                                    name=model_name,
+                                    manufacturer_id=m_record_id,
+                                    category="不明",
+                                    displacement=None
+                                )
+                                db.add(new_model)
+                                db.flush()
+                                model_id = new_model.id
                                 existing_models[model_name] = model_id
+                                new_models_count += 1
+                            except IntegrityError:
+                                db.rollback()
+                                db_model = db.query(BikeModel).filter(BikeModel.name == model_name).first()
+                                if db_model:
+                                    model_id = db_model.id
+                                    existing_models[model_name] = model_id
 
-                # 識別番号の登録
-                if model_id and identifier_val:
-                    exists = db.query(BikeModelIdentifier).filter(
-                        BikeModelIdentifier.site_id == site_id,
-                        BikeModelIdentifier.identifier == identifier_val
-                    ).first()
+                    # 識別番号の登録
+                    if model_id and identifier_val:
+                        exists = db.query(BikeModelIdentifier).filter(
+                            BikeModelIdentifier.site_id == site_id,
+                            BikeModelIdentifier.identifier == identifier_val
+                        ).first()
                     
-                    if not exists:
-                        db.add(BikeModelIdentifier(
-                            bike_model_id=model_id,
-                            site_id=site_id,
-                            identifier=identifier_val
-                        ))
+                        if not exists:
+                            db.add(BikeModelIdentifier(
+                                bike_model_id=model_id,
+                                site_id=site_id,
+                                identifier=identifier_val
+                            ))
             
-            db.commit()
-            if new_models_count > 0:
-                print(f"  [完了] {target['name']}: {new_models_count}件の新車種を登録")
-        except Exception as e:
-            print(f"  [エラー] {target['name']}: {e}")
-            db.rollback()
-        finally:
-            db.close()
-            await page.close()
+                db.commit()
+                if new_models_count > 0:
+                    print(f"  [完了] {target['name']}: {new_models_count}件の新車種を登録")
+            except Exception as e:
+                print(f"  [エラー] {target['name']}: {e}")
+                db.rollback()
+            finally:
+                db.close()
+                await page.close()
 
 async def collect():
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("BDSモデルコレクター（セキュア・並列版）を起動しています...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -219,33 +224,34 @@ async def collect():
         ]
 
         maker_targets = []
-        for m in maker_list_raw:
-            m_id = manufacturer_cache.get(m['name'])
+        with query_stats.stage("makers"):
+            for m in maker_list_raw:
+                m_id = manufacturer_cache.get(m['name'])
             
-            if not m_id:
-                m_record = db.query(Manufacturer).filter(Manufacturer.name == m['name']).first()
-                if m_record:
-                    m_id = m_record.id
-                    manufacturer_cache[m['name']] = m_id
-                else:
-                    try:
-                        m_record = Manufacturer(name=m['name'])
-                        db.add(m_record)
-                        db.flush()
+                if not m_id:
+                    m_record = db.query(Manufacturer).filter(Manufacturer.name == m['name']).first()
+                    if m_record:
                         m_id = m_record.id
                         manufacturer_cache[m['name']] = m_id
-                    except IntegrityError:
-                        db.rollback()
-                        m_record = db.query(Manufacturer).filter(Manufacturer.name == m['name']).first()
-                        if m_record:
+                    else:
+                        try:
+                            m_record = Manufacturer(name=m['name'])
+                            db.add(m_record)
+                            db.flush()
                             m_id = m_record.id
                             manufacturer_cache[m['name']] = m_id
+                        except IntegrityError:
+                            db.rollback()
+                            m_record = db.query(Manufacturer).filter(Manufacturer.name == m['name']).first()
+                            if m_record:
+                                m_id = m_record.id
+                                manufacturer_cache[m['name']] = m_id
             
-            if m_id:
-                maker_targets.append({
-                    "name": m['name'],
-                    "url": f"https://www.bds-bikesensor.net/bike/maker/{m['slug']}"
-                })
+                if m_id:
+                    maker_targets.append({
+                        "name": m['name'],
+                        "url": f"https://www.bds-bikesensor.net/bike/maker/{m['slug']}"
+                    })
         
         db.commit()
 
@@ -259,7 +265,16 @@ async def collect():
 
         print("\nすべての同期が完了しました。")
         db.close()
-        await browser.close()
+        await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BDS のメーカー・車種マスタを収集する")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect())
\ No newline at end of file
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import os
 import datetime
@@ -6,10 +7,9 @@ import unicodedata
 import random
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
-from sqlalchemy import create_engine, Column, BigInteger, String, Text, DateTime, ForeignKey, UniqueConstraint, or_
+from sqlalchemy import create_engine, Column, BigInteger, String, Text, DateTime, ForeignKey, UniqueConstraint, or_, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
-from sqlalchemy.exc import IntegrityError
 
 # 1. 環境変数の読み込み
 # 現在のファイル位置 (scraper/bds/) から見て、2つ上の階層 (scraper/) にある .env を探す
@@ -21,6 +21,11 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.browser import open_browser
+from common import profiling, query_stats, slow_pages
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -110,127 +115,150 @@ async def block_resources(route):
     else:
         await route.continue_()
 
+def flush_shop_page(db, site_id, pending_shops, pending_idents, shop_cache, ident_cache):
+    """
+    1ページ分の新規店舗と識別番号を、複数行の upsert でまとめて書き込む。
+    店舗は一意な住所、識別番号は (site_id, identifier) をキーとし、既存行はそのまま残す。
+    """
+    resolved = {}
+    if pending_shops:
+        shop_table = Shop.__table__
+        stmt = mysql_insert(shop_table).values(list(pending_shops.values()))
+        # shops は店名・住所のどちらも一意のため、店名で衝突した場合に住所を書き換えないよう何も更新しない
+        db.execute(stmt.on_duplicate_key_update(id=shop_table.c.id))
+
+        # 新規・既存（他の都道府県タスクが先に登録した店舗を含む）を問わず、住所から店舗IDを一括で解決
+        resolved = dict(db.execute(
+            select(shop_table.c.address, shop_table.c.id).where(shop_table.c.address.in_(list(pending_shops)))
+        ).all())
+        for address, row in pending_shops.items():
+            shop_id = resolved.get(address)
+            if shop_id:
+                shop_cache.setdefault(normalize_text(row['name']), []).append((normalize_text(address), address, shop_id))
+
+    ident_rows = {}
+    for identifier, shop_id, address in pending_idents:
+        shop_id = shop_id or resolved.get(address)
+        if shop_id and (site_id, identifier) not in ident_cache:
+            ident_rows.setdefault(identifier, {"shop_id": shop_id, "site_id": site_id, "identifier": identifier})
+
+    if ident_rows:
+        ident_table = ShopIdentifier.__table__
+        stmt = mysql_insert(ident_table).values(list(ident_rows.values()))
+        db.execute(stmt.on_duplicate_key_update(shop_id=ident_table.c.shop_id))
+
+    db.commit()
+    ident_cache.update((site_id, identifier) for identifier in ident_rows)
+    return len(resolved), len(ident_rows)
+
 async def process_prefecture(context, code, pref_name, site_id, shop_cache, ident_cache):
     """1つの都道府県の店舗情報を並列で収集するタスク"""
     async with semaphore:
-        db = SessionLocal()
-        page = await context.new_page()
-        await page.route("**/*", block_resources)
+        with query_stats.stage("prefecture"):
+            db = SessionLocal()
+            page = await context.new_page()
+            await page.route("**/*", block_resources)
 
-        base_url = "https://www.bds-bikesensor.net"
-        current_url = f"{base_url}/shop?prefectureCodes%5B%5D={code}"
+            base_url = "https://www.bds-bikesensor.net"
+            current_url = f"{base_url}/shop?prefectureCodes%5B%5D={code}"
         
-        try:
-            print(f"  [開始] {pref_name}")
-            while current_url:
-                await page.goto(current_url, wait_until="domcontentloaded", timeout=60000)
-                shop_items = await page.query_selector_all("li.c-search_block_list_item.type_shop")
+            try:
+                print(f"  [開始] {pref_name}")
+                while current_url:
+                    await slow_pages.goto(page, current_url, wait_until="domcontentloaded", timeout=60000)
+                    shop_items = await page.query_selector_all("li.c-search_block_list_item.type_shop")
                 
-                if not shop_items:
-                    break
-
-                for item in shop_items:
-                    try:
-                        # 店名取得
-                        name_el = await item.query_selector(".c-search_block_shop_title01 a")
-                        if not name_el: continue
-                        raw_name = (await name_el.inner_text()).strip()
-                        href = await name_el.get_attribute("href")
-                        
-                        identifier = None
-                        if href:
-                            match = re.search(r'client/(\d+)', href)
-                            if match: identifier = match.group(1)
-
-                        # 住所と電話番号の取得
-                        address = ""
-                        phone = ""
-                        table_rows = await item.query_selector_all(".c-search_block_shop-info_table table tr")
-                        for row in table_rows:
-                            th = await row.query_selector("th")
-                            td = await row.query_selector("td")
-                            if th and td:
-                                header = await th.inner_text()
-                                if "住所" in header:
-                                    address = (await td.inner_text()).strip()
-                                elif "電話番号" in header:
-                                    phone = (await td.inner_text()).strip()
-
-                        if not raw_name or not address: continue
-
-                        # --- 表記ゆれ対策: 高度な正規化 ---
-                        norm_name = normalize_text(raw_name)
-                        norm_address = normalize_text(address)
-
-                        shop_id = None
+                    if not shop_items:
+                        break
+
+                    # ページ単位で書き込む新規店舗（住所 -> 行）と識別番号（識別番号, 店舗ID, 住所）
+                    pending_shops = {}
+                    pending_idents = []
+
+                    for item in shop_items:
+                        try:
+                            # 店名取得
+                            name_el = await item.query_selector(".c-search_block_shop_title01 a")
+                            if not name_el: continue
+                            raw_name = (await name_el.inner_text()).strip()
+                            href = await name_el.get_attribute("href")
                         
-                        # 1. キャッシュから店名が一致する既存店を探す
-                        candidates = shop_cache.get(norm_name, [])
-                        for cached_norm_addr, cached_real_addr, cached_id in candidates:
-                            # 住所が「どちらか一方がもう一方を含む」なら同一店とみなす
-                            if norm_address in cached_norm_addr or cached_norm_addr in norm_address:
-                                shop_id = cached_id
-                                break
-
-                        # 2. それでもない場合は新規登録
-                        if not shop_id:
-                            try:
-                                shop_record = Shop(
-                                    name=raw_name,
-                                    prefecture=pref_name,
-                                    address=address,
-                                    phone=phone,
-                                    website_url=(href if href.startswith('http') else base_url + href) if href else None
-                                )
-                                db.add(shop_record)
-                                db.flush()
-                                shop_id = shop_record.id
-                                
-                                # キャッシュに追加
-                                if norm_name not in shop_cache:
-                                    shop_cache[norm_name] = []
-                                shop_cache[norm_name].append((norm_address, address, shop_id))
-                                
-                            except IntegrityError:
-                                db.rollback()
-                                db_shop = db.query(Shop).filter(Shop.address == address).first()
-                                if db_shop:
-                                    shop_id = db_shop.id
-
-                        # 3. 識別番号の登録
-                        if shop_id and identifier:
-                            if (site_id, identifier) not in ident_cache:
-                                try:
-                                    db.add(ShopIdentifier(shop_id=shop_id, site_id=site_id, identifier=identifier))
-                                    db.commit()
-                                    ident_cache.add((site_id, identifier))
-                                except IntegrityError:
-                                    db.rollback()
+                            identifier = None
+                            if href:
+                                match = re.search(r'client/(\d+)', href)
+                                if match: identifier = match.group(1)
+
+                            # 住所と電話番号の取得
+                            address = ""
+                            phone = ""
+                            table_rows = await item.query_selector_all(".c-search_block_shop-info_table table tr")
+                            for row in table_rows:
+                                th = await row.query_selector("th")
+                                td = await row.query_selector("td")
+                                if th and td:
+                                    header = await th.inner_text()
+                                    if "住所" in header:
+                                        address = (await td.inner_text()).strip()
+                                    elif "電話番号" in header:
+                                        phone = (await td.inner_text()).strip()
+
+                            if not raw_name or not address: continue
+
+                            # --- 表記ゆれ対策: 高度な正規化 ---
+                            norm_name = normalize_text(raw_name)
+                            norm_address = normalize_text(address)
+
+                            shop_id = None
                         
-                        db.commit()
+                            # 1. キャッシュから店名が一致する既存店を探す
+                            candidates = shop_cache.get(norm_name, [])
+                            for cached_norm_addr, cached_real_addr, cached_id in candidates:
+                                # 住所が「どちらか一方がもう一方を含む」なら同一店とみなす
+                                if norm_address in cached_norm_addr or cached_norm_addr in norm_address:
+                                    shop_id = cached_id
+                                    break
+
+                            # 2. それでもない場合はページ単位の新規登録候補に追加
+                            if not shop_id and address not in pending_shops:
+                                pending_shops[address] = {
+                                    "name": raw_name,
+                                    "prefecture": pref_name,
+                                    "address": address,
+                                    "phone": phone,
+                                    "website_url": (href if href.startswith('http') else base_url + href) if href else None,
+                                }
+
+                            # 3. 識別番号の登録候補（新規店舗の場合は書き込み時に住所から店舗IDを解決）
+                            if identifier and (site_id, identifier) not in ident_cache:
+                                pending_idents.append((identifier, shop_id, address))
+                        except Exception as e:
+                            print(f"      解析エラー: {e}")
+
+                    # 4. ページ分をまとめて書き込み
+                    try:
+                        flush_shop_page(db, site_id, pending_shops, pending_idents, shop_cache, ident_cache)
                     except Exception as e:
                         db.rollback()
-                        print(f"      解析エラー: {e}")
-
-                # ページネーション処理
-                next_btn = await page.query_selector("div.c-pager a.c-btn_next")
-                if next_btn:
-                    href = await next_btn.get_attribute("href")
-                    current_url = href if href.startswith('http') else base_url + (href if href.startswith('/') else '/' + href)
-                    await asyncio.sleep(0.5)
-                else:
-                    current_url = None
-
-        except Exception as e:
-            print(f"  [エラー] {pref_name}: {e}")
-        finally:
-            db.close()
-            await page.close()
+                        print(f"      書き込みエラー ({pref_name}): {e}")
+
+                    # ページネーション処理
+                    next_btn = await page.query_selector("div.c-pager a.c-btn_next")
+                    if next_btn:
+                        href = await next_btn.get_attribute("href")
+                        current_url = href if href.startswith('http') else base_url + (href if href.startswith('/') else '/' + href)
+                        await asyncio.sleep(0.5)
+                    else:
+                        current_url = None
+
+            except Exception as e:
+                print(f"  [エラー] {pref_name}: {e}")
+            finally:
+                db.close()
+                await page.close()
 
 async def collect():
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("BDSショップコレクター（セキュア版）を起動しています...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
             viewport={'width': 1280, 'height': 800}
@@ -273,7 +301,16 @@ async def collect():
         await asyncio.gather(*tasks)
 
         print("\nBDS販売店データの全件収集が完了しました。")
-        await browser.close()
+        await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BDS の販売店情報を収集する")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect())
\ No newline at end of file
@@ -1,10 +1,18 @@
+import argparse
 import os
 import re
+import sys
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime
+from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, bindparam, or_, select, update
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from common import profiling
+
 # 環境変数の読み込み
 load_dotenv()
 if not os.getenv("DB_DATABASE"):
@@ -30,6 +38,13 @@ class BikeModel(Base):
     name = Column(String(255), nullable=False)
     displacement = Column(Integer, nullable=True)
 
+# 抽出用の正規表現はモジュール読み込み時に一度だけコンパイルする（プロセスプールの各ワーカーでも再利用）
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# ストリーミングモードの既定値
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_WORKERS = os.cpu_count() or 1
+
 def normalize_text(text):
     """全角英数字を半角に変換する"""
     if not text:
@@ -40,7 +55,7 @@ def extract_displacement(name):
     """名前から50以上の数値を抽出する"""
     normalized_name = normalize_text(name)
     # 文字列内の数値をすべて抽出
-    numbers = re.findall(r'\d+', normalized_name)
+    numbers = NUMBER_PATTERN.findall(normalized_name)
     
     for num_str in numbers:
         num = int(num_str)
@@ -81,5 +96,101 @@ def fix_displacements():
     finally:
         db.close()
 
+def extract_displacements(rows):
+    """(id, name, 現在の排気量) のリストから排気量を抽出し、値が得られた (id, name, 旧値, 排気量) だけを返す（ワーカープロセス用）"""
+    results = []
+    for model_id, name, current_val in rows:
+        suggested_val = extract_displacement(name)
+        if suggested_val:
+            results.append((model_id, name, current_val, suggested_val))
+    return results
+
+def iter_target_chunks(chunk_size):
+    """displacement が NULL または 0 の車種を (id, name, displacement) だけ id 順に chunk_size 件ずつ読み出す"""
+    table = BikeModel.__table__
+    last_id = 0
+    while True:
+        # チャンクごとに接続を取り直し、1つのセッションに全件を抱え込まない
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.name, table.c.displacement)
+                .where(or_(table.c.displacement == None, table.c.displacement == 0))
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(chunk_size)
+            ).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [(r[0], r[1], r[2]) for r in rows]
+
+def fix_displacements_streaming(chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS, dry_run=False, report_path=None):
+    """
+    チャンク単位で排気量を補完するストリーミングモード。
+    (id, name, displacement) だけを読み出し、抽出はプロセスプールで並列に行い、チャンクごとに一括 UPDATE する。
+    dry_run=True の場合は更新せず、差分レポート (id, 車種名, 旧値 -> 新値) だけを出力する。
+    """
+    table = BikeModel.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam('b_id'))
+        .where(or_(table.c.displacement == None, table.c.displacement == 0))
+        .values(displacement=bindparam('b_displacement'))
+    )
+
+    report = open(report_path, "w", encoding="utf-8") if report_path else sys.stdout
+    mode = "ドライラン" if dry_run else "更新"
+    print(f"車種名からの排気量補完プロセスを開始します（ストリーミング/{mode}モード, チャンク {chunk_size} 件, {workers} ワーカー）...")
+
+    scanned_count = 0
+    updated_count = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk in iter_target_chunks(chunk_size):
+                scanned_count += len(chunk)
+
+                # チャンクをワーカー数に分割して並列抽出
+                step = max(1, -(-len(chunk) // workers))
+                parts = [chunk[i:i + step] for i in range(0, len(chunk), step)]
+                results = [r for part in executor.map(extract_displacements, parts) for r in part]
+
+                if dry_run:
+                    for model_id, name, current_val, suggested_val in results:
+                        report.write(f"{model_id}\t{name}\t{'NULL' if current_val is None else f'{current_val}cc'} -> {suggested_val}cc\n")
+                elif results:
+                    with engine.begin() as conn:
+                        conn.execute(stmt, [{"b_id": model_id, "b_displacement": val} for model_id, _, _, val in results])
+
+                updated_count += len(results)
+                print(f"  [チャンク] 最終ID {chunk[-1][0]}: {len(chunk)} 件中 {len(results)} 件{'が補完対象' if dry_run else 'を更新'} (累計 {updated_count}/{scanned_count})")
+    finally:
+        if report_path:
+            report.close()
+
+    if dry_run:
+        print(f"\n完了（ドライラン）: {scanned_count} 件中 {updated_count} 件が補完対象です。")
+    else:
+        print(f"\n完了: {scanned_count} 件中 {updated_count} 件の排気量を更新しました。")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="車種名から排気量を補完する")
+    parser.add_argument("--stream", action="store_true", help="チャンク単位・並列・一括UPDATEのストリーミングモードで実行する")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="1チャンクあたりの読み出し件数")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="抽出に使うプロセス数")
+    parser.add_argument("--dry-run", action="store_true", help="更新せず差分レポートのみ出力する（ストリーミングモード）")
+    parser.add_argument("--report", default=None, help="差分レポートの出力先ファイル（省略時は標準出力）")
+    profiling.add_argument(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    fix_displacements()
\ No newline at end of file
+    args = parse_args()
+    with profiling.profile(args.profile):
+        if args.stream or args.dry_run:
+            fix_displacements_streaming(
+                chunk_size=args.chunk_size,
+                workers=args.workers,
+                dry_run=args.dry_run,
+                report_path=args.report,
+            )
+        else:
+            fix_displacements()
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""
+Playwright のブラウザ起動の共通化
+
+単体実行では従来どおりコレクターごとに Chromium を起動・終了する。
+run_all.py --in-process では起動済みのブラウザを共有し、各コレクターは自分のコンテキストだけを閉じる。
+"""
+
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+
+_playwright = None
+_shared_browser = None
+
+async def start_shared_browser():
+    """パイプライン全体で共有するブラウザを起動する"""
+    global _playwright, _shared_browser
+    if _playwright is None:
+        _playwright = await async_playwright().start()
+    if _shared_browser is None or not _shared_browser.is_connected():
+        _shared_browser = await _playwright.chromium.launch(headless=True)
+    return _shared_browser
+
+async def stop_shared_browser():
+    global _playwright, _shared_browser
+    if _shared_browser is not None:
+        await _shared_browser.close()
+        _shared_browser = None
+    if _playwright is not None:
+        await _playwright.stop()
+        _playwright = None
+
+@asynccontextmanager
+async def open_browser():
+    """共有ブラウザがあればそれを、なければこのコレクター専用のブラウザを起動して返す"""
+    if _playwright is not None:
+        # 前のステップでブラウザが落ちていれば起動し直す
+        yield await start_shared_browser()
+        return
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            yield browser
+        finally:
+            await browser.close()
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+巡回の進捗（チェックポイント）の記録と再開
+
+巡回1回分を crawl_runs に、完了した作業単位（メーカー・車種・都道府県・ページ）を crawl_units に記録する。
+--resume で再開した場合は、前回の未完了の巡回で完了済みの単位を飛ばし、
+そこで見つかったURLと最後まで巡回できた車種を引き継いで最後の掲載終了判定に使う。
+- 完了の記録はまとめて書き込む。確定させる時は先にスナップショットの変更を書き込む (checkpoint)
+- 255文字を超えるキーは、先頭とハッシュをつないだ255文字のキーにして記録・照合する
+"""
+
+import datetime
+import hashlib
+from sqlalchemy import Column, BigInteger, String, JSON, DateTime, insert, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import DeclarativeBase
+
+class Base(DeclarativeBase):
+    pass
+
+class CrawlRun(Base):
+    __tablename__ = "crawl_runs"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    site_id = Column(BigInteger, nullable=False)
+    collector = Column(String(100), nullable=False)
+    status = Column(String(20), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class CrawlUnit(Base):
+    __tablename__ = "crawl_units"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    crawl_run_id = Column(BigInteger, nullable=False)
+    unit_type = Column(String(20), nullable=False)
+    unit_key = Column(String(255), nullable=False)
+    found_urls = Column(JSON, nullable=True)
+    completed_at = Column(DateTime, nullable=False)
+
+# crawl_runs.status
+RUNNING = "running"
+COMPLETED = "completed"
+ABANDONED = "abandoned"
+
+UNIT_KEY_LENGTH = 255
+# この件数の完了記録が溜まるごとに、スナップショットの変更と合わせて確定させる
+DEFAULT_CHECKPOINT_UNITS = 20
+
+def _unit_key(unit_key):
+    """crawl_units.unit_key に収まるキーにする（長いURLが先頭の一致だけで同じ単位とみなされないよう、ハッシュを付ける）"""
+    if len(unit_key) <= UNIT_KEY_LENGTH:
+        return unit_key
+    digest = hashlib.sha1(unit_key.encode("utf-8")).hexdigest()
+    return f"{unit_key[:UNIT_KEY_LENGTH - len(digest) - 1]}#{digest}"
+
+class CrawlState:
+    """1回の巡回の進捗を保持する"""
+
+    def __init__(self, site_id, collector, checkpoint_units=DEFAULT_CHECKPOINT_UNITS):
+        self.site_id = site_id
+        self.collector = collector
+        self.run_id = None
+        self.resumed = False
+        # (unit_type, unit_key) の完了済みセット
+        self.done = set()
+        # 完了済みの単位で見つかったURL（掲載終了判定に引き継ぐ）
+        self.found_urls = set()
+        # 今回の実行で一覧ページの取得に失敗した車種（掲載終了判定の対象から外す）
+        self.failed_models = set()
+        self.pending = []
+        self.checkpoint_units = checkpoint_units
+
+    def start(self, db, resume=False, run_id=None):
+        """
+        巡回を開始する。resume=True なら同じコレクターの直近の未完了の巡回（run_id 指定時はその巡回）を再開し、
+        見つからなければ新しい巡回を始める。新しく始める場合、残っている未完了の巡回は破棄扱いにする。
+        """
+        if resume or run_id is not None:
+            query = db.query(CrawlRun).filter(
+                CrawlRun.site_id == self.site_id,
+                CrawlRun.collector == self.collector,
+                CrawlRun.status == RUNNING,
+            )
+            if run_id is not None:
+                query = query.filter(CrawlRun.id == run_id)
+            run = query.order_by(CrawlRun.id.desc()).first()
+            if run:
+                self.run_id = run.id
+                self.resumed = True
+                for unit_type, unit_key, found_urls in db.query(
+                    CrawlUnit.unit_type, CrawlUnit.unit_key, CrawlUnit.found_urls
+                ).filter(CrawlUnit.crawl_run_id == run.id).yield_per(1000):
+                    self.done.add((unit_type, unit_key))
+                    self.found_urls.update(found_urls or [])
+                return self.run_id
+            print("  再開できる未完了の巡回がないため、新しく巡回を始めます。")
+
+        now = datetime.datetime.now()
+        db.execute(
+            update(CrawlRun.__table__)
+            .where(CrawlRun.site_id == self.site_id)
+            .where(CrawlRun.collector == self.collector)
+            .where(CrawlRun.status == RUNNING)
+            .values(status=ABANDONED, finished_at=now, updated_at=now)
+        )
+        result = db.execute(insert(CrawlRun.__table__).values(
+            site_id=self.site_id, collector=self.collector, status=RUNNING, started_at=now, created_at=now, updated_at=now,
+        ))
+        db.commit()
+        self.run_id = result.inserted_primary_key[0]
+        return self.run_id
+
+    def is_done(self, unit_type, unit_key):
+        return (unit_type, _unit_key(unit_key)) in self.done
+
+    def mark_done(self, unit_type, unit_key, found_urls=None):
+        """作業単位の完了を記録する（flush までは書き込まない）"""
+        key = (unit_type, _unit_key(unit_key))
+        if key in self.done:
+            return
+        self.done.add(key)
+        if found_urls:
+            self.found_urls.update(found_urls)
+        self.pending.append({
+            "crawl_run_id": self.run_id,
+            "unit_type": unit_type,
+            "unit_key": key[1],
+            "found_urls": sorted(found_urls) if found_urls else None,
+            "completed_at": datetime.datetime.now(),
+        })
+
+    def model_crawled(self, bike_model_id, ok):
+        """車種の一覧ページの巡回結果を記録する。1ページでも失敗した車種は掲載終了判定の対象にしない"""
+        if ok:
+            self.mark_done("crawled_model", str(bike_model_id))
+        else:
+            self.failed_models.add(bike_model_id)
+
+    def reconciliation_scope(self):
+        """掲載終了判定の対象とする車種ID（この巡回で一覧ページを最後まで処理でき、失敗のなかった車種）"""
+        crawled = {int(key) for unit_type, key in self.done if unit_type == "crawled_model"}
+        return crawled - self.failed_models
+
+    def flush(self, db):
+        """溜まった完了記録を書き込む（同じ単位が既にあれば上書き）"""
+        if not self.pending:
+            return 0
+        rows, self.pending = self.pending, []
+        stmt = mysql_insert(CrawlUnit.__table__)
+        db.execute(stmt.on_duplicate_key_update(found_urls=stmt.inserted.found_urls, completed_at=stmt.inserted.completed_at), rows)
+        db.commit()
+        return len(rows)
+
+    def checkpoint(self, db, snapshot):
+        """
+        スナップショットの変更がバッチサイズに達していれば書き込み、完了記録が checkpoint_units 件溜まったら
+        スナップショットの残りの変更を書き込んでから完了記録を確定させる。
+        （完了済みとして飛ばした単位の価格変化が、中断によって失われないようにする）
+        """
+        snapshot.flush_if_full(db)
+        if len(self.pending) >= self.checkpoint_units:
+            snapshot.flush(db)
+            self.flush(db)
+
+    def finish(self, db):
+        """巡回の完了を記録する（以降この巡回は再開の対象にならない）"""
+        self.flush(db)
+        now = datetime.datetime.now()
+        db.execute(
+            update(CrawlRun.__table__)
+            .where(CrawlRun.id == self.run_id)
+            .values(status=COMPLETED, finished_at=now, updated_at=now)
+        )
+        db.commit()
\ No newline at end of file
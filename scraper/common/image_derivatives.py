@@ -0,0 +1,180 @@
+"""
+保存済み画像の派生画像（一覧用サムネイル・WebP 版）の生成
+
+画像のダウンロード (image_downloader.py) の後に実行し、local_image_derivatives が NULL の出品だけを対象にする。
+- thumb: 検索結果のカード (4:3) に合わせて切り抜いたサムネイル (WebP)
+- webp: 長辺を WEBP_MAX_EDGE までに縮めた WebP 版
+派生画像は元の画像と同じく内容のハッシュをキーに derivatives/ へ保存するため、複数の出品で共有され、
+すでにあるものは作り直さない。画像の変換 (image_render.py) は ProcessPoolExecutor で行い、ダウンロードのイベントループとは分ける。
+local_image_derivatives は local_image_paths と同じ並びで {"thumb": パス, "webp": パス} を持つ（移行前のパスの画像は null）。
+変換に失敗した画像がある出品は NULL のまま残し、次回の実行で作り直させる。失敗の回数は内容ごとに
+image_objects.derivative_failures に数え、MAX_RENDER_ATTEMPTS 回失敗した画像は作り直さずに null として記録する。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, bindparam, text
+
+# 1. 環境変数の読み込み
+# 実行ファイルからの相対パスで .env を探す
+current_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(current_dir, '..', '.env')
+load_dotenv(dotenv_path=env_path)
+
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common import image_files, image_render, image_store, profiling, prom_metrics, run_metrics
+
+def get_env_or_exit(key, default=None, required=True):
+    """
+    環境変数を取得する。
+    required=True の場合、値が取得できなければプログラムを終了させる（セキュリティ対策）。
+    """
+    val = os.getenv(key, default)
+    if required and val is None:
+        print(f"致命的エラー: 必須の環境変数 '{key}' が設定されていません。")
+        sys.exit(1)
+    return val
+
+# DB設定: セキュリティのため機密情報はデフォルト値を設定せず必須（required=True）とする
+DB_USER = get_env_or_exit("DB_USERNAME")
+DB_PASS = get_env_or_exit("DB_PASSWORD")
+DB_NAME = get_env_or_exit("DB_DATABASE")
+
+# 接続先やポートは、機密情報ではないため利便性のためにデフォルト値を残しても許容される
+DB_HOST = get_env_or_exit("DB_HOST", default="db")
+DB_PORT = get_env_or_exit("DB_PORT", default="3306")
+
+DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+engine = create_engine(DATABASE_URL)
+
+# 2. 生成の設定
+DEFAULT_STORAGE_PATH = os.path.abspath(os.path.join(current_dir, "../../backend/storage/app/public/listings"))
+STORAGE_BASE_PATH = os.getenv("IMAGE_STORAGE_PATH", DEFAULT_STORAGE_PATH)
+
+DEFAULT_WORKERS = os.cpu_count() or 2
+DEFAULT_BATCH_SIZE = 200
+# 同じ画像の変換をやり直す回数の上限（壊れた画像で毎晩やり直し続けないため）
+MAX_RENDER_ATTEMPTS = 3
+
+TARGETS_SQL = text("""
+    SELECT id, local_image_paths FROM listings
+    WHERE id > :last_id AND local_image_paths IS NOT NULL AND local_image_derivatives IS NULL
+    ORDER BY id LIMIT :limit
+""")
+
+# 読み込んだ後に local_image_paths が変わった（画像URLの変化で取り直しになった）出品には書き込まない
+UPDATE_SQL = text("""
+    UPDATE listings SET local_image_derivatives = :derivatives
+    WHERE id = :row_id AND local_image_derivatives IS NULL AND local_image_paths = JSON_EXTRACT(:paths, '$')
+""")
+
+COUNT_FAILURES_SQL = text(
+    "UPDATE image_objects SET derivative_failures = derivative_failures + 1 WHERE sha256 IN :hashes"
+).bindparams(bindparam("hashes", expanding=True))
+
+GIVEN_UP_SQL = text(
+    "SELECT sha256 FROM image_objects WHERE sha256 IN :hashes AND derivative_failures >= :max_attempts"
+).bindparams(bindparam("hashes", expanding=True))
+
+def _sha256(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def given_up(paths):
+    """変換の失敗が上限に達した画像のパスを返す"""
+    if not paths:
+        return set()
+    with engine.connect() as conn:
+        hashes = set(conn.execute(GIVEN_UP_SQL, {"hashes": [_sha256(path) for path in paths], "max_attempts": MAX_RENDER_ATTEMPTS}).scalars())
+    return {path for path in paths if _sha256(path) in hashes}
+
+def count_failures(paths):
+    """変換に失敗した画像の失敗回数を1つ増やし、上限に達したもののパスを返す"""
+    if not paths:
+        return set()
+    with engine.begin() as conn:
+        conn.execute(COUNT_FAILURES_SQL, {"hashes": [_sha256(path) for path in paths]})
+    return given_up(paths)
+
+def iter_targets(batch_size, limit):
+    """派生画像が未生成の出品を ID 順に batch_size 件ずつ返す"""
+    last_id = 0
+    remaining = limit
+    while remaining is None or remaining > 0:
+        chunk_limit = batch_size if remaining is None else min(batch_size, remaining)
+        with engine.connect() as conn:
+            rows = conn.execute(TARGETS_SQL, {"last_id": last_id, "limit": chunk_limit}).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        if remaining is not None:
+            remaining -= len(rows)
+        yield [(row.id, json.loads(row.local_image_paths) if isinstance(row.local_image_paths, str) else row.local_image_paths) for row in rows]
+
+def generate(batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS, limit=None):
+    print(f"派生画像の生成を開始します（{workers} プロセス）: {STORAGE_BASE_PATH}")
+    listings = rendered = reused = failed = 0
+
+    # fork だと親のDB接続やスレッド (--in-process のイベントループ等) の状態を子プロセスが引き継ぐため spawn で起動する。
+    # spawn のワーカーは関数をモジュール名から読み込むため、変換処理は通常の import ができる image_render に置く
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for rows in iter_targets(batch_size, limit):
+            # 移行前の出品ごとのディレクトリの画像は対象外（image_store.py --migrate の後に作られる）
+            wanted = {path: image_files.derivative_paths(path) for _, paths in rows for path in paths or [] if image_store.is_object(path)}
+            missing = [
+                path for path, derivatives in wanted.items()
+                if not all(os.path.exists(os.path.join(STORAGE_BASE_PATH, p)) for p in derivatives.values())
+            ]
+            # 失敗の上限に達した画像は変換せず、派生画像なし (null) として記録する
+            skipped = given_up(missing)
+            for path in skipped:
+                wanted[path] = None
+            missing = [path for path in missing if path not in skipped]
+            reused += len(wanted) - len(missing) - len(skipped)
+
+            broken = set()
+            for path, result in zip(missing, pool.map(image_render.render, [STORAGE_BASE_PATH] * len(missing), missing, chunksize=8)):
+                if isinstance(result, str):
+                    print(f"  [エラー] {path}: {result}")
+                    run_metrics.count("errors")
+                    broken.add(path)
+                    failed += 1
+                else:
+                    rendered += 1
+            for path in count_failures(broken):
+                print(f"  [エラー] {path}: {MAX_RENDER_ATTEMPTS} 回失敗したため、派生画像なしとして記録します")
+                wanted[path] = None
+                broken.discard(path)
+
+            # 失敗した画像を含む出品は書き込まない（NULL のまま残し、次回の実行で作り直す）
+            updates = [
+                {"row_id": row_id, "paths": json.dumps(paths), "derivatives": json.dumps([wanted.get(path) for path in paths or []])}
+                for row_id, paths in rows
+                if not broken.intersection(paths or [])
+            ]
+            if updates:
+                with engine.begin() as conn, prom_metrics.timed(prom_metrics.DB_BATCH_SECONDS, operation="local_image_derivatives_update"):
+                    conn.execute(UPDATE_SQL, updates)
+            run_metrics.count("rows_updated", len(updates))
+            listings += len(updates)
+            print(f"  [バッチ] 最終ID {rows[-1][0]}: {len(updates)} 件 (次回に持ち越し {len(rows) - len(updates)} 件, 累計 {listings} 件, 生成 {rendered} 枚 / 既存 {reused} 枚 / 失敗 {failed} 枚)")
+
+    print(f"\n完了: {listings} 件の出品の派生画像を記録しました（生成 {rendered} 枚 / 既存 {reused} 枚 / 失敗 {failed} 枚）。")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="保存済み画像から一覧用サムネイルと WebP 版を生成する（未生成の出品のみ）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="画像を変換するプロセス数")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="まとめて処理・書き込みする出品数")
+    parser.add_argument("--limit", type=int, default=None, help="1回の実行で処理する出品の上限件数")
+    profiling.add_argument(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with profiling.profile(args.profile):
+        generate(batch_size=args.batch_size, workers=args.workers, limit=args.limit)
\ No newline at end of file
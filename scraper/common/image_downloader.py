@@ -1,12 +1,13 @@
 import os
+import argparse
 import asyncio
 import httpx
-import json
-import mimetypes
-import random
+import importlib.util
 import sys
 import time
-from sqlalchemy import create_engine, Column, BigInteger, JSON, Text
+from collections import Counter
+from urllib.parse import urlsplit
+from sqlalchemy import create_engine, Column, BigInteger, JSON, bindparam, select, update
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 from dotenv import load_dotenv
 
@@ -16,6 +17,10 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 env_path = os.path.join(current_dir, '..', '.env')
 load_dotenv(dotenv_path=env_path)
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common import image_files, image_store, profiling, prom_metrics, run_metrics, tracing
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -53,58 +58,270 @@ class Listing(Base):
     image_urls = Column(JSON)
     local_image_paths = Column(JSON, nullable=True)
 
-async def download_image(client, url, site_name, shard, listing_id, index):
-    """1枚の画像をダウンロードして適切な拡張子で保存"""
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        }
-        
-        # サーバー負荷軽減のためランダム待機
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-        
-        resp = await client.get(url, headers=headers, timeout=15.0)
-        if resp.status_code != 200:
-            return None
-
-        content_type = resp.headers.get("Content-Type", "")
-        ext = mimetypes.guess_extension(content_type.split(';')[0])
-        if not ext:
-            ext = ".jpg"
-        
-        filename = f"{index}{ext}"
-        rel_path = f"{site_name}/{shard}/{listing_id}/{filename}"
-        abs_path = os.path.join(STORAGE_BASE_PATH, rel_path)
+# 3. ダウンロードの設定
+DEFAULT_WORKERS = 16
+DEFAULT_PER_HOST = 4
+DEFAULT_QUEUE_SIZE = 500
+DEFAULT_BATCH_SIZE = 100
+# 1枚あたりの上限サイズ。これを超える画像は保存しない
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+CANDIDATE_CHUNK_SIZE = 500
+# 進捗（スループット）を表示する間隔（秒）
+REPORT_INTERVAL = 30
 
-        # フォルダ作成
-        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-        
-        with open(abs_path, "wb") as f:
-            f.write(resp.content)
-            
-        return rel_path
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# HTTP/2 は h2 パッケージがある場合だけ使う（無ければ HTTP/1.1 の keep-alive で接続を使い回す）
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
 
+# キューの終端
+QUEUE_END = None
+
+def site_dir(site_id):
+    return "goobike" if site_id == 1 else "bds"
+
+async def download_image(client, url, site_name, max_bytes):
+    """
+    1枚の画像をストリーミングで受信し、内容のハッシュをキーに objects/ へ保存する（common/image_files.py）。
+    (保存先の相対パス, SHA-256, 受信バイト数) を返す。同じ内容がすでに保存されていれば書き込まない。
+    画像以外・上限を超えるサイズのレスポンスは保存せず、途中までのファイルも残さない。
+    """
+    size = 0
+    try:
+        with prom_metrics.timed(prom_metrics.PAGE_FETCH_SECONDS, site=site_name, page_type="image"):
+            async with client.stream("GET", url) as resp:
+                if resp.status_code != 200:
+                    run_metrics.count("errors")
+                    return None, None, size
+                rel_path, sha256, size, _ = await image_files.save_stream(resp, STORAGE_BASE_PATH, max_bytes)
+        run_metrics.count("bytes_fetched", size)
+        prom_metrics.inc(prom_metrics.IMAGE_BYTES, size, site=site_name)
+        return rel_path, sha256, size
+
+    except image_files.ImageRejected as e:
+        print(f"      Rejected ({url}): {e}")
+        run_metrics.count("errors")
     except Exception as e:
         print(f"      Download Error ({url}): {e}")
-    return None
+        run_metrics.count("errors")
+    return None, None, size
 
-async def process_listing(client, listing):
-    """1つの出品情報の画像を全て処理"""
-    if not listing.image_urls or not isinstance(listing.image_urls, list):
-        return None
+class PendingListing:
+    """画像の取得待ちの出品。すべての画像が終わった時点で保存先の一覧を書き込む"""
+    __slots__ = ("id", "site_name", "images", "sources", "remaining")
 
-    site_name = "goobike" if listing.site_id == 1 else "bds"
-    shard = str(listing.id % 100).zfill(2)
-    
-    downloaded_paths = []
-    for i, url in enumerate(listing.image_urls):
-        saved_rel_path = await download_image(client, url, site_name, shard, listing.id, i)
-        if saved_rel_path:
-            downloaded_paths.append(saved_rel_path)
-    
-    return downloaded_paths if downloaded_paths else None
+    def __init__(self, listing_id, site_id, image_count):
+        self.id = listing_id
+        self.site_name = site_dir(site_id)
+        # 画像ごとの (保存先の相対パス, SHA-256, バイト数)。取得できなかった画像は None
+        self.images = [None] * image_count
+        # 今回ダウンロードした画像の (URL の SHA-1, SHA-256)
+        self.sources = []
+        self.remaining = image_count
+
+    def complete(self, index, image, source=None):
+        """1枚分の結果を記録し、出品の画像がすべて終わったら True を返す"""
+        self.images[index] = image
+        if source:
+            self.sources.append(source)
+        self.remaining -= 1
+        return self.remaining == 0
+
+    def saved_images(self):
+        # 取得できた画像だけを元の並び順で残す
+        return [image for image in self.images if image]
+
+class PathWriter:
+    """
+    出品ごとの保存先 (local_image_paths) を溜めて、まとめて書き込む。
+    書き込みに失敗したバッチは捨てずに残し、次のバッチと一緒に書き込み直す（最後の flush で失敗すれば例外になる）。
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.pending = []
+        self.saved_count = 0
+        self.skipped_count = 0
+
+    def add(self, listing_id, images, sources=()):
+        # 取得できなかった出品も空配列を入れてスキップする（リトライループ防止）
+        self.pending.append(({"listing_id": listing_id, "paths": [path for path, _, _ in images]}, images, sources))
+        if images:
+            self.saved_count += 1
+        else:
+            self.skipped_count += 1
+        # 失敗して残ったバッチがあっても、書き込み直すのは batch_size 件増えるごとにする
+        if len(self.pending) % self.batch_size == 0:
+            self.try_flush()
+
+    def try_flush(self):
+        """
+        ダウンロード中の書き込み。ワーカーが例外で止まるとキューが空かず produce() が待ち続けるため、
+        ここでは例外を送出せずに記録だけする。
+        """
+        try:
+            self.flush()
+        except Exception as e:
+            run_metrics.count("errors")
+            print(f"  [エラー] 保存先の書き込みに失敗しました。{len(self.pending)} 件は次の書き込みでやり直します: {type(e).__name__}: {e}")
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            written = self._write(pending)
+        except Exception:
+            # 書き込めなかったバッチは捨てずに戻す
+            self.pending = pending + self.pending
+            raise
+        skipped = f", 書き込み済み・退避済みのため省略 {len(pending) - len(written)} 件" if len(written) < len(pending) else ""
+        print(f"  [書き込み] {len(written)} 件{skipped} (保存済み 累計 {self.saved_count} 車両 / 画像なし・取得失敗 累計 {self.skipped_count} 車両)")
+
+    def _write(self, pending):
+        """1トランザクションで書き込み、実際に書き換えた分を返す"""
+        table = Listing.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("listing_id"), table.c.local_image_paths == None)
+            .values(local_image_paths=bindparam("paths"))
+        )
+        # 出品の書き換えと参照数の加算を同じトランザクションで確定させる
+        with tracing.span("persist", rows=len(pending)), engine.begin() as conn, prom_metrics.timed(prom_metrics.DB_BATCH_SECONDS, operation="local_image_paths_update"):
+            # 読み込んだ後にアーカイブへ退避された・他の実行が書き込んだ出品は書き換えず、参照数も数えない
+            open_ids = set(conn.execute(
+                select(table.c.id)
+                .where(table.c.id.in_([row["listing_id"] for row, _, _ in pending]), table.c.local_image_paths == None)
+                .with_for_update()
+            ).scalars())
+            written = [entry for entry in pending if entry[0]["listing_id"] in open_ids]
+            if written:
+                conn.execute(stmt, [row for row, _, _ in written])
+                image_store.add_refs(
+                    conn,
+                    [image for _, images, _ in written for image in images],
+                    [source for _, _, sources in written for source in sources],
+                )
+        return written
 
-async def run():
+class ThroughputStats:
+    """画像の取得件数・バイト数をホストごとに数え、スループットを表示する"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.images = Counter()
+        self.failed = Counter()
+        self.bytes = Counter()
+        # ダウンロードせずに保存済みの内容を使った画像
+        self.reused = 0
+
+    def record(self, host, ok, size):
+        (self.images if ok else self.failed)[host] += 1
+        self.bytes[host] += size
+
+    def line(self, queue):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        images = sum(self.images.values())
+        total_bytes = sum(self.bytes.values())
+        return (
+            f"  [進捗] 画像 {images} 枚 (失敗 {sum(self.failed.values())} 枚, 保存済みのため省略 {self.reused} 枚), "
+            f"{images / elapsed:.1f} 枚/秒, {total_bytes / elapsed / 1024 / 1024:.2f} MB/秒, 待ち {queue.qsize()} 件"
+        )
+
+    def host_lines(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return [
+            f"  {host}: {self.images[host]} 枚 (失敗 {self.failed[host]} 枚), {self.bytes[host] / 1024 / 1024:.1f} MB, {self.images[host] / elapsed:.1f} 枚/秒"
+            for host in sorted(self.images.keys() | self.failed.keys(), key=lambda h: self.bytes[h], reverse=True)
+        ]
+
+async def produce(queue, writer, known, stats, limit, workers):
+    """
+    未処理の出品 (local_image_paths が NULL) を ID 順に読み込み、画像1枚ずつのジョブとしてキューに積む。
+    キューの上限に達すると取り出されるまで待つため、DBから読み込む件数も取得の速度に合わせて抑えられる。
+    内容を保存済みの画像URL（image_sources・この実行でダウンロードしたもの）はキューに積まずにそのまま使う。
+    """
+    queued = 0
+    last_id = 0
+    while limit is None or queued < limit:
+        chunk_limit = CANDIDATE_CHUNK_SIZE if limit is None else min(CANDIDATE_CHUNK_SIZE, limit - queued)
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(Listing.id, Listing.site_id, Listing.image_urls)
+                .where(Listing.image_urls != None, Listing.local_image_paths == None, Listing.id > last_id)
+                .order_by(Listing.id)
+                .limit(chunk_limit)
+            ).all()
+        finally:
+            db.close()
+        if not rows:
+            break
+        hashes = {url: image_store.url_hash(url) for row in rows if isinstance(row.image_urls, list) for url in row.image_urls}
+        with engine.connect() as conn:
+            known.update(image_store.known_sources(conn, set(hashes.values()) - known.keys()))
+        for row in rows:
+            urls = row.image_urls if isinstance(row.image_urls, list) else []
+            if not urls:
+                writer.add(row.id, [])
+                continue
+            listing = PendingListing(row.id, row.site_id, len(urls))
+            for index, url in enumerate(urls):
+                image = known.get(hashes[url])
+                if image:
+                    stats.reused += 1
+                    if listing.complete(index, image):
+                        writer.add(listing.id, listing.saved_images(), listing.sources)
+                    continue
+                await queue.put((listing, index, url))
+                prom_metrics.set_gauge(prom_metrics.QUEUE_DEPTH, queue.qsize(), queue="images")
+        last_id = rows[-1].id
+        queued += len(rows)
+
+    for _ in range(workers):
+        await queue.put(QUEUE_END)
+    return queued
+
+async def download_worker(client, queue, host_limits, known, args, writer, stats):
+    """キューから画像を取り出してダウンロードする。同じホストへの同時接続数は per_host までに抑える"""
+    while True:
+        job = await queue.get()
+        prom_metrics.set_gauge(prom_metrics.QUEUE_DEPTH, queue.qsize(), queue="images")
+        try:
+            if job is QUEUE_END:
+                return
+
+            listing, index, url = job
+            host = urlsplit(url).hostname or ""
+            limit = host_limits.setdefault(host, asyncio.Semaphore(args.per_host))
+            with tracing.span("image", url=url, listing_id=listing.id, index=index) as unit:
+                async with tracing.acquire(limit, "image_host"):
+                    with tracing.span("fetch") as fetch_span:
+                        rel_path, sha256, size = await download_image(client, url, listing.site_name, args.max_bytes)
+                        fetch_span.set(bytes=size)
+                if not rel_path:
+                    unit.set(error="download failed")
+            stats.record(host, rel_path is not None, size)
+            image = source = None
+            if rel_path:
+                image = (rel_path, sha256, size)
+                source = (image_store.url_hash(url), sha256)
+                # 同じURLが後の出品にもあれば（店舗の共通画像など）、この実行中はダウンロードしない
+                known[source[0]] = image
+            if listing.complete(index, image, source):
+                writer.add(listing.id, listing.saved_images(), listing.sources)
+        finally:
+            queue.task_done()
+
+async def report_progress(stats, queue):
+    while True:
+        await asyncio.sleep(REPORT_INTERVAL)
+        print(stats.line(queue))
+
+async def run(args=None):
+    if args is None:
+        # run_all.py --in-process からは既定値で呼び出す
+        args = parse_args([])
     print(f"DEBUG: 画像保存ベースパス -> {STORAGE_BASE_PATH}")
     
     # 書き込み権限のチェック
@@ -115,53 +332,49 @@ async def run():
         print(f"致命的エラー: {STORAGE_BASE_PATH} への書き込み権限がありません。")
         return
 
-    batch_count = 1
-    total_downloaded = 0
+    queue = asyncio.Queue(maxsize=args.queue_size)
+    writer = PathWriter(args.batch_size)
+    stats = ThroughputStats()
+    host_limits = {}
+    # URL の SHA-1 -> 保存済みの (保存先の相対パス, SHA-256, バイト数)
+    known = {}
 
-    while True:
-        db = SessionLocal()
+    print(f"画像のダウンロードを開始します（最大 {args.workers} 並列・1ホストあたり {args.per_host} 並列・{'HTTP/2' if HTTP2_AVAILABLE else 'HTTP/1.1'}）...")
+    # 実行中は1つのクライアントで接続を使い回す
+    limits = httpx.Limits(max_connections=args.workers, max_keepalive_connections=args.workers)
+    async with httpx.AsyncClient(
+        headers={"User-Agent": USER_AGENT}, timeout=15.0, follow_redirects=True, limits=limits, http2=HTTP2_AVAILABLE
+    ) as client:
+        workers = [
+            asyncio.create_task(download_worker(client, queue, host_limits, known, args, writer, stats))
+            for _ in range(args.workers)
+        ]
+        reporter = asyncio.create_task(report_progress(stats, queue))
         try:
-            # 未処理のレコードを取得 (NULLのもの)
-            query = db.query(Listing).filter(
-                Listing.image_urls != None,
-                Listing.local_image_paths == None
-            )
-            
-            # バッチサイズを設定 (100件ずつ処理)
-            batch_size = 100
-            target_listings = query.limit(batch_size).all() 
-
-            if not target_listings:
-                print("\nすべての未処理画像のダウンロードが完了しました。")
-                break
-
-            print(f"\n--- バッチ {batch_count}: {len(target_listings)} 件の処理を開始 ---")
-
-            async with httpx.AsyncClient(follow_redirects=True) as client:
-                for listing in target_listings:
-                    print(f"  車両ID:{listing.id} の画像を処理中...")
-                    paths = await process_listing(client, listing)
-                    
-                    if paths:
-                        listing.local_image_paths = paths
-                        db.commit() # 1件ごとにコミットして進捗を確実に保存
-                        total_downloaded += 1
-                        print(f"    -> {len(paths)} 枚保存完了 (累計: {total_downloaded}車両)")
-                    else:
-                        # 取得できなかった場合は空配列をいれてスキップ（リトライループ防止）
-                        listing.local_image_paths = []
-                        db.commit()
-                        print(f"    -> 画像なしまたは取得失敗につきスキップ")
-
-            batch_count += 1
-            # 次のバッチの前に少し休止
-            await asyncio.sleep(1)
-
-        except Exception as e:
-            print(f"バッチ処理中にエラーが発生しました: {e}")
-            await asyncio.sleep(5) # エラー時は少し長めに待機
+            listing_count = await produce(queue, writer, known, stats, args.limit, args.workers)
+            await asyncio.gather(*workers)
         finally:
-            db.close()
+            reporter.cancel()
+            writer.flush()
+
+    print(stats.line(queue))
+    for line in stats.host_lines():
+        print(line)
+    print(f"\n{listing_count} 件の出品を処理しました（保存 {writer.saved_count} 車両 / 画像なし・取得失敗 {writer.skipped_count} 車両）。")
+    print("すべての未処理画像のダウンロードが完了しました。")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="出品画像をローカルストレージへ同期する")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="画像を同時に取得する数（全ホストの合計）")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST, help="1つのホストへ同時に取得する数の上限")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="取得待ちキューの上限件数（画像の枚数）")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="保存先をまとめて書き込む出品数")
+    parser.add_argument("--limit", type=int, default=None, help="1回の実行で処理する出品の上限件数")
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES, help="1枚あたりの上限サイズ（バイト）。超える画像は保存しない")
+    profiling.add_argument(parser)
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    asyncio.run(run())
\ No newline at end of file
+    args = parse_args()
+    with profiling.profile(args.profile):
+        asyncio.run(run(args))
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+画像レスポンスのストリーミング保存と、内容のハッシュをキーにした保存先 (objects/)
+
+レスポンス全体をメモリに載せず、チャンクごとに一時ファイルへ書き込みながら SHA-256 を計算し、
+objects/<先頭2桁>/<次の2桁>/<SHA-256><拡張子> へ os.replace で置き換える。
+- 同じ内容の画像がすでにあれば書き込まずに一時ファイルを捨てる（出品・再掲載をまたいで1つのファイルを共有する）
+- 書き込み中に落ちても保存先に途中までのファイルが残らない（残るのは objects/ 直下の *.part だけ）
+- Content-Type が画像以外のもの、先頭のバイト列が既知の画像形式でないもの、max_bytes を超えるものは保存しない
+- ファイルの書き込みはスレッドで行い、イベントループを止めない
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+
+OBJECTS_DIR = "objects"
+# 派生画像 (image_derivatives.py) の保存先と、種類ごとのファイル名の末尾
+DERIVATIVES_DIR = "derivatives"
+DERIVATIVE_SUFFIXES = {"thumb": "_thumb.webp", "webp": ".webp"}
+CHUNK_SIZE = 64 * 1024
+# 形式の判定に使う先頭のバイト数
+SNIFF_BYTES = 12
+
+# Content-Type を付けない・汎用の型で返すサーバーもあるため、これらは先頭のバイト列だけで判定する
+GENERIC_CONTENT_TYPES = {"", "application/octet-stream", "binary/octet-stream"}
+
+class ImageRejected(Exception):
+    """保存しない画像（種類・サイズが不正）"""
+
+def sniff_extension(head):
+    """先頭のバイト列から画像の形式を判定して拡張子を返す（画像でなければ None）"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return ".avif"
+    if head.startswith(b"BM"):
+        return ".bmp"
+    return None
+
+def object_path(sha256, ext):
+    """内容のハッシュから保存先の相対パス (STORAGE_BASE_PATH から) を決める"""
+    return f"{OBJECTS_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+def derivative_paths(rel_path):
+    """objects/ の画像から作る派生画像の相対パスを {種類: パス} で返す（元の画像と同じく内容のハッシュがキー）"""
+    sha256 = os.path.splitext(os.path.basename(rel_path))[0]
+    return {kind: f"{DERIVATIVES_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{suffix}" for kind, suffix in DERIVATIVE_SUFFIXES.items()}
+
+def _place(temp_path, base_dir, rel_path):
+    """一時ファイルを保存先へ置く。同じ内容がすでにあれば一時ファイルを捨てて False を返す"""
+    abs_path = os.path.join(base_dir, rel_path)
+    if os.path.exists(abs_path):
+        os.remove(temp_path)
+        # DBに記録される前のファイルとして image_store.py --gc に消されないよう、更新日時を今にする
+        os.utime(abs_path)
+        return False
+    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    os.replace(temp_path, abs_path)
+    return True
+
+def check_content_type(content_type):
+    mime = content_type.split(";")[0].strip().lower()
+    if mime not in GENERIC_CONTENT_TYPES and not mime.startswith("image/"):
+        raise ImageRejected(f"画像ではない Content-Type: {mime}")
+
+def _open_temp(directory):
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    return os.fdopen(fd, "wb"), temp_path
+
+def _discard(f, temp_path):
+    f.close()
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+async def save_stream(resp, base_dir, max_bytes):
+    """
+    ストリーミング中のレスポンス (client.stream の resp) を base_dir/objects/ に保存する。
+    拡張子は先頭のバイト列から決める。(保存先の相対パス, SHA-256, バイト数, 新しく書き込んだか) を返し、
+    不正な画像は ImageRejected を送出する。
+    """
+    check_content_type(resp.headers.get("Content-Type", ""))
+    declared = resp.headers.get("Content-Length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise ImageRejected(f"サイズが上限を超えています: {int(declared)} bytes")
+
+    f, temp_path = await asyncio.to_thread(_open_temp, os.path.join(base_dir, OBJECTS_DIR))
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    ext = None
+    try:
+        async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageRejected(f"サイズが上限を超えています: {size} bytes 以上")
+            if ext is None:
+                head += chunk[:SNIFF_BYTES]
+                if len(head) >= SNIFF_BYTES:
+                    ext = sniff_extension(head)
+                    if ext is None:
+                        raise ImageRejected("既知の画像形式ではありません")
+            digest.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+        if ext is None:
+            # SNIFF_BYTES に満たない小さなレスポンス
+            ext = sniff_extension(head)
+            if ext is None:
+                raise ImageRejected("既知の画像形式ではありません")
+        await asyncio.to_thread(f.close)
+    except BaseException:
+        await asyncio.to_thread(_discard, f, temp_path)
+        raise
+
+    sha256 = digest.hexdigest()
+    rel_path = object_path(sha256, ext)
+    created = await asyncio.to_thread(_place, temp_path, base_dir, rel_path)
+    return rel_path, sha256, size, created
+
+def hash_file(path):
+    """ファイルの SHA-256 と、形式の判定に使う先頭のバイト列を返す"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest(), head
+
+def store_file(path, base_dir):
+    """
+    既存のファイルを objects/ へ取り込む（移行用）。元のファイルは残す（呼び出し側でDBを更新してから消す）。
+    拡張子は先頭のバイト列から決め、判定できなければ元の拡張子を使う。(相対パス, SHA-256, バイト数, 新しく書き込んだか) を返す。
+    """
+    sha256, head = hash_file(path)
+    ext = sniff_extension(head) or os.path.splitext(path)[1].lower()
+    rel_path = object_path(sha256, ext)
+    abs_path = os.path.join(base_dir, rel_path)
+    size = os.path.getsize(path)
+    created = not os.path.exists(abs_path)
+    if created:
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        try:
+            # 同じファイルシステムならハードリンクでコピーを避ける
+            os.link(path, abs_path)
+        except OSError:
+            f, temp_path = _open_temp(os.path.join(base_dir, OBJECTS_DIR))
+            with f, open(path, "rb") as src:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    f.write(chunk)
+            os.replace(temp_path, abs_path)
+    # リンクは元のファイルの更新日時を引き継ぐため、DBを更新するまでに image_store.py --gc が
+    # 記録されていない古いファイルとして消さないよう、更新日時を今にする
+    os.utime(abs_path)
+    return rel_path, sha256, size, created
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""
+派生画像（一覧用サムネイル・WebP 版）の変換処理
+
+image_derivatives.py がプロセスプールのワーカーで呼び出す。spawn で起動したワーカーは関数を
+モジュール名から読み込み直すため、DB接続などを持たない通常の import できるモジュールに置く
+（run_all.py --in-process で読み込んだステップのモジュールは子プロセスから import できない）。
+"""
+
+import os
+from PIL import Image, ImageOps
+
+from common import image_files
+
+# 検索結果のカードの画像枠 (aspect-[4/3]) の2倍程度
+THUMB_SIZE = (480, 360)
+THUMB_QUALITY = 75
+WEBP_MAX_EDGE = 1280
+WEBP_QUALITY = 80
+
+def _save_webp(image, abs_path, quality):
+    """一時ファイルに書き込んでから置き換える（書き込み途中のファイルを配信しないため）"""
+    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    temp_path = f"{abs_path}.{os.getpid()}.part"
+    image.save(temp_path, "WEBP", quality=quality, method=4)
+    os.replace(temp_path, abs_path)
+
+def render(base_dir, rel_path):
+    """
+    1枚の画像から派生画像を作る（プロセスプールで実行する）。{種類: 相対パス} を返し、
+    作れなかった場合は例外のメッセージを返す（例外のままでは他の画像の結果まで失われるため）。
+    """
+    paths = image_files.derivative_paths(rel_path)
+    try:
+        with Image.open(os.path.join(base_dir, rel_path)) as source:
+            image = ImageOps.exif_transpose(source)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+        thumb = ImageOps.fit(image, THUMB_SIZE, Image.Resampling.LANCZOS)
+        _save_webp(thumb, os.path.join(base_dir, paths["thumb"]), THUMB_QUALITY)
+
+        image.thumbnail((WEBP_MAX_EDGE, WEBP_MAX_EDGE), Image.Resampling.LANCZOS)
+        _save_webp(image, os.path.join(base_dir, paths["webp"]), WEBP_QUALITY)
+        return paths
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
\ No newline at end of file
@@ -0,0 +1,353 @@
+"""
+内容のハッシュをキーにした画像の保存先 (listings/objects/) の管理
+
+画像は image_files.py で SHA-256 をキーに objects/ へ保存し、出品の local_image_paths はそのパスを指す。
+- image_objects: 保存済みの内容と、listings・listings_archive の local_image_paths から参照されている数 (ref_count)
+  出品に書き込む時に add_refs で増やし、出品から外す時（画像URLの変化による取り直しなど）に同じトランザクションで
+  release_refs で減らす。listings と listings_archive の間の移動では変わらない
+- image_sources: 画像URL (SHA-1) と内容の対応。既知のURLはダウンロードせずに既存のファイルを使う
+コマンド:
+- --migrate: 出品ごとのディレクトリ ({site}/{id%100}/{listing_id}/{index}.ext) の既存ファイルを objects/ へ移す
+- --recount: local_image_paths を数え直して ref_count を合わせる（ダウンロード中には実行しない。
+  参照数を増減させる処理が途中で止まった場合などの修復用で、--gc の前に毎回実行する必要はない）
+- --gc: 参照されていない内容と、DBに記録されないまま残ったファイルを削除する
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, Column, BigInteger, Integer, String, DateTime, bindparam, text
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import DeclarativeBase
+
+# 1. 環境変数の読み込み
+# 実行ファイルからの相対パスで .env を探す
+current_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(current_dir, '..', '.env')
+load_dotenv(dotenv_path=env_path)
+
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common import image_files, profiling
+
+def get_env_or_exit(key, default=None, required=True):
+    """
+    環境変数を取得する。
+    required=True の場合、値が取得できなければプログラムを終了させる（セキュリティ対策）。
+    """
+    val = os.getenv(key, default)
+    if required and val is None:
+        print(f"致命的エラー: 必須の環境変数 '{key}' が設定されていません。")
+        sys.exit(1)
+    return val
+
+# DB設定: セキュリティのため機密情報はデフォルト値を設定せず必須（required=True）とする
+DB_USER = get_env_or_exit("DB_USERNAME")
+DB_PASS = get_env_or_exit("DB_PASSWORD")
+DB_NAME = get_env_or_exit("DB_DATABASE")
+
+# 接続先やポートは、機密情報ではないため利便性のためにデフォルト値を残しても許容される
+DB_HOST = get_env_or_exit("DB_HOST", default="db")
+DB_PORT = get_env_or_exit("DB_PORT", default="3306")
+
+DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+engine = create_engine(DATABASE_URL)
+
+# 2. 保存先の設定
+DEFAULT_STORAGE_PATH = os.path.abspath(os.path.join(current_dir, "../../backend/storage/app/public/listings"))
+STORAGE_BASE_PATH = os.getenv("IMAGE_STORAGE_PATH", DEFAULT_STORAGE_PATH)
+
+class Base(DeclarativeBase):
+    pass
+
+class ImageObject(Base):
+    __tablename__ = "image_objects"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    path = Column(String(255), nullable=False)
+    bytes = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    derivative_failures = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class ImageSource(Base):
+    __tablename__ = "image_sources"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    url_hash = Column(String(40), nullable=False, unique=True)
+    sha256 = Column(String(64), nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+# local_image_paths を持つテーブル（退避済みの出品も画像を参照し続ける）
+LISTING_TABLES = ("listings", "listings_archive")
+DEFAULT_BATCH_SIZE = 500
+# 参照されていないファイルを消すまでの猶予。実行中のダウンロードがDBへ書き込む前のファイルを消さないため
+DEFAULT_GC_GRACE_HOURS = 24
+
+KNOWN_SOURCES_SQL = text("""
+    SELECT s.url_hash, o.path, o.sha256, o.bytes
+    FROM image_sources s
+    JOIN image_objects o ON o.sha256 = s.sha256
+    WHERE s.url_hash IN :hashes AND o.ref_count > 0
+""").bindparams(bindparam("hashes", expanding=True))
+
+def url_hash(url):
+    """画像URLの検索キー (SHA-1)"""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+def is_object(path):
+    return path.startswith(f"{image_files.OBJECTS_DIR}/")
+
+def known_sources(conn, hashes):
+    """
+    保存済みの内容がある画像URLを {url_hash: (path, sha256, bytes)} で返す。
+    参照が 0 の内容は --gc が消す途中の可能性があるため使わない（ダウンロードし直す）。
+    """
+    if not hashes:
+        return {}
+    return {row.url_hash: (row.path, row.sha256, row.bytes) for row in conn.execute(KNOWN_SOURCES_SQL, {"hashes": list(hashes)})}
+
+def add_refs(conn, images, sources=()):
+    """
+    出品に書き込んだ画像 [(path, sha256, bytes), ...] の参照を1つずつ増やし、
+    新しくダウンロードしたURLと内容の対応 [(url_hash, sha256), ...] を記録する。
+    """
+    now = datetime.datetime.now()
+    refs = Counter(sha256 for _, sha256, _ in images)
+    if refs:
+        details = {sha256: (path, size) for path, sha256, size in images}
+        table = ImageObject.__table__
+        stmt = insert(table)
+        conn.execute(
+            stmt.on_duplicate_key_update(ref_count=table.c.ref_count + stmt.inserted.ref_count, updated_at=stmt.inserted.updated_at),
+            [
+                {"sha256": sha256, "path": details[sha256][0], "bytes": details[sha256][1], "ref_count": count, "created_at": now, "updated_at": now}
+                for sha256, count in refs.items()
+            ],
+        )
+    if sources:
+        stmt = insert(ImageSource.__table__)
+        conn.execute(
+            stmt.on_duplicate_key_update(sha256=stmt.inserted.sha256, updated_at=stmt.inserted.updated_at),
+            [{"url_hash": h, "sha256": sha256, "created_at": now, "updated_at": now} for h, sha256 in dict(sources).items()],
+        )
+
+def release_refs(conn, paths):
+    """
+    出品から外した画像パスの参照を1つずつ減らす（objects/ 以外の移行前のパスは数えていないため対象外）。
+    updated_at を今にするため、参照が 0 になった内容も --gc の猶予が過ぎるまでは消されない。
+    """
+    refs = Counter(os.path.splitext(os.path.basename(path))[0] for path in paths if is_object(path))
+    if not refs:
+        return
+    now = datetime.datetime.now()
+    conn.execute(
+        text("UPDATE image_objects SET ref_count = GREATEST(ref_count - :count, 0), updated_at = :now WHERE sha256 = :sha256"),
+        [{"sha256": sha256, "count": count, "now": now} for sha256, count in refs.items()],
+    )
+
+def iter_image_rows(table, batch_size):
+    """local_image_paths が空でない行を ID 順に batch_size 件ずつ返す"""
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    f"SELECT id, local_image_paths FROM {table} "
+                    "WHERE id > :last_id AND local_image_paths IS NOT NULL "
+                    "ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": batch_size},
+            ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield [(row.id, json.loads(row.local_image_paths) if isinstance(row.local_image_paths, str) else row.local_image_paths) for row in rows]
+
+def remove_empty_dirs(directory):
+    """移行後に空になった出品ごとのディレクトリを消す（objects/ は残す）"""
+    for root, dirs, files in os.walk(directory, topdown=False):
+        if root == directory or os.path.relpath(root, directory).split(os.sep)[0] == image_files.OBJECTS_DIR:
+            continue
+        if not os.listdir(root):
+            os.rmdir(root)
+
+def migrate(batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    出品ごとのディレクトリに保存された画像を objects/ へ移し、local_image_paths を書き換える。
+    1バッチ = 1トランザクション。ファイルはリンク（またはコピー）してからDBを更新し、確定した後に元のファイルを消すため、
+    途中で止まっても出品が存在しないファイルを指すことはない（再実行すれば続きから移行する）。
+    """
+    print(f"既存の画像を objects/ へ移行します{'（ドライラン）' if dry_run else ''}: {STORAGE_BASE_PATH}")
+    seen = set()
+    files = missing = 0
+    total_bytes = unique_bytes = 0
+
+    for table in LISTING_TABLES:
+        for rows in iter_image_rows(table, batch_size):
+            updates = []
+            images = []
+            legacy_files = []
+            for row_id, paths in rows:
+                if not paths or all(is_object(path) for path in paths):
+                    continue
+                new_paths = []
+                for path in paths:
+                    if is_object(path):
+                        new_paths.append(path)
+                        continue
+                    abs_path = os.path.join(STORAGE_BASE_PATH, path)
+                    if not os.path.exists(abs_path):
+                        # ファイルが無い画像は一覧から外す
+                        missing += 1
+                        continue
+                    if dry_run:
+                        sha256, _ = image_files.hash_file(abs_path)
+                        size = os.path.getsize(abs_path)
+                    else:
+                        rel_path, sha256, size, _ = image_files.store_file(abs_path, STORAGE_BASE_PATH)
+                        new_paths.append(rel_path)
+                        images.append((rel_path, sha256, size))
+                        legacy_files.append(abs_path)
+                    files += 1
+                    total_bytes += size
+                    if sha256 not in seen:
+                        seen.add(sha256)
+                        unique_bytes += size
+                updates.append({"row_id": row_id, "paths": json.dumps(new_paths)})
+
+            if not dry_run and updates:
+                with engine.begin() as conn:
+                    # 派生画像 (image_derivatives.py) は新しいパスで作り直させる
+                    conn.execute(text(f"UPDATE {table} SET local_image_paths = :paths, local_image_derivatives = NULL WHERE id = :row_id"), updates)
+                    add_refs(conn, images)
+                for abs_path in legacy_files:
+                    os.remove(abs_path)
+            if updates:
+                print(f"  [{table}] 最終ID {rows[-1][0]}: {len(updates)} 件 (累計 {files} ファイル, 重複を除いて {len(seen)} 件)")
+
+    if not dry_run:
+        remove_empty_dirs(STORAGE_BASE_PATH)
+    saved = total_bytes - unique_bytes
+    print(
+        f"\n完了{'（ドライラン）' if dry_run else ''}: {files} ファイル ({total_bytes / 1024 / 1024:.1f} MB) → "
+        f"{len(seen)} 件 ({unique_bytes / 1024 / 1024:.1f} MB)。削減 {saved / 1024 / 1024:.1f} MB、ファイルが無かった画像 {missing} 件"
+    )
+
+def recount(batch_size=DEFAULT_BATCH_SIZE):
+    """listings・listings_archive の local_image_paths を数え直し、image_objects.ref_count を合わせる"""
+    refs = Counter()
+    for table in LISTING_TABLES:
+        for rows in iter_image_rows(table, batch_size):
+            for _, paths in rows:
+                refs.update(os.path.splitext(os.path.basename(path))[0] for path in paths or [] if is_object(path))
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE image_objects SET ref_count = 0"))
+        if refs:
+            conn.execute(
+                text("UPDATE image_objects SET ref_count = :ref_count WHERE sha256 = :sha256"),
+                [{"sha256": sha256, "ref_count": count} for sha256, count in refs.items()],
+            )
+        unreferenced = conn.execute(text("SELECT COUNT(*) FROM image_objects WHERE ref_count = 0")).scalar()
+    print(f"参照数を数え直しました: 参照されている内容 {len(refs)} 件 / 参照されていない内容 {unreferenced} 件")
+
+def gc(grace_hours=DEFAULT_GC_GRACE_HOURS, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """参照数が 0 の内容と、image_objects に記録されていない objects/ のファイル（猶予より古いもの）を削除する"""
+    cutoff = datetime.datetime.now() - datetime.timedelta(hours=grace_hours)
+    removed = removed_bytes = 0
+
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT sha256, path, bytes FROM image_objects WHERE ref_count = 0 AND updated_at < :cutoff LIMIT :limit"),
+                {"cutoff": cutoff, "limit": batch_size},
+            ).all()
+        if not rows:
+            break
+        if dry_run:
+            removed += len(rows)
+            removed_bytes += sum(row.bytes for row in rows)
+            break
+        with engine.begin() as conn:
+            # 読んだ後に参照された（ダウンロードが add_refs で加算した）内容は消さないよう、ロックして数え直す
+            hashes = list(conn.execute(
+                text(
+                    "SELECT sha256 FROM image_objects "
+                    "WHERE sha256 IN :hashes AND ref_count = 0 AND updated_at < :cutoff FOR UPDATE"
+                ).bindparams(bindparam("hashes", expanding=True)),
+                {"hashes": [row.sha256 for row in rows], "cutoff": cutoff},
+            ).scalars())
+            if hashes:
+                conn.execute(text("DELETE FROM image_sources WHERE sha256 IN :hashes").bindparams(bindparam("hashes", expanding=True)), {"hashes": hashes})
+                conn.execute(text("DELETE FROM image_objects WHERE sha256 IN :hashes").bindparams(bindparam("hashes", expanding=True)), {"hashes": hashes})
+        deleted = set(hashes)
+        for row in rows:
+            if row.sha256 not in deleted:
+                continue
+            removed += 1
+            removed_bytes += row.bytes
+            # 派生画像 (image_derivatives.py) も一緒に消す
+            for path in [row.path, *image_files.derivative_paths(row.path).values()]:
+                abs_path = os.path.join(STORAGE_BASE_PATH, path)
+                try:
+                    # 同じ内容を実行中のダウンロードが保存し直した（更新日時が新しい）ファイルは残す。
+                    # DBに記録されなければ、後で記録のないファイルとして消える
+                    if os.path.getmtime(abs_path) < cutoff.timestamp():
+                        os.remove(abs_path)
+                except FileNotFoundError:
+                    pass
+
+    # DBに記録されないまま残ったファイル（書き込み前に止まったダウンロード・一時ファイル）
+    objects_dir = os.path.join(STORAGE_BASE_PATH, image_files.OBJECTS_DIR)
+    orphans = []
+    for root, _, names in os.walk(objects_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.getmtime(path) < time.time() - grace_hours * 3600:
+                orphans.append((os.path.splitext(name)[0], path))
+    for i in range(0, len(orphans), batch_size):
+        chunk = orphans[i:i + batch_size]
+        with engine.connect() as conn:
+            recorded = set(conn.execute(
+                text("SELECT sha256 FROM image_objects WHERE sha256 IN :hashes").bindparams(bindparam("hashes", expanding=True)),
+                {"hashes": [sha256 for sha256, _ in chunk]},
+            ).scalars())
+        for sha256, path in chunk:
+            if sha256 in recorded:
+                continue
+            removed += 1
+            removed_bytes += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+
+    print(f"{'削除対象' if dry_run else '削除しました'}: {removed} 件 ({removed_bytes / 1024 / 1024:.1f} MB)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="内容のハッシュをキーにした画像の保存先 (objects/) を移行・整理する")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--migrate", action="store_true", help="出品ごとのディレクトリの既存画像を objects/ へ移す")
+    mode.add_argument("--recount", action="store_true", help="local_image_paths から参照数を数え直す")
+    mode.add_argument("--gc", action="store_true", help="参照されていない画像を削除する")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="1トランザクションで処理する行数")
+    parser.add_argument("--grace-hours", type=int, default=DEFAULT_GC_GRACE_HOURS, help="--gc で、参照されなくなってから削除するまでの時間")
+    parser.add_argument("--dry-run", action="store_true", help="変更せず対象件数・削減できる容量だけを表示する")
+    profiling.add_argument(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with profiling.profile(args.profile):
+        if args.migrate:
+            migrate(batch_size=args.batch_size, dry_run=args.dry_run)
+        elif args.recount:
+            recount(batch_size=args.batch_size)
+        else:
+            gc(grace_hours=args.grace_hours, batch_size=args.batch_size, dry_run=args.dry_run)
\ No newline at end of file
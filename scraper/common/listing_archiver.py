@@ -0,0 +1,238 @@
+import argparse
+import datetime
+import os
+import sys
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, bindparam, text
+
+# 1. 環境変数の読み込み
+# 実行ファイルからの相対パスで .env を探す
+current_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(current_dir, '..', '.env')
+load_dotenv(dotenv_path=env_path)
+
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common import profiling
+
+def get_env_or_exit(key, default=None, required=True):
+    """
+    環境変数を取得する。
+    required=True の場合、値が取得できなければプログラムを終了させる（セキュリティ対策）。
+    """
+    val = os.getenv(key, default)
+    if required and val is None:
+        print(f"致命的エラー: 必須の環境変数 '{key}' が設定されていません。")
+        sys.exit(1)
+    return val
+
+# DB設定: セキュリティのため機密情報はデフォルト値を設定せず必須（required=True）とする
+DB_USER = get_env_or_exit("DB_USERNAME")
+DB_PASS = get_env_or_exit("DB_PASSWORD")
+DB_NAME = get_env_or_exit("DB_DATABASE")
+
+# 接続先やポートは、機密情報ではないため利便性のためにデフォルト値を残しても許容される
+DB_HOST = get_env_or_exit("DB_HOST", default="db")
+DB_PORT = get_env_or_exit("DB_PORT", default="3306")
+
+DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+engine = create_engine(DATABASE_URL)
+
+# 2. 退避の設定
+DEFAULT_ARCHIVE_DAYS = 30
+DEFAULT_BATCH_SIZE = 1000
+
+# listings と listings_archive で共通のカラム（ID を含めてそのまま移す）
+LISTING_COLUMNS = [
+    "id", "bike_model_id", "shop_id", "site_id", "title", "source_url", "url_hash",
+    "price", "total_price", "model_year", "mileage", "image_urls", "local_image_paths",
+    "local_image_derivatives", "fingerprint", "is_sold_out", "created_at", "updated_at",
+]
+
+# listings_archive.price_history (JSON配列) に詰める価格履歴のカラムと型
+HISTORY_COLUMNS = {
+    "price": "DECIMAL(12,0)",
+    "total_price": "DECIMAL(12,0)",
+    "mileage": "INT",
+    "previous_price": "DECIMAL(12,0)",
+    "previous_total_price": "DECIMAL(12,0)",
+    "previous_mileage": "INT",
+    "recorded_at": "DATETIME(6)",
+}
+
+# listings_archive.details (JSON) に詰める詳細ページの補完結果 (listing_details) のカラムと型
+DETAIL_COLUMNS = {
+    "status": "VARCHAR(20)",
+    "attempts": "INT",
+    "displacement": "INT",
+    "color": "VARCHAR(50)",
+    "inspection": "VARCHAR(50)",
+    "image_urls": "JSON",
+    "error": "VARCHAR(255)",
+    "enriched_at": "DATETIME(6)",
+    "created_at": "DATETIME(6)",
+    "updated_at": "DATETIME(6)",
+}
+
+LISTING_COLUMN_SQL = ", ".join(LISTING_COLUMNS)
+HISTORY_JSON_SQL = "JSON_OBJECT(" + ", ".join(f"'{c}', h.{c}" for c in HISTORY_COLUMNS) + ")"
+HISTORY_TABLE_SQL = ", ".join(f"{c} {t} PATH '$.{c}'" for c, t in HISTORY_COLUMNS.items())
+DETAIL_JSON_SQL = "JSON_OBJECT(" + ", ".join(f"'{c}', d.{c}" for c in DETAIL_COLUMNS) + ")"
+DETAIL_TABLE_SQL = ", ".join(f"{c} {t} PATH '$.{c}'" for c, t in DETAIL_COLUMNS.items())
+
+ARCHIVE_SQL = text(f"""
+    INSERT INTO listings_archive ({LISTING_COLUMN_SQL}, price_history, details, archived_at)
+    SELECT {", ".join("l." + c for c in LISTING_COLUMNS)},
+           (SELECT JSON_ARRAYAGG({HISTORY_JSON_SQL}) FROM listing_price_history h WHERE h.listing_id = l.id),
+           (SELECT {DETAIL_JSON_SQL} FROM listing_details d WHERE d.listing_id = l.id),
+           NOW()
+    FROM listings l
+    WHERE l.id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+# listing_price_history・listing_details は外部キー (ON DELETE CASCADE) により一緒に削除される
+DELETE_LISTINGS_SQL = text("DELETE FROM listings WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+
+RESTORE_SQL = text(f"""
+    INSERT INTO listings ({LISTING_COLUMN_SQL})
+    SELECT {LISTING_COLUMN_SQL} FROM listings_archive WHERE id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+RESTORE_HISTORY_SQL = text(f"""
+    INSERT INTO listing_price_history (listing_id, {", ".join(HISTORY_COLUMNS)})
+    SELECT a.id, {", ".join("jt." + c for c in HISTORY_COLUMNS)}
+    FROM listings_archive a,
+         JSON_TABLE(a.price_history, '$[*]' COLUMNS ({HISTORY_TABLE_SQL})) AS jt
+    WHERE a.id IN :ids AND a.price_history IS NOT NULL
+""").bindparams(bindparam("ids", expanding=True))
+
+RESTORE_DETAILS_SQL = text(f"""
+    INSERT INTO listing_details (listing_id, {", ".join(DETAIL_COLUMNS)})
+    SELECT a.id, {", ".join("jt." + c for c in DETAIL_COLUMNS)}
+    FROM listings_archive a,
+         JSON_TABLE(a.details, '$' COLUMNS ({DETAIL_TABLE_SQL})) AS jt
+    WHERE a.id IN :ids AND a.details IS NOT NULL
+""").bindparams(bindparam("ids", expanding=True))
+
+DELETE_ARCHIVE_SQL = text("DELETE FROM listings_archive WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+
+def report_hot_table(label):
+    """listings（ホットテーブル）の行数とサイズを表示する"""
+    with engine.connect() as conn:
+        # information_schema の統計を最新化してからサイズを取得
+        conn.execute(text("ANALYZE TABLE listings")).all()
+        total_rows = conn.execute(text("SELECT COUNT(*) FROM listings")).scalar()
+        sold_out_rows = conn.execute(text("SELECT COUNT(*) FROM listings WHERE is_sold_out = 1")).scalar()
+        size_bytes = conn.execute(text(
+            "SELECT data_length + index_length FROM information_schema.TABLES "
+            "WHERE table_schema = DATABASE() AND table_name = 'listings'"
+        )).scalar() or 0
+    print(f"  [{label}] listings: {total_rows} 行 (うち掲載終了 {sold_out_rows} 行), 約 {size_bytes / 1024 / 1024:.1f} MB")
+
+def iter_archive_candidates(cutoff, batch_size):
+    """掲載終了から cutoff より前に更新が止まった出品IDを、ID順に batch_size 件ずつ返す"""
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            ids = conn.execute(
+                text(
+                    "SELECT id FROM listings "
+                    "WHERE is_sold_out = 1 AND updated_at < :cutoff AND id > :last_id "
+                    "ORDER BY id LIMIT :limit"
+                ),
+                {"cutoff": cutoff, "last_id": last_id, "limit": batch_size},
+            ).scalars().all()
+        if not ids:
+            return
+        last_id = ids[-1]
+        yield ids
+
+def iter_restore_targets(ids, since, batch_size):
+    """復元対象のIDを batch_size 件ずつ返す（ID指定または退避日時の下限指定）"""
+    if ids:
+        for i in range(0, len(ids), batch_size):
+            yield ids[i:i + batch_size]
+        return
+
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            chunk = conn.execute(
+                text(
+                    "SELECT id FROM listings_archive "
+                    "WHERE archived_at >= :since AND id > :last_id "
+                    "ORDER BY id LIMIT :limit"
+                ),
+                {"since": since, "last_id": last_id, "limit": batch_size},
+            ).scalars().all()
+        if not chunk:
+            return
+        last_id = chunk[-1]
+        yield chunk
+
+def archive(days=DEFAULT_ARCHIVE_DAYS, batch_size=DEFAULT_BATCH_SIZE, dry_run=False, optimize=False):
+    """掲載終了から days 日以上経過した出品を listings_archive へバッチ単位で移動する"""
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    print(f"掲載終了から {days} 日以上経過した出品の退避を開始します（基準日時: {cutoff:%Y-%m-%d %H:%M}）...")
+    report_hot_table("退避前")
+
+    total = 0
+    for ids in iter_archive_candidates(cutoff, batch_size):
+        if not dry_run:
+            # 1バッチ = 1トランザクション（コピーと削除を同時に確定させる）
+            with engine.begin() as conn:
+                conn.execute(ARCHIVE_SQL, {"ids": ids})
+                conn.execute(DELETE_LISTINGS_SQL, {"ids": ids})
+        total += len(ids)
+        print(f"  [バッチ] 最終ID {ids[-1]}: {len(ids)} 件{'が対象' if dry_run else 'を退避'} (累計 {total} 件)")
+
+    if dry_run:
+        print(f"\n完了（ドライラン）: {total} 件が退避対象です。")
+        return
+
+    if optimize and total > 0:
+        # InnoDB は削除だけではファイルサイズが縮まないため、必要に応じて再構築する
+        print("listings を再構築しています (OPTIMIZE TABLE)...")
+        with engine.connect() as conn:
+            conn.execute(text("OPTIMIZE TABLE listings")).all()
+
+    report_hot_table("退避後")
+    print(f"\n完了: {total} 件を listings_archive に退避しました。")
+
+def restore(ids=None, since=None, batch_size=DEFAULT_BATCH_SIZE):
+    """listings_archive から元のIDのまま listings と価格履歴・詳細ページの補完結果を復元する"""
+    print("退避済み出品の復元を開始します...")
+    report_hot_table("復元前")
+
+    total = 0
+    for chunk in iter_restore_targets(ids, since, batch_size):
+        with engine.begin() as conn:
+            conn.execute(RESTORE_SQL, {"ids": chunk})
+            conn.execute(RESTORE_HISTORY_SQL, {"ids": chunk})
+            conn.execute(RESTORE_DETAILS_SQL, {"ids": chunk})
+            conn.execute(DELETE_ARCHIVE_SQL, {"ids": chunk})
+        total += len(chunk)
+        print(f"  [バッチ] {len(chunk)} 件を復元 (累計 {total} 件)")
+
+    report_hot_table("復元後")
+    print(f"\n完了: {total} 件を listings に復元しました。")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="掲載終了した出品を listings_archive へ退避・復元する")
+    parser.add_argument("--days", type=int, default=DEFAULT_ARCHIVE_DAYS, help="掲載終了後、退避するまでの日数")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="1トランザクションで移動する件数")
+    parser.add_argument("--dry-run", action="store_true", help="移動せず対象件数だけを表示する")
+    parser.add_argument("--optimize", action="store_true", help="退避後に OPTIMIZE TABLE で listings を再構築する")
+    parser.add_argument("--restore-ids", default=None, help="復元する出品ID（カンマ区切り）")
+    parser.add_argument("--restore-since", default=None, help="この日時以降に退避した出品を復元する (例: 2026-01-01)")
+    profiling.add_argument(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with profiling.profile(args.profile):
+        if args.restore_ids or args.restore_since:
+            restore_ids = [int(v) for v in args.restore_ids.split(",") if v.strip()] if args.restore_ids else None
+            restore(ids=restore_ids, since=args.restore_since, batch_size=args.batch_size)
+        else:
+            archive(days=args.days, batch_size=args.batch_size, dry_run=args.dry_run, optimize=args.optimize)
\ No newline at end of file
@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, Column, BigInteger, Integer, String, JSON, DateTime, literal_column, text
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import DeclarativeBase
+
+# 1. 環境変数の読み込み
+# 実行ファイルからの相対パスで .env を探す
+current_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(current_dir, '..', '.env')
+load_dotenv(dotenv_path=env_path)
+
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common import profiling, prom_metrics, run_metrics, tracing
+from common.parsers import bds, goobike
+
+def get_env_or_exit(key, default=None, required=True):
+    """
+    環境変数を取得する。
+    required=True の場合、値が取得できなければプログラムを終了させる（セキュリティ対策）。
+    """
+    val = os.getenv(key, default)
+    if required and val is None:
+        print(f"致命的エラー: 必須の環境変数 '{key}' が設定されていません。")
+        sys.exit(1)
+    return val
+
+# DB設定: セキュリティのため機密情報はデフォルト値を設定せず必須（required=True）とする
+DB_USER = get_env_or_exit("DB_USERNAME")
+DB_PASS = get_env_or_exit("DB_PASSWORD")
+DB_NAME = get_env_or_exit("DB_DATABASE")
+
+# 接続先やポートは、機密情報ではないため利便性のためにデフォルト値を残しても許容される
+DB_HOST = get_env_or_exit("DB_HOST", default="db")
+DB_PORT = get_env_or_exit("DB_PORT", default="3306")
+
+DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+engine = create_engine(DATABASE_URL)
+
+class Base(DeclarativeBase):
+    pass
+
+class ListingDetail(Base):
+    __tablename__ = "listing_details"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    listing_id = Column(BigInteger, nullable=False, unique=True)
+    status = Column(String(20), nullable=False)
+    attempts = Column(Integer, default=0)
+    displacement = Column(Integer, nullable=True)
+    color = Column(String(50), nullable=True)
+    inspection = Column(String(50), nullable=True)
+    image_urls = Column(JSON, nullable=True)
+    error = Column(String(255), nullable=True)
+    enriched_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class EnrichmentWatermark(Base):
+    __tablename__ = "enrichment_watermarks"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    site_id = Column(BigInteger, nullable=False, unique=True)
+    last_listing_id = Column(BigInteger, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+# 2. 補完の設定
+# sites.name -> 詳細ページのパーサー
+DETAIL_PARSERS = {
+    "GooBike": goobike.parse_detail_page,
+    "BDS": bds.parse_detail_page,
+}
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 3
+CANDIDATE_CHUNK_SIZE = 500
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# キューの終端（優先度が最も低くなるよう attempts に無限大を入れる）
+QUEUE_END = (float("inf"), 0, 0, "")
+
+NEW_CANDIDATES_SQL = text("""
+    SELECT l.id, l.source_url
+    FROM listings l
+    LEFT JOIN listing_details d ON d.listing_id = l.id
+    WHERE l.site_id = :site_id AND l.is_sold_out = 0 AND l.id > :last_id AND d.id IS NULL
+    ORDER BY l.id LIMIT :limit
+""")
+
+RETRY_CANDIDATES_SQL = text("""
+    SELECT l.id, l.source_url, d.attempts
+    FROM listing_details d
+    JOIN listings l ON l.id = d.listing_id
+    WHERE l.site_id = :site_id AND l.is_sold_out = 0 AND d.status = 'failed' AND d.attempts < :max_attempts
+    ORDER BY l.id
+""")
+
+def load_watermark(conn, site_id, backfill):
+    """
+    前回の補完位置を返す。初回は既存の出品をすべて補完済みとみなし、現在の最大IDから始める
+    （--backfill 指定時は 0 から）。
+    """
+    row = conn.execute(
+        text("SELECT last_listing_id FROM enrichment_watermarks WHERE site_id = :site_id"), {"site_id": site_id}
+    ).first()
+    if row:
+        return row.last_listing_id, False
+    if backfill:
+        return 0, True
+    max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM listings WHERE site_id = :site_id"), {"site_id": site_id}).scalar()
+    return max_id, True
+
+def save_watermark(conn, site_id, last_listing_id):
+    table = EnrichmentWatermark.__table__
+    now = datetime.datetime.now()
+    stmt = insert(table).values(site_id=site_id, last_listing_id=last_listing_id, created_at=now, updated_at=now)
+    conn.execute(stmt.on_duplicate_key_update(
+        last_listing_id=stmt.inserted.last_listing_id,
+        updated_at=stmt.inserted.updated_at,
+    ))
+
+def keep_on_failure(column):
+    """失敗時は前回取得できた値を消さないよう、成功した行だけ値を上書きする"""
+    return literal_column(f"IF(VALUES(status) = 'done', VALUES({column}), {column})")
+
+class DetailWriter:
+    """
+    補完結果（成功・失敗とも）を溜めて、listing_details へまとめて書き込む。
+    書き込みに失敗したバッチは捨てずに残し、次のバッチと一緒に書き込み直す（最後の flush で失敗すれば例外になる）。
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.pending = []
+        self.done_count = 0
+        self.failed_count = 0
+
+    def add(self, listing_id, attempts, detail=None, error=None):
+        now = datetime.datetime.now()
+        row = {
+            "listing_id": listing_id,
+            "status": "failed" if error else "done",
+            "attempts": attempts,
+            "displacement": detail.displacement if detail else None,
+            "color": detail.color if detail else None,
+            "inspection": detail.inspection if detail else None,
+            "image_urls": detail.image_urls if detail else None,
+            "error": error[:255] if error else None,
+            "enriched_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.pending.append(row)
+        if error:
+            self.failed_count += 1
+        else:
+            self.done_count += 1
+        # 失敗して残ったバッチがあっても、書き込み直すのは batch_size 件増えるごとにする
+        if len(self.pending) % self.batch_size == 0:
+            self.try_flush()
+
+    def try_flush(self):
+        """
+        取得中の書き込み。ワーカーが例外で止まるとキューが空かず produce() が待ち続けるため、
+        ここでは例外を送出せずに記録だけする。
+        """
+        try:
+            self.flush()
+        except Exception as e:
+            run_metrics.count("errors")
+            print(f"  [エラー] 補完結果の書き込みに失敗しました。{len(self.pending)} 件は次の書き込みでやり直します: {type(e).__name__}: {e}")
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        try:
+            self._write(rows)
+        except Exception:
+            # 書き込めなかったバッチは捨てずに戻す
+            self.pending = rows + self.pending
+            raise
+        print(f"  [書き込み] {len(rows)} 件 (取得済み 累計 {self.done_count} 件 / 失敗 累計 {self.failed_count} 件)")
+
+    def _write(self, rows):
+        table = ListingDetail.__table__
+        stmt = insert(table)
+        # まとめ書き込みは、バッチを満たした出品の作業単位の persist として記録される
+        with tracing.span("persist", rows=len(rows)), engine.begin() as conn, prom_metrics.timed(prom_metrics.DB_BATCH_SECONDS, operation="listing_details_upsert"):
+            conn.execute(
+                stmt.on_duplicate_key_update(
+                    status=stmt.inserted.status,
+                    attempts=stmt.inserted.attempts,
+                    displacement=keep_on_failure("displacement"),
+                    color=keep_on_failure("color"),
+                    inspection=keep_on_failure("inspection"),
+                    image_urls=keep_on_failure("image_urls"),
+                    error=stmt.inserted.error,
+                    enriched_at=stmt.inserted.enriched_at,
+                    updated_at=stmt.inserted.updated_at,
+                ),
+                rows,
+            )
+
+async def produce(queue, site_id, watermark, max_attempts, limit, workers, new_ids):
+    """
+    補完対象を優先度付きキューに積む。キューの上限に達すると取り出されるまで待つため、
+    DBから読み込む件数も取得の速度に合わせて抑えられる。
+    優先度: 新着 (attempts=0) を再試行より先に、新着の中では新しい出品から。
+    """
+    queued = 0
+
+    with engine.connect() as conn:
+        retries = conn.execute(RETRY_CANDIDATES_SQL, {"site_id": site_id, "max_attempts": max_attempts}).all()
+    for row in retries:
+        await queue.put((row.attempts, -row.id, row.id, row.source_url))
+        prom_metrics.set_gauge(prom_metrics.QUEUE_DEPTH, queue.qsize(), queue="enrich")
+
+    last_id = watermark
+    while limit is None or queued < limit:
+        chunk_limit = CANDIDATE_CHUNK_SIZE if limit is None else min(CANDIDATE_CHUNK_SIZE, limit - queued)
+        with engine.connect() as conn:
+            rows = conn.execute(NEW_CANDIDATES_SQL, {"site_id": site_id, "last_id": last_id, "limit": chunk_limit}).all()
+        if not rows:
+            break
+        for row in rows:
+            await queue.put((0, -row.id, row.id, row.source_url))
+            prom_metrics.set_gauge(prom_metrics.QUEUE_DEPTH, queue.qsize(), queue="enrich")
+            new_ids.append(row.id)
+        last_id = rows[-1].id
+        queued += len(rows)
+
+    for _ in range(workers):
+        await queue.put(QUEUE_END)
+    return len(retries), queued
+
+async def fetch_worker(client, queue, site, parse_detail, writer):
+    """キューから出品を取り出して詳細ページを取得・解析する"""
+    while True:
+        attempts, _, listing_id, url = await queue.get()
+        prom_metrics.set_gauge(prom_metrics.QUEUE_DEPTH, queue.qsize(), queue="enrich")
+        try:
+            if attempts == QUEUE_END[0]:
+                return
+
+            with tracing.span("detail_page", url=url, listing_id=listing_id, attempts=attempts) as unit:
+                # サーバー負荷軽減のためランダム待機
+                with tracing.span("throttle"):
+                    await asyncio.sleep(random.uniform(0.2, 0.5))
+                try:
+                    with tracing.span("fetch") as fetch_span, prom_metrics.timed(prom_metrics.PAGE_FETCH_SECONDS, site=site, page_type="detail"):
+                        resp = await client.get(url)
+                        fetch_span.set(status=resp.status_code, bytes=len(resp.content))
+                    run_metrics.page_fetched(resp.content)
+                    if resp.status_code != 200:
+                        run_metrics.count("errors")
+                        unit.set(error=f"HTTP {resp.status_code}")
+                        writer.add(listing_id, attempts + 1, error=f"HTTP {resp.status_code}")
+                        continue
+                    with tracing.span("parse"), prom_metrics.timed(prom_metrics.PARSE_SECONDS, site=site, page_type="detail"):
+                        detail = parse_detail(resp.content, str(resp.url))
+                    writer.add(listing_id, attempts + 1, detail=detail)
+                except Exception as e:
+                    run_metrics.count("errors")
+                    unit.set(error=f"{type(e).__name__}: {e}")
+                    writer.add(listing_id, attempts + 1, error=f"{type(e).__name__}: {e}")
+        finally:
+            queue.task_done()
+
+async def enrich_site(client, site_name, site_id, args):
+    print(f"\n--- {site_name} の新着出品の詳細を補完します ---")
+    with engine.begin() as conn:
+        watermark, initialized = load_watermark(conn, site_id, args.backfill)
+        if initialized:
+            # 初回は基準位置だけを記録する（--backfill なしで既存の全出品を取りに行かないため）
+            save_watermark(conn, site_id, watermark)
+    print(f"  補完位置: 出品ID {watermark} より後{'（初回のため新規に記録）' if initialized else ''}")
+
+    queue = asyncio.PriorityQueue(maxsize=args.queue_size)
+    writer = DetailWriter(args.batch_size)
+    new_ids = []
+
+    workers = [
+        asyncio.create_task(fetch_worker(client, queue, site_name.lower(), DETAIL_PARSERS[site_name], writer))
+        for _ in range(args.workers)
+    ]
+    retry_count, new_count = await produce(queue, site_id, watermark, args.max_attempts, args.limit, args.workers, new_ids)
+    run_metrics.count("retries", retry_count)
+    await asyncio.gather(*workers)
+    writer.flush()
+
+    # 取り出した新着はすべて成功・失敗のいずれかで記録済みのため、補完位置を進める
+    if new_ids:
+        with engine.begin() as conn:
+            save_watermark(conn, site_id, max(new_ids))
+
+    print(f"  -> 新着 {new_count} 件・再試行 {retry_count} 件を処理しました（取得 {writer.done_count} 件 / 失敗 {writer.failed_count} 件）。")
+
+async def run(args=None):
+    if args is None:
+        # run_all.py --in-process からは既定値で呼び出す
+        args = parse_args([])
+    with engine.connect() as conn:
+        sites = {name: site_id for site_id, name in conn.execute(text("SELECT id, name FROM sites")).all()}
+
+    targets = list(DETAIL_PARSERS) if args.site == "all" else [args.site]
+    limits = httpx.Limits(max_connections=args.workers, max_keepalive_connections=args.workers)
+    async with httpx.AsyncClient(
+        headers={"User-Agent": USER_AGENT}, timeout=20.0, follow_redirects=True, limits=limits
+    ) as client:
+        for site_name in targets:
+            if site_name not in sites:
+                print(f"エラー: sitesテーブルに '{site_name}' が見つかりません。スキップします。")
+                continue
+            await enrich_site(client, site_name, sites[site_name], args)
+
+    print("\n詳細ページの補完が完了しました。")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="前回の補完位置より後に登録された出品だけ、詳細ページから排気量・車体色・車検・全画像を補完する")
+    parser.add_argument("--site", choices=["all", *DETAIL_PARSERS], default="all", help="対象サイト")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="詳細ページを同時に取得する数")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="取得待ちキューの上限件数")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="まとめて書き込む件数")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="失敗した出品を再試行する上限回数")
+    parser.add_argument("--limit", type=int, default=None, help="1回の実行で処理する新着の上限件数")
+    parser.add_argument("--backfill", action="store_true", help="補完位置が未記録のサイトは既存の出品もすべて対象にする")
+    profiling.add_argument(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    with profiling.profile(args.profile):
+        asyncio.run(run(args))
\ No newline at end of file
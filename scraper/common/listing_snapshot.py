@@ -0,0 +1,268 @@
+"""
+既存出品のスナップショットと変更検知
+
+起動時に既存出品の (ID, 本体価格, 支払総額, 走行距離, フィンガープリント) だけをURLをキーにメモリへ読み込み、
+巡回で得たカードと比較して実際に変化した出品だけを書き込む。
+- 価格・支払総額・走行距離が変わった出品は listing_price_history に追記する
+- フィンガープリント（正規化したカード内容のハッシュ）が変わった出品だけ、url_hash をキーに listings をまとめて更新する
+  （カードで取れなかった項目は前回値を残し、画像URLが変わった出品は保存済み画像・派生画像を取り直させる。
+  その際、外した保存済み画像の参照数 (image_objects.ref_count) を同じトランザクションで減らす）
+このため毎晩全行を書き換えることはなく、書き込み量は実際の変更件数に比例する。
+掲載終了の判定 (mark_sold_out) は、今回最後まで巡回できた車種の出品だけを対象にする。
+"""
+
+import datetime
+import hashlib
+import json
+from sqlalchemy import Column, BigInteger, Numeric, Integer, String, Text, JSON, Boolean, DateTime, and_, bindparam, case, func, insert, not_, null, select, update
+from sqlalchemy.orm import DeclarativeBase
+
+from common import prom_metrics, run_metrics
+
+class Base(DeclarativeBase):
+    pass
+
+class Listing(Base):
+    __tablename__ = "listings"
+    id = Column(BigInteger, primary_key=True)
+    site_id = Column(BigInteger, nullable=False)
+    bike_model_id = Column(BigInteger, nullable=True)
+    shop_id = Column(BigInteger, nullable=True)
+    title = Column(String(255), nullable=True)
+    source_url = Column(Text, nullable=False)
+    url_hash = Column(String(40), nullable=True)
+    price = Column(Numeric(12, 0))
+    total_price = Column(Numeric(12, 0), nullable=True)
+    model_year = Column(Integer, nullable=True)
+    mileage = Column(Integer, nullable=True)
+    image_urls = Column(JSON, nullable=True)
+    local_image_paths = Column(JSON, nullable=True)
+    local_image_derivatives = Column(JSON, nullable=True)
+    fingerprint = Column(String(40), nullable=True)
+    is_sold_out = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class ListingPriceHistory(Base):
+    __tablename__ = "listing_price_history"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    listing_id = Column(BigInteger, nullable=False)
+    price = Column(Numeric(12, 0), nullable=True)
+    total_price = Column(Numeric(12, 0), nullable=True)
+    mileage = Column(Integer, nullable=True)
+    previous_price = Column(Numeric(12, 0), nullable=True)
+    previous_total_price = Column(Numeric(12, 0), nullable=True)
+    previous_mileage = Column(Integer, nullable=True)
+    recorded_at = Column(DateTime, default=datetime.datetime.now)
+
+# 変更をまとめて書き込む件数
+DEFAULT_BATCH_SIZE = 500
+
+# 掲載終了の判定で、一度に読み込む車種数・一度に更新する出品数
+SOLD_OUT_CHUNK_SIZE = 100
+
+# フィンガープリントの対象となるカードの項目（listings の更新対象カラムと同じ）
+CARD_FIELDS = ("title", "price", "total_price", "model_year", "mileage", "image_urls", "shop_id")
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+def url_hash(url):
+    """source_url の検索キー (SHA-1)。マイグレーションでの SHA1(source_url) と一致する"""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+def card_fingerprint(card):
+    """正規化したカード内容のハッシュ"""
+    normalized = [
+        (card.get("title") or "").strip(),
+        _to_int(card.get("price")),
+        _to_int(card.get("total_price")),
+        card.get("model_year"),
+        card.get("mileage"),
+        list(card.get("image_urls") or []),
+        card.get("shop_id"),
+    ]
+    return hashlib.sha1(json.dumps(normalized, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+class ListingSnapshot:
+    """既存出品のスナップショットを保持し、変化だけをバッチで記録する"""
+
+    def __init__(self, site_id, batch_size=DEFAULT_BATCH_SIZE):
+        self.site_id = site_id
+        self.batch_size = batch_size
+        # source_url -> (listing_id, price, total_price, mileage, fingerprint)
+        self.entries = {}
+        self.pending_history = []
+        self.pending_updates = []
+        self.recorded_count = 0
+        self.updated_count = 0
+
+    def load(self, db, include_sold_out=False):
+        """対象サイトの既存出品を読み込み、既知URLのセットを返す"""
+        query = db.query(
+            Listing.id, Listing.source_url, Listing.price, Listing.total_price, Listing.mileage, Listing.fingerprint
+        ).filter(Listing.site_id == self.site_id)
+        if not include_sold_out:
+            query = query.filter(Listing.is_sold_out == False)
+
+        for row in query.yield_per(10000):
+            self.entries[row.source_url] = (row.id, _to_int(row.price), _to_int(row.total_price), row.mileage, row.fingerprint)
+        return set(self.entries)
+
+    def track(self, url, listing_id, card):
+        """今回新規登録した出品をスナップショットに追加する"""
+        self.entries[url] = (listing_id, card.get("price"), card.get("total_price"), card.get("mileage"), card_fingerprint(card))
+        run_metrics.count("rows_inserted")
+
+    def observe(self, url, card):
+        """
+        既存出品の最新のカード内容を比較し、変化があれば書き込み待ちに積む。
+        取得できなかった値 (None や 本体価格 0) は「不明」とみなし、前回値を維持する。
+        戻り値はフィンガープリントが変化したかどうか。
+        """
+        entry = self.entries.get(url)
+        if entry is None:
+            return False
+
+        listing_id, old_price, old_total, old_mileage, old_fingerprint = entry
+        card = dict(card)
+        card["price"] = card.get("price") or old_price
+        if card.get("total_price") is None:
+            card["total_price"] = old_total
+        if card.get("mileage") is None:
+            card["mileage"] = old_mileage
+
+        # 1. 価格・支払総額・走行距離の変化は履歴に追記
+        if (card["price"], card["total_price"], card["mileage"]) != (old_price, old_total, old_mileage):
+            self.pending_history.append({
+                "listing_id": listing_id,
+                "price": card["price"],
+                "total_price": card["total_price"],
+                "mileage": card["mileage"],
+                "previous_price": old_price,
+                "previous_total_price": old_total,
+                "previous_mileage": old_mileage,
+            })
+
+        # 2. カード内容のいずれかが変わった出品だけを更新対象にする
+        fingerprint = card_fingerprint(card)
+        self.entries[url] = (listing_id, card["price"], card["total_price"], card["mileage"], fingerprint)
+        if fingerprint == old_fingerprint:
+            return False
+
+        row = {f"b_{field}": card.get(field) for field in CARD_FIELDS}
+        image_urls = card.get("image_urls")
+        row.update(
+            b_url_hash=url_hash(url),
+            b_fingerprint=fingerprint,
+            b_image_urls_json=json.dumps(list(image_urls), ensure_ascii=False) if image_urls is not None else None,
+        )
+        self.pending_updates.append(row)
+        return True
+
+    def has_pending(self):
+        """書き込み待ちの変更が残っているかどうか"""
+        return bool(self.pending_history or self.pending_updates)
+
+    def flush_if_full(self, db):
+        """溜まった変更がバッチサイズに達していれば書き込む"""
+        if len(self.pending_history) >= self.batch_size or len(self.pending_updates) >= self.batch_size:
+            return self.flush(db)
+        return 0
+
+    def flush(self, db):
+        """溜まった変更を価格履歴へ追記し、変化した出品だけを url_hash をキーにまとめて更新する"""
+        if not self.pending_history and not self.pending_updates:
+            return 0
+
+        history, self.pending_history = self.pending_history, []
+        updates, self.pending_updates = self.pending_updates, []
+        now = datetime.datetime.now()
+
+        if history:
+            with prom_metrics.timed(prom_metrics.DB_BATCH_SECONDS, operation="price_history_insert"):
+                db.execute(insert(ListingPriceHistory.__table__), [dict(row, recorded_at=now) for row in history])
+
+        if updates:
+            with prom_metrics.timed(prom_metrics.DB_BATCH_SECONDS, operation="listing_update"):
+                self._release_replaced_images(db, updates)
+                db.execute(_update_statement(self.site_id, now), updates)
+        db.commit()
+
+        self.recorded_count += len(history)
+        self.updated_count += len(updates)
+        run_metrics.count("rows_updated", len(updates))
+        return len(history) + len(updates)
+
+    def _release_replaced_images(self, db, updates):
+        """画像URLが変わる出品の保存済み画像の参照を外す（更新で local_image_paths が NULL に戻る行と同じ条件）"""
+        new_urls = {row["b_url_hash"]: list(row["b_image_urls"]) for row in updates if row["b_image_urls"] is not None}
+        if not new_urls:
+            return
+        table = Listing.__table__
+        rows = db.execute(
+            select(table.c.url_hash, table.c.image_urls, table.c.local_image_paths)
+            .where(table.c.site_id == self.site_id)
+            .where(table.c.url_hash.in_(list(new_urls)))
+            .where(table.c.local_image_paths != None)
+            .with_for_update()
+        ).all()
+        released = [path for row in rows if (row.image_urls or []) != new_urls[row.url_hash] for path in row.local_image_paths or []]
+        if released:
+            # image_store は読み込み時にDB設定を必須とするため、書き込む時にだけ読み込む
+            from common import image_store
+            image_store.release_refs(db, released)
+
+def _update_statement(site_id, now):
+    """
+    変化した出品をまとめて更新する文。カードで取れなかった (None の) 項目は前回値を残す。
+    画像URLが変わった出品は local_image_paths・local_image_derivatives を NULL に戻し、次の画像の同期で取り直させる。
+    （MySQL は SET を左から順に評価するため、image_urls を書き換える前に比較する）
+    """
+    table = Listing.__table__
+    new_images = bindparam("b_image_urls_json", type_=String)
+    images_changed = and_(
+        new_images != None,
+        not_(table.c.image_urls.is_not_distinct_from(func.json_extract(new_images, "$"))),
+    )
+    return (
+        update(table)
+        .where(table.c.site_id == site_id)
+        .where(table.c.url_hash == bindparam("b_url_hash"))
+        .ordered_values(
+            (table.c.local_image_paths, case((images_changed, null()), else_=table.c.local_image_paths)),
+            (table.c.local_image_derivatives, case((images_changed, null()), else_=table.c.local_image_derivatives)),
+            *((table.c[field], func.coalesce(bindparam(f"b_{field}", type_=table.c[field].type), table.c[field])) for field in CARD_FIELDS),
+            (table.c.fingerprint, bindparam("b_fingerprint")),
+            (table.c.updated_at, now),
+        )
+    )
+
+def mark_sold_out(db, site_id, bike_model_ids, found_urls, chunk_size=SOLD_OUT_CHUNK_SIZE):
+    """
+    最後まで巡回できた車種 (bike_model_ids) の販売中の出品のうち、今回見つからなかったものを掲載終了にする。
+    巡回しなかった・失敗した車種の出品には触れないため、一部のメーカーだけの巡回や分割した巡回でも安全。
+    更新した件数を返す。
+    """
+    table = Listing.__table__
+    model_ids = sorted(bike_model_ids)
+    missing_ids = []
+    for i in range(0, len(model_ids), chunk_size):
+        rows = db.execute(
+            select(table.c.id, table.c.source_url)
+            .where(table.c.site_id == site_id)
+            .where(table.c.bike_model_id.in_(model_ids[i:i + chunk_size]))
+            .where(table.c.is_sold_out == False)
+        )
+        missing_ids.extend(row.id for row in rows if row.source_url not in found_urls)
+
+    now = datetime.datetime.now()
+    for i in range(0, len(missing_ids), chunk_size):
+        with prom_metrics.timed(prom_metrics.DB_BATCH_SECONDS, operation="sold_out_update"):
+            db.execute(
+                update(table)
+                .where(table.c.id.in_(missing_ids[i:i + chunk_size]))
+                .values(is_sold_out=True, updated_at=now)
+            )
+    db.commit()
+    run_metrics.count("rows_sold_out", len(missing_ids))
+    return len(missing_ids)
\ No newline at end of file
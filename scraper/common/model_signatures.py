@@ -0,0 +1,103 @@
+"""
+車種ページの変化検知（差分巡回）
+
+メーカーページに表示される車種ごとの在庫台数と、前回巡回時の一覧の先頭URLを model_crawl_signatures に保存する。
+差分巡回では、在庫台数が前回と同じ車種の一覧ページを開かずに飛ばす。
+- 台数が変わらないまま入れ替わった出品（1台売れて1台入荷など）を取りこぼさないよう、
+  最後に一覧を開いてから refresh_days 日以上経った車種は必ず巡回する
+- 在庫台数が表示されていない車種は常に巡回する
+- 飛ばした車種は掲載終了判定の対象外になる (listing_snapshot.mark_sold_out)
+"""
+
+import datetime
+from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import DeclarativeBase
+
+class Base(DeclarativeBase):
+    pass
+
+class ModelCrawlSignature(Base):
+    __tablename__ = "model_crawl_signatures"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    site_id = Column(BigInteger, nullable=False)
+    identifier = Column(String(100), nullable=False)
+    stock_count = Column(Integer, nullable=True)
+    top_url = Column(Text, nullable=True)
+    last_crawled_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+# 在庫台数が変わらなくても、この日数が経った車種は一覧を開き直す
+DEFAULT_REFRESH_DAYS = 7
+
+class ModelSignatures:
+    """サイトごとの車種のシグネチャ（在庫台数・先頭URL）を保持し、巡回を飛ばせるか判定する"""
+
+    def __init__(self, site_id, refresh_days=DEFAULT_REFRESH_DAYS):
+        self.site_id = site_id
+        self.refresh_days = refresh_days
+        # identifier -> (stock_count, top_url, last_crawled_at)
+        self.entries = {}
+        self.pending = {}
+        self.skipped_count = 0
+        # 在庫台数は同じなのに先頭の出品が入れ替わっていた車種の数（refresh_days の目安）
+        self.silent_change_count = 0
+
+    def load(self, db):
+        for row in db.query(
+            ModelCrawlSignature.identifier, ModelCrawlSignature.stock_count,
+            ModelCrawlSignature.top_url, ModelCrawlSignature.last_crawled_at,
+        ).filter(ModelCrawlSignature.site_id == self.site_id):
+            self.entries[row.identifier] = (row.stock_count, row.top_url, row.last_crawled_at)
+        return len(self.entries)
+
+    def is_unchanged(self, entry, now=None):
+        """メーカーページの在庫台数が前回と同じで、定期的な再巡回の時期でもなければ True"""
+        saved = self.entries.get(entry.identifier)
+        if saved is None or entry.stock_count is None:
+            return False
+        stock_count, _, last_crawled_at = saved
+        now = now or datetime.datetime.now()
+        if last_crawled_at < now - datetime.timedelta(days=self.refresh_days):
+            return False
+        if stock_count != entry.stock_count:
+            return False
+        self.skipped_count += 1
+        return True
+
+    def record(self, entry, top_url):
+        """一覧ページを最後まで処理した車種のシグネチャを記録する（flush までは書き込まない）"""
+        saved = self.entries.get(entry.identifier)
+        if saved is not None and saved[0] == entry.stock_count and saved[1] != top_url:
+            self.silent_change_count += 1
+        now = datetime.datetime.now()
+        self.entries[entry.identifier] = (entry.stock_count, top_url, now)
+        self.pending[entry.identifier] = {
+            "site_id": self.site_id,
+            "identifier": entry.identifier,
+            "stock_count": entry.stock_count,
+            "top_url": top_url,
+            "last_crawled_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    def flush(self, db):
+        """
+        記録したシグネチャをまとめて書き込む。
+        価格変化などの書き込みより先に保存すると、中断時にその車種が次回飛ばされるため、巡回の最後に呼ぶこと。
+        """
+        if not self.pending:
+            return 0
+        rows = list(self.pending.values())
+        self.pending = {}
+        stmt = insert(ModelCrawlSignature.__table__)
+        db.execute(stmt.on_duplicate_key_update(
+            stock_count=stmt.inserted.stock_count,
+            top_url=stmt.inserted.top_url,
+            last_crawled_at=stmt.inserted.last_crawled_at,
+            updated_at=stmt.inserted.updated_at,
+        ), rows)
+        db.commit()
+        return len(rows)
\ No newline at end of file
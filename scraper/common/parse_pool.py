@@ -0,0 +1,73 @@
+"""
+一覧ページの解析をプロセスプールで並列化する
+
+ブラウザを使わない巡回 (Scrapy) では、HTMLの解析と正規表現の処理がイベントループのスレッドを占有し、
+1コアで頭打ちになる。取得したページの bytes をそのままワーカープロセスへ渡して解析させ、
+結果の ListingPage（小さなレコード）だけをDB書き込み側に戻す。
+- 同時に解析待ちにできるページ数を max_in_flight で制限し、メモリの膨張を防ぐ
+- workers が 1 以下、または巡回対象が少ない場合はプロセスを立てずにその場で解析する
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from common import prom_metrics
+from common.parsers import bds, goobike
+
+PARSERS = {
+    "goobike": goobike.parse_listing_page,
+    "bds": bds.parse_listing_page,
+}
+
+# 巡回する車種ページがこれより少なければ、プロセス起動のコストの方が大きいためその場で解析する
+INLINE_THRESHOLD = 50
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def _parse(site, html, page_url):
+    """ワーカープロセス側で実行する解析処理"""
+    return PARSERS[site](html, page_url)
+
+class ParsePool:
+    """一覧ページの解析を受け付けるプール（asyncio から await で使う）"""
+
+    def __init__(self, site, workers=None, max_in_flight=None, expected_pages=None):
+        if site not in PARSERS:
+            raise ValueError(f"未対応のサイトです: {site}")
+        self.site = site
+        self.workers = default_workers() if workers is None else workers
+        # 解析待ち + 解析中のページ数の上限（既定はワーカー数の2倍）
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.inline = self.workers <= 1 or (expected_pages is not None and expected_pages < INLINE_THRESHOLD)
+        self.executor = None
+        self.semaphore = None
+        self.parsed_count = 0
+
+    def describe(self):
+        if self.inline:
+            return "解析: インライン"
+        return f"解析: プロセスプール (ワーカー {self.workers}, 同時解析上限 {self.max_in_flight} ページ)"
+
+    async def parse(self, html, page_url):
+        """ページのHTMLを解析し ListingPage を返す"""
+        self.parsed_count += 1
+        if self.inline:
+            with prom_metrics.timed(prom_metrics.PARSE_SECONDS, site=self.site, page_type="model"):
+                return _parse(self.site, html, page_url)
+
+        # イベントループ上で作る必要があるため、最初の呼び出し時に用意する
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async with prom_metrics.acquire(self.semaphore, "parse_pool"):
+            loop = asyncio.get_running_loop()
+            with prom_metrics.timed(prom_metrics.PARSE_SECONDS, site=self.site, page_type="model"):
+                return await loop.run_in_executor(self.executor, _parse, self.site, html, page_url)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""
+サイトごとの一覧・詳細ページパーサー
+
+HTML (bytes または str) とページURLを受け取り、型付きのレコード (ListingCard / ListingDetail / ModelEntry) を返す純粋関数の集まり。
+Playwright 版・Scrapy 版のコレクターはどちらもここを通して解析するため、セレクタや正規表現の修正は1か所で済む。
+lxml (C 実装) で解析し、セレクタはモジュール読み込み時にコンパイル済み。
+"""
+
+from . import bds, goobike
+from .records import ListingCard, ListingDetail, ListingPage, ModelEntry
+
+__all__ = ["bds", "goobike", "ListingCard", "ListingDetail", "ListingPage", "ModelEntry"]
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+BDS の一覧・詳細ページのパーサー
+
+Playwright 版・Scrapy 版のどちらのコレクターからも、取得したHTMLを渡して使う。
+"""
+
+import re
+from urllib.parse import urljoin
+
+from lxml.cssselect import CSSSelector
+
+from .records import (
+    ListingCard, ListingDetail, ListingPage, ModelEntry, element_text, find_spec, image_gallery,
+    parse_document, parse_integer, parse_man_yen, parse_stock_count, parse_year, spec_pairs,
+)
+
+# セレクタは読み込み時に一度だけコンパイルする
+SEL_CARD = CSSSelector("li.type_bike, li.type_bike_sp")
+SEL_TITLE_LINK = CSSSelector(".c-search_block_title a, .c-search_block_title02 a")
+SEL_PRICE_ITEM = CSSSelector(".c-search_block_price")
+SEL_PRICE_LABEL = CSSSelector(".c-search_block_price_title")
+SEL_PRICE_VALUE = CSSSelector(".c-search_block_price_text")
+SEL_STATUS_COL = CSSSelector(".c-search_status_col")
+SEL_STATUS_HEAD = CSSSelector(".c-search_status_head")
+SEL_STATUS_VALUE = CSSSelector(".c-search_status_title01")
+SEL_IMAGE = CSSSelector(".c-bike_image figure.c-img_cover")
+SEL_SHOP_LINK = CSSSelector(".c-search_block_bottom_lead a")
+SEL_NEXT_PAGE = CSSSelector("div.c-pager a.c-btn_next")
+
+# メーカーページの車種一覧
+SEL_MODEL_ITEM = CSSSelector(".model_item")
+SEL_MODEL_INPUT = CSSSelector("input.model-checkbox")
+SEL_MODEL_LINK = CSSSelector("a.c-bike_image")
+
+# 詳細ページの画像ギャラリー（メイン画像とサムネイル）
+SEL_DETAIL_IMAGES = CSSSelector(".c-detail_slider img, .c-detail_slider figure, .c-detail_thumb img")
+DETAIL_IMAGE_ATTRS = ("data-src", "src")
+
+SHOP_ID_PATTERN = re.compile(r'client/(\d+)')
+
+def _first(selector, el):
+    found = selector(el)
+    return found[0] if found else None
+
+def parse_card(el, page_url):
+    """車両カード (li.type_bike) 1件を解析する。車両へのリンクがなければ None"""
+    link = _first(SEL_TITLE_LINK, el)
+    href = link.get("href") if link is not None else None
+    if not href:
+        return None
+
+    card = ListingCard(url=urljoin(page_url, href), title=element_text(link))
+
+    # 本体価格・支払総額（ラベルで判別）
+    for item in SEL_PRICE_ITEM(el):
+        label = _first(SEL_PRICE_LABEL, item)
+        value = _first(SEL_PRICE_VALUE, item)
+        if label is None or value is None:
+            continue
+        num = parse_man_yen(value.text_content())
+        if num is None:
+            continue
+        l_text = label.text_content()
+        if "本体価格" in l_text:
+            card.price = num
+        elif "支払総額" in l_text:
+            card.total_price = num
+
+    # スペック欄（モデル年・走行距離・排気量）
+    for col in SEL_STATUS_COL(el):
+        head = _first(SEL_STATUS_HEAD, col)
+        value = _first(SEL_STATUS_VALUE, col)
+        if head is None or value is None:
+            continue
+        h_txt = head.text_content()
+        v_txt = value.text_content()
+        if "モデル年" in h_txt and "不明" not in v_txt:
+            card.model_year = parse_year(v_txt)
+        elif "距離" in h_txt:
+            card.mileage = parse_integer(v_txt)
+        elif "排気量" in h_txt:
+            card.displacement = parse_integer(v_txt)
+
+    # 画像（遅延読み込みの data-src 属性を優先し、プレースホルダー画像は除外）
+    img = _first(SEL_IMAGE, el)
+    if img is not None:
+        img_url = img.get("data-src") or img.get("src")
+        if img_url and "blank" not in img_url:
+            card.image_urls.append(urljoin(page_url, img_url))
+
+    # 販売店の識別番号
+    shop_link = _first(SEL_SHOP_LINK, el)
+    if shop_link is not None:
+        match = SHOP_ID_PATTERN.search(shop_link.get("href") or "")
+        if match:
+            card.shop_identifier = match.group(1)
+
+    return card
+
+def parse_listing_page(html, page_url):
+    """車種ごとの出品一覧ページを解析する。次ページがあれば next_url に絶対URLで入れる"""
+    page = ListingPage()
+    doc = parse_document(html)
+    if doc is None:
+        return page
+
+    for el in SEL_CARD(doc):
+        card = parse_card(el, page_url)
+        if card is not None:
+            page.cards.append(card)
+
+    next_link = _first(SEL_NEXT_PAGE, doc)
+    if next_link is not None and next_link.get("href"):
+        page.next_url = urljoin(page_url, next_link.get("href"))
+    return page
+
+def parse_maker_page(html, page_url):
+    """メーカーページ (.model_item) の車種一覧を解析する。識別番号かリンクのない車種は除く"""
+    entries = []
+    doc = parse_document(html)
+    if doc is None:
+        return entries
+
+    for item in SEL_MODEL_ITEM(doc):
+        model_input = _first(SEL_MODEL_INPUT, item)
+        link = _first(SEL_MODEL_LINK, item)
+        identifier = model_input.get("value") if model_input is not None else None
+        href = link.get("href") if link is not None else None
+        if identifier and href:
+            entries.append(ModelEntry(
+                identifier=identifier,
+                url=urljoin(page_url, href),
+                stock_count=parse_stock_count(item.text_content()),
+            ))
+    return entries
+
+def parse_detail_page(html, page_url):
+    """車両の詳細ページからスペック表（排気量・車体色・車検）と全画像を取り出す"""
+    detail = ListingDetail()
+    doc = parse_document(html)
+    if doc is None:
+        return detail
+
+    pairs = spec_pairs(doc)
+    displacement = find_spec(pairs, "排気量")
+    detail.displacement = parse_integer(displacement) if displacement else None
+    detail.color = find_spec(pairs, "色", "カラー")
+    detail.inspection = find_spec(pairs, "車検")
+    detail.image_urls = image_gallery(SEL_DETAIL_IMAGES(doc), page_url, DETAIL_IMAGE_ATTRS)
+    return detail
\ No newline at end of file
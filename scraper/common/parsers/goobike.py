@@ -0,0 +1,128 @@
+"""
+GooBike の一覧・詳細ページのパーサー
+
+Playwright 版・Scrapy 版のどちらのコレクターからも、取得したHTMLを渡して使う。
+"""
+
+import re
+from urllib.parse import urljoin
+
+from lxml.cssselect import CSSSelector
+
+from .records import (
+    ListingCard, ListingDetail, ListingPage, ModelEntry, element_text, find_spec, image_gallery,
+    parse_document, parse_integer, parse_man_yen, parse_stock_count, parse_year, spec_pairs,
+)
+
+# セレクタは読み込み時に一度だけコンパイルする
+SEL_CARD = CSSSelector(".bike_sec")
+SEL_TITLE_LINK = CSSSelector("h4 span a")
+SEL_PRICE = CSSSelector("td.num_td")
+SEL_TOTAL_PRICE = CSSSelector("span.total, .price_total")
+SEL_SPEC = CSSSelector(".cont01 ul li")
+SEL_IMAGE = CSSSelector(".bike_img img")
+SEL_SHOP_LINK = CSSSelector(".shop_name a")
+
+# メーカーページの車種一覧
+SEL_MODEL_ITEM = CSSSelector("li.bike_list")
+SEL_MODEL_INPUT = CSSSelector("input[name='model']")
+SEL_MODEL_LINK = CSSSelector("a")
+
+# 詳細ページの画像ギャラリー（メイン画像とサムネイル）
+SEL_DETAIL_IMAGES = CSSSelector("#photo_area img, .photo_list img, .thumb_list img")
+DETAIL_IMAGE_ATTRS = ("real-url", "data-src", "src")
+
+SHOP_ID_PATTERN = re.compile(r'client_(\d+)')
+
+def _first(selector, el):
+    found = selector(el)
+    return found[0] if found else None
+
+def parse_card(el, page_url):
+    """車両カード (.bike_sec) 1件を解析する。車両へのリンクがなければ None"""
+    link = _first(SEL_TITLE_LINK, el)
+    href = link.get("href") if link is not None else None
+    if not href:
+        return None
+
+    card = ListingCard(url=urljoin(page_url, href), title=element_text(link))
+
+    # 本体価格・支払総額（万円表記、子要素を含めたテキストから）
+    price_el = _first(SEL_PRICE, el)
+    if price_el is not None:
+        card.price = parse_man_yen(price_el.text_content()) or 0
+    total_texts = [t.text_content() for t in SEL_TOTAL_PRICE(el)]
+    if total_texts:
+        card.total_price = parse_man_yen("".join(total_texts))
+
+    # 年式・走行距離
+    for li in SEL_SPEC(el):
+        li_text = li.text_content()
+        if "年式" in li_text:
+            card.model_year = parse_year(li_text)
+        elif "走行" in li_text:
+            card.mileage = parse_integer(li_text)
+
+    # 画像（遅延読み込みの real-url 属性を優先）
+    img = _first(SEL_IMAGE, el)
+    if img is not None:
+        img_url = img.get("real-url") or img.get("src")
+        if img_url:
+            card.image_urls.append(urljoin(page_url, img_url))
+
+    # 販売店の識別番号
+    shop_link = _first(SEL_SHOP_LINK, el)
+    if shop_link is not None:
+        match = SHOP_ID_PATTERN.search(shop_link.get("href") or "")
+        if match:
+            card.shop_identifier = match.group(1)
+
+    return card
+
+def parse_listing_page(html, page_url):
+    """車種ごとの出品一覧ページを解析する（GooBike は1ページに全件が載るため next_url は常に None）"""
+    page = ListingPage()
+    doc = parse_document(html)
+    if doc is None:
+        return page
+
+    for el in SEL_CARD(doc):
+        card = parse_card(el, page_url)
+        if card is not None:
+            page.cards.append(card)
+    return page
+
+def parse_maker_page(html, page_url):
+    """メーカーページ (li.bike_list) の車種一覧を解析する。識別番号かリンクのない車種は除く"""
+    entries = []
+    doc = parse_document(html)
+    if doc is None:
+        return entries
+
+    for item in SEL_MODEL_ITEM(doc):
+        model_input = _first(SEL_MODEL_INPUT, item)
+        link = _first(SEL_MODEL_LINK, item)
+        identifier = model_input.get("value") if model_input is not None else None
+        href = link.get("href") if link is not None else None
+        if identifier and href:
+            entries.append(ModelEntry(
+                identifier=identifier,
+                url=urljoin(page_url, href),
+                stock_count=parse_stock_count(item.text_content()),
+            ))
+    return entries
+
+def parse_detail_page(html, page_url):
+    """車両の詳細ページからスペック表（排気量・車体色・車検）と全画像を取り出す"""
+    detail = ListingDetail()
+    doc = parse_document(html)
+    if doc is None:
+        return detail
+
+    pairs = spec_pairs(doc)
+    displacement = find_spec(pairs, "排気量")
+    detail.displacement = parse_integer(displacement) if displacement else None
+    detail.color = find_spec(pairs, "色", "カラー")
+    detail.inspection = find_spec(pairs, "車検")
+    detail.image_urls = image_gallery(SEL_DETAIL_IMAGES(doc), page_url, DETAIL_IMAGE_ATTRS)
+    return detail
\ No newline at end of file
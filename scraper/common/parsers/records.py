@@ -0,0 +1,134 @@
+"""
+パーサーが返す型付きレコードと、サイト共通の値の正規化処理
+"""
+
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import List, Optional
+from urllib.parse import urljoin
+
+import lxml.html
+
+# 「38.5万円」「1,234万円」などの価格表記（カンマ除去後）
+MAN_YEN_PATTERN = re.compile(r'(\d+\.?\d*)')
+YEAR_PATTERN = re.compile(r'(\d{4})')
+INTEGER_PATTERN = re.compile(r'(\d+)')
+# メーカーページの車種ごとの在庫台数（「12台」「1,024 台」など）
+STOCK_COUNT_PATTERN = re.compile(r'(\d[\d,]*)\s*台')
+
+@dataclass
+class ListingCard:
+    """一覧ページの車両カード1件分"""
+    url: str
+    title: str
+    price: int = 0
+    total_price: Optional[int] = None
+    model_year: Optional[int] = None
+    mileage: Optional[int] = None
+    image_urls: List[str] = field(default_factory=list)
+    # サイト側の販売店識別番号（shop_identifiers.identifier）
+    shop_identifier: Optional[str] = None
+    # カードのスペック欄に排気量があるサイトのみ
+    displacement: Optional[int] = None
+
+    def to_card(self, shop_id):
+        """listings の更新対象カラム (listing_snapshot.CARD_FIELDS) の辞書に変換する"""
+        return {
+            "title": self.title,
+            "price": self.price,
+            "total_price": self.total_price,
+            "model_year": self.model_year,
+            "mileage": self.mileage,
+            "image_urls": list(self.image_urls),
+            "shop_id": shop_id,
+        }
+
+@dataclass
+class ListingDetail:
+    """車両の詳細ページから補完する情報"""
+    displacement: Optional[int] = None
+    color: Optional[str] = None
+    inspection: Optional[str] = None
+    image_urls: List[str] = field(default_factory=list)
+
+@dataclass
+class ModelEntry:
+    """メーカーページに並ぶ車種1件分（出品一覧ページへのリンクと在庫台数）"""
+    # サイト側の車種識別番号（bike_model_identifiers.identifier）
+    identifier: str
+    url: str
+    # ページに表示されている在庫台数（表示がなければ None）
+    stock_count: Optional[int] = None
+
+@dataclass
+class ListingPage:
+    """一覧ページ1枚分の解析結果"""
+    cards: List[ListingCard] = field(default_factory=list)
+    next_url: Optional[str] = None
+
+def parse_document(html):
+    """HTML (bytes または str) を lxml のツリーに変換する。空のページは None"""
+    if not html or not html.strip():
+        return None
+    return lxml.html.document_fromstring(html)
+
+def element_text(el):
+    """要素配下のすべてのテキストを、空白を詰めて返す"""
+    if el is None:
+        return ""
+    return " ".join(el.text_content().split())
+
+def spec_pairs(doc):
+    """スペック表 (th/td, dt/dd) を「見出し -> 値」の辞書にする。同じ見出しは最初のものを採用"""
+    pairs = {}
+    for head in doc.iter("th", "dt"):
+        value = head.getnext()
+        while value is not None and value.tag not in ("td", "dd"):
+            value = value.getnext()
+        label = element_text(head)
+        if value is not None and label and label not in pairs:
+            pairs[label] = element_text(value)
+    return pairs
+
+def find_spec(pairs, *keywords):
+    """見出しにいずれかのキーワードを含む値を返す（値が「-」「不明」などなら None）"""
+    for label, value in pairs.items():
+        if any(k in label for k in keywords):
+            if not value or value in ("-", "ー", "―", "不明", "なし"):
+                return None
+            return value
+    return None
+
+def image_gallery(images, page_url, attrs, skip_words=("blank", "noimage")):
+    """画像要素の一覧から、遅延読み込み属性を優先してURLを重複なく集める"""
+    urls = []
+    for img in images:
+        src = next((img.get(a) for a in attrs if img.get(a)), None)
+        if not src or any(w in src for w in skip_words):
+            continue
+        url = urljoin(page_url, src)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+def parse_man_yen(text):
+    """万円表記の価格を円に変換する（数値がなければ None）。float の丸め誤差を避けるため Decimal で計算する"""
+    match = MAN_YEN_PATTERN.search(text.replace(',', ''))
+    if not match:
+        return None
+    return int(Decimal(match.group(1)) * 10000)
+
+def parse_year(text):
+    match = YEAR_PATTERN.search(text)
+    return int(match.group(1)) if match else None
+
+def parse_integer(text):
+    """カンマ区切りの整数（走行距離・排気量など）"""
+    match = INTEGER_PATTERN.search(text.replace(',', ''))
+    return int(match.group(1)) if match else None
+
+def parse_stock_count(text):
+    """「12台」のような在庫台数の表記を整数にする（表記がなければ None）"""
+    match = STOCK_COUNT_PATTERN.search(text)
+    return int(match.group(1).replace(',', '')) if match else None
\ No newline at end of file
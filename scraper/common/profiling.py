@@ -0,0 +1,268 @@
+"""
+各スクリプト共通のプロファイリング (--profile=cpu|mem|async|sql|trace)
+
+スクリプトを書き換えずに、本番に近い実行のホットスポットを調べるためのもの。
+- cpu: cProfile でメインスレッドの関数ごとの所要時間を記録する (<名前>.cpu.prof は pstats / snakeviz で開ける)
+- mem: tracemalloc で一定間隔ごとに確保量の多い行の上位を記録し、最初のスナップショットからの増分も出す
+- async: 別スレッドからイベントループに定期的に割り込み、応答の遅れ (ループのラグ) とタスク数を記録する。
+  ループが長く止まった時は、その時点のループのスレッドのスタックを残す
+- sql: SQLAlchemy のエンジンイベントでステートメントをステージごとに集計し、N+1 の候補と遅いSQLを報告する (common/query_stats.py)
+- trace: 1ページなどの作業単位ごとに、待ち・取得・解析・書き込みのスパンを JSONL に記録する (common/tracing.py)
+出力は実行ごとのディレクトリ (既定は scraper/profiles/<日時>/) にまとめ、終了時に要約を表示する。
+run_all.py --profile では子プロセスにも同じモードと出力先 (SCRAPER_PROFILE / SCRAPER_PROFILE_DIR) を引き継ぐ。
+"""
+
+import asyncio
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from contextlib import contextmanager
+
+from common.query_stats import QueryStats
+from common.tracing import Tracer
+
+PROFILE_MODES = ("cpu", "mem", "async", "sql", "trace")
+PROFILE_ENV = "SCRAPER_PROFILE"
+PROFILE_DIR_ENV = "SCRAPER_PROFILE_DIR"
+PROFILE_INTERVAL_ENV = "SCRAPER_PROFILE_INTERVAL"
+
+SCRAPER_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+DEFAULT_BASE_DIR = os.path.join(SCRAPER_DIR, "profiles")
+
+# mem: スナップショットを取る間隔（秒）と、記録する上位の行数
+DEFAULT_MEM_INTERVAL = 30
+MEM_TOP_N = 20
+# async: ループへの割り込み間隔と、これ以上応答がなければ「止まっている」とみなしてスタックを残す時間（秒）
+LAG_PROBE_INTERVAL = 0.25
+BLOCKED_THRESHOLD = 0.5
+MAX_BLOCKED_STACKS = 50
+# 要約に表示する件数
+SUMMARY_TOP_N = 10
+
+def add_argument(parser):
+    """--profile を追加する（run_all.py から起動された場合は環境変数のモードを既定にする）"""
+    default = os.getenv(PROFILE_ENV) or None
+    parser.add_argument(
+        "--profile", choices=PROFILE_MODES, default=default if default in PROFILE_MODES else None,
+        help="cpu: cProfile / mem: tracemalloc の上位行 / async: イベントループのラグとタスク数 / sql: ステージごとのSQLと N+1 の候補 / trace: 作業単位ごとのスパン を記録する",
+    )
+
+def default_name():
+    """出力ファイル名に使う実行中のスクリプト名 (例: goobike_listing_collector)"""
+    script = os.path.abspath(sys.argv[0]) if sys.argv and sys.argv[0] else "python"
+    relative = os.path.relpath(script, SCRAPER_DIR)
+    if relative.startswith(".."):
+        relative = os.path.basename(script)
+    return os.path.splitext(relative)[0].replace(os.sep, "_")
+
+def run_directory():
+    """この実行の出力先。未指定なら日時のディレクトリを作り、子プロセスにも引き継ぐ"""
+    directory = os.getenv(PROFILE_DIR_ENV)
+    if not directory:
+        directory = os.path.join(DEFAULT_BASE_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+        os.environ[PROFILE_DIR_ENV] = directory
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+class CpuProfiler:
+    def __init__(self, path):
+        self.path = path
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(f"{self.path}.cpu.prof")
+        report = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=report).strip_dirs()
+        stats.sort_stats("cumulative").print_stats(50)
+        stats.sort_stats("tottime").print_stats(50)
+        with open(f"{self.path}.cpu.txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+
+        summary = io.StringIO()
+        pstats.Stats(self.profiler, stream=summary).strip_dirs().sort_stats("tottime").print_stats(SUMMARY_TOP_N)
+        lines = summary.getvalue().splitlines()
+        # ヘッダー（関数ごとの表の見出し）以降だけを要約に使う
+        start = next((i for i, line in enumerate(lines) if line.strip().startswith("ncalls")), 0)
+        return ["自身の処理時間 (tottime) の上位:"] + [line for line in lines[start:] if line.strip()]
+
+class MemoryProfiler:
+    def __init__(self, path):
+        self.path = path
+        self.interval = int(os.getenv(PROFILE_INTERVAL_ENV, DEFAULT_MEM_INTERVAL))
+        self.stopped = threading.Event()
+        self.first = None
+        self.started_at = None
+        self.thread = None
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def _write(self, snapshot, label):
+        current, peak = tracemalloc.get_traced_memory()
+        with open(f"{self.path}.mem.txt", "a", encoding="utf-8") as f:
+            f.write(f"=== {label} (経過 {time.time() - self.started_at:.0f}秒, 現在 {current / 1024 / 1024:.1f}MB, ピーク {peak / 1024 / 1024:.1f}MB) ===\n")
+            for stat in snapshot.statistics("lineno")[:MEM_TOP_N]:
+                f.write(f"{stat}\n")
+            f.write("\n")
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._write(self._snapshot(), "途中経過")
+
+    def start(self):
+        self.started_at = time.time()
+        tracemalloc.start(10)
+        self.first = self._snapshot()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        last = self._snapshot()
+        self._write(last, "終了時")
+        growth = [stat for stat in last.compare_to(self.first, "lineno") if stat.size_diff > 0]
+        with open(f"{self.path}.mem.txt", "a", encoding="utf-8") as f:
+            f.write("=== 開始時からの増分 ===\n")
+            for stat in growth[:MEM_TOP_N]:
+                f.write(f"{stat}\n")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return [f"ピーク確保量: {peak / 1024 / 1024:.1f}MB", "終了時に確保量の多い行:"] + [
+            f"  {stat}" for stat in last.statistics("lineno")[:SUMMARY_TOP_N]
+        ]
+
+class _MonitoringPolicy(asyncio.DefaultEventLoopPolicy):
+    """新しく作られたイベントループ (asyncio.run や Scrapy の asyncio リアクター) を監視対象に加える"""
+
+    def __init__(self, monitor):
+        super().__init__()
+        self.monitor = monitor
+
+    def new_event_loop(self):
+        loop = super().new_event_loop()
+        self.monitor.loops.append(loop)
+        return loop
+
+class AsyncMonitor:
+    def __init__(self, path):
+        self.path = path
+        self.loops = []
+        self.lags = []
+        self.max_tasks = 0
+        self.blocked = []
+        self.stopped = threading.Event()
+        self.loop_thread_ids = {}
+        self.previous_policy = None
+        self.thread = None
+
+    def _probe(self, loop, done):
+        self.loop_thread_ids[id(loop)] = threading.get_ident()
+        self.max_tasks = max(self.max_tasks, len(asyncio.all_tasks(loop)))
+        done.set()
+
+    def _measure(self, loop):
+        done = threading.Event()
+        started = time.perf_counter()
+        try:
+            loop.call_soon_threadsafe(self._probe, loop, done)
+        except RuntimeError:
+            # 監視の途中でループが閉じられた
+            return
+        if not done.wait(BLOCKED_THRESHOLD):
+            thread_id = self.loop_thread_ids.get(id(loop))
+            frame = sys._current_frames().get(thread_id) if thread_id else None
+            if frame is not None and len(self.blocked) < MAX_BLOCKED_STACKS:
+                self.blocked.append({"at": time.time(), "stack": traceback.format_stack(frame)})
+            while not done.wait(LAG_PROBE_INTERVAL):
+                if self.stopped.is_set() or loop.is_closed():
+                    return
+        self.lags.append(time.perf_counter() - started)
+
+    def _run(self):
+        while not self.stopped.wait(LAG_PROBE_INTERVAL):
+            for loop in list(self.loops):
+                if loop.is_closed():
+                    self.loops.remove(loop)
+                elif loop.is_running():
+                    self._measure(loop)
+
+    def start(self):
+        self.previous_policy = asyncio.get_event_loop_policy()
+        asyncio.set_event_loop_policy(_MonitoringPolicy(self))
+        # run_all.py --in-process のように、既に動いているループの中から呼ばれた場合
+        try:
+            self.loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            pass
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        asyncio.set_event_loop_policy(self.previous_policy)
+
+        lags = sorted(self.lags)
+        def percentile(p):
+            return lags[min(len(lags) - 1, int(len(lags) * p))] * 1000 if lags else 0.0
+        result = {
+            "probes": len(lags),
+            "lag_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99), "max": lags[-1] * 1000 if lags else 0.0},
+            "max_tasks": self.max_tasks,
+            "blocked": self.blocked,
+        }
+        with open(f"{self.path}.async.json", "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+        if not lags:
+            return ["イベントループを使う処理がなかったため、ラグは計測されていません"]
+        lag = result["lag_ms"]
+        lines = [
+            f"ループのラグ: p50 {lag['p50']:.1f}ms / p95 {lag['p95']:.1f}ms / p99 {lag['p99']:.1f}ms / 最大 {lag['max']:.1f}ms ({len(lags)} 回計測)",
+            f"同時に存在したタスク数の最大: {self.max_tasks}",
+            f"{BLOCKED_THRESHOLD}秒以上ループが止まった回数: {len(self.blocked)}",
+        ]
+        if self.blocked:
+            lines.append("最初に止まった時点のスタック（末尾）:")
+            lines += [f"  {line.rstrip()}" for line in "".join(self.blocked[0]["stack"][-3:]).splitlines()]
+        return lines
+
+PROFILERS = {"cpu": CpuProfiler, "mem": MemoryProfiler, "async": AsyncMonitor, "sql": QueryStats, "trace": Tracer}
+
+@contextmanager
+def profile(mode, name=None):
+    """with ブロックの間、指定したモードでプロファイルを取り、終了時に要約を表示する（mode が None なら何もしない）"""
+    if not mode:
+        yield None
+        return
+
+    directory = run_directory()
+    path = os.path.join(directory, name or default_name())
+    profiler = PROFILERS[mode](path)
+    print(f"プロファイル ({mode}) を記録します。出力先: {directory}")
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        summary = profiler.stop()
+        print(f"\n--- プロファイルの要約 ({mode}: {name or default_name()}) ---")
+        for line in summary:
+            print(line)
+        print(f"詳細: {path}.{mode}.*")
\ No newline at end of file
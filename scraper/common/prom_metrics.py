@@ -0,0 +1,161 @@
+"""
+Prometheus 形式のメトリクス（取得・解析・DB書き込みのレイテンシ、キューの深さ、セマフォ待ち、画像の取得量）
+
+各モジュールは timed() / observe() / inc() / set_gauge() で値を記録するだけでよい。すべての系列には
+どのステップの値かを示す step ラベルが付く（--in-process では実行中のステップ名、単体実行ではスクリプト名）。
+- SCRAPER_METRICS_DIR が指定されていれば、SCRAPER_METRICS_INTERVAL 秒ごとと終了時に
+  <ステップ名>.prom へテキスト形式で書き出す（node_exporter の textfile collector でそのまま読める）
+- run_all.py --metrics-port を指定すると、実行中は http://localhost:<port>/metrics で公開する。
+  子プロセスとして動くステップの値は、各プロセスが書き出した .prom を読み込んで合わせて返す
+"""
+
+import atexit
+import contextvars
+import glob
+import os
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, disable_created_metrics, start_http_server, write_to_textfile
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.metrics_core import Metric
+
+METRICS_DIR_ENV = "SCRAPER_METRICS_DIR"
+METRICS_INTERVAL_ENV = "SCRAPER_METRICS_INTERVAL"
+STEP_ENV = "SCRAPER_STEP"
+DEFAULT_INTERVAL = 15
+
+# *_created の系列は不要（ファイルをまたいで集約する際に重複する）
+disable_created_metrics()
+
+# ページ取得・解析は秒単位、DB書き込み・セマフォ待ちはミリ秒から数十秒まで
+FETCH_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+PAGE_FETCH_SECONDS = Histogram(
+    "scraper_page_fetch_seconds", "ページの取得にかかった時間", ["step", "site", "page_type"], buckets=FETCH_BUCKETS)
+PARSE_SECONDS = Histogram(
+    "scraper_parse_seconds", "ページの解析にかかった時間", ["step", "site", "page_type"], buckets=FAST_BUCKETS)
+DB_BATCH_SECONDS = Histogram(
+    "scraper_db_batch_seconds", "DBへのまとめ書き込み1回にかかった時間", ["step", "operation"], buckets=FAST_BUCKETS)
+SEMAPHORE_WAIT_SECONDS = Histogram(
+    "scraper_semaphore_wait_seconds", "同時実行数の制限で待たされた時間", ["step", "name"], buckets=FAST_BUCKETS)
+QUEUE_DEPTH = Gauge(
+    "scraper_queue_depth", "キューに溜まっている件数", ["step", "queue"])
+IMAGE_BYTES = Counter(
+    "scraper_image_bytes", "ダウンロードした画像のバイト数", ["step", "site"])
+
+# run_all.py --in-process が実行中のステップ名を設定する
+current_step = contextvars.ContextVar("prom_current_step", default=None)
+
+def step_name():
+    return current_step.get() or os.getenv(STEP_ENV) or os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+
+@contextmanager
+def timed(metric, **labels):
+    """with ブロックの所要時間を metric (Histogram) に記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.labels(step=step_name(), **labels).observe(time.perf_counter() - start)
+
+def observe(metric, value, **labels):
+    metric.labels(step=step_name(), **labels).observe(value)
+
+def inc(metric, value=1, **labels):
+    metric.labels(step=step_name(), **labels).inc(value)
+
+def set_gauge(metric, value, **labels):
+    metric.labels(step=step_name(), **labels).set(value)
+
+@asynccontextmanager
+async def acquire(semaphore, name):
+    """セマフォを取得し、取得までの待ち時間を記録する"""
+    start = time.perf_counter()
+    async with semaphore:
+        observe(SEMAPHORE_WAIT_SECONDS, time.perf_counter() - start, name=name)
+        yield
+
+# --- 書き出しと公開 ---
+
+def textfile_path(directory, step=None):
+    safe = (step or step_name()).replace("/", "_").replace(".py", "")
+    return os.path.join(directory, f"{safe}.prom")
+
+def write_textfile(directory=None):
+    """レジストリの内容を <ステップ名>.prom に書き出す（書き込み途中のファイルは読まれないよう置き換える）"""
+    directory = directory or os.getenv(METRICS_DIR_ENV)
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = textfile_path(directory)
+    write_to_textfile(path, REGISTRY)
+    return path
+
+def _write_periodically(directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_textfile(directory)
+        except OSError:
+            pass
+
+_textfile_started = False
+
+def start_textfile(directory, interval=None):
+    """一定間隔と終了時に directory へ .prom を書き出し始める（子プロセスにも同じ出力先を引き継ぐ）"""
+    global _textfile_started
+    os.environ[METRICS_DIR_ENV] = directory
+    if _textfile_started:
+        return
+    _textfile_started = True
+    interval = interval or int(os.getenv(METRICS_INTERVAL_ENV, DEFAULT_INTERVAL))
+    threading.Thread(target=_write_periodically, args=(directory, interval), daemon=True).start()
+    atexit.register(write_textfile, directory)
+
+class AggregateCollector:
+    """このプロセスの値に、子プロセスが書き出した .prom の値を同じ名前の系列としてまとめて返す
+    （子プロセスのプロセス・GC の系列はステップを区別できず自身の値と重複するため、scraper_* だけを取り込む）"""
+
+    def __init__(self, registry, directory, exclude=None):
+        self.registry = registry
+        self.directory = directory
+        self.exclude = exclude
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        families = {}
+        for family in self.registry.collect():
+            merged = families.setdefault(family.name, Metric(family.name, family.documentation, family.type))
+            merged.samples.extend(family.samples)
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.prom"))):
+            if path == self.exclude:
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                continue
+            for family in text_string_to_metric_families(text):
+                if not family.name.startswith("scraper_"):
+                    continue
+                merged = families.setdefault(family.name, Metric(family.name, family.documentation, family.type))
+                merged.samples.extend(family.samples)
+        return list(families.values())
+
+def serve(port, directory=None):
+    """/metrics を公開する。directory を指定すると、そこにある子プロセスの .prom も合わせて返す"""
+    if not directory:
+        start_http_server(port)
+        return
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(AggregateCollector(REGISTRY, directory, exclude=textfile_path(directory)))
+    start_http_server(port, registry=registry)
+
+if os.getenv(METRICS_DIR_ENV):
+    start_textfile(os.getenv(METRICS_DIR_ENV))
\ No newline at end of file
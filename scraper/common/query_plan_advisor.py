@@ -0,0 +1,273 @@
+import argparse
+import datetime
+import os
+import sys
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+# 1. 環境変数の読み込み
+# 実行ファイルからの相対パスで .env を探す
+current_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(current_dir, '..', '.env')
+load_dotenv(dotenv_path=env_path)
+
+def get_env_or_exit(key, default=None, required=True):
+    """
+    環境変数を取得する。
+    required=True の場合、値が取得できなければプログラムを終了させる（セキュリティ対策）。
+    """
+    val = os.getenv(key, default)
+    if required and val is None:
+        print(f"致命的エラー: 必須の環境変数 '{key}' が設定されていません。")
+        sys.exit(1)
+    return val
+
+# DB設定: セキュリティのため機密情報はデフォルト値を設定せず必須（required=True）とする
+DB_USER = get_env_or_exit("DB_USERNAME")
+DB_PASS = get_env_or_exit("DB_PASSWORD")
+DB_NAME = get_env_or_exit("DB_DATABASE")
+
+# 接続先やポートは、機密情報ではないため利便性のためにデフォルト値を残しても許容される
+DB_HOST = get_env_or_exit("DB_HOST", default="db")
+DB_PORT = get_env_or_exit("DB_PORT", default="3306")
+
+DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+engine = create_engine(DATABASE_URL)
+
+# 2. 各コレクターが発行するホットなクエリ
+# site は sites.name から site_id を解決する。index は全表走査時に提案する索引のカラム（先頭から順に）。
+SAMPLE_URL_HASH = "0" * 40
+
+HOT_QUERIES = [
+    {
+        "collector": "goobike/listing_collector.py",
+        "label": "既知URL・スナップショットの読み込み（掲載終了を含む）",
+        "sql": "SELECT id, source_url, price, total_price, mileage, fingerprint FROM listings WHERE site_id = :site_id",
+        "site": "GooBike",
+        "table": "listings",
+        "index": ["site_id"],
+    },
+    {
+        "collector": "bds/listing_collector.py, scrapy/*_listing_collector.py",
+        "label": "既知URL・スナップショットの読み込み（販売中のみ）",
+        "sql": "SELECT id, source_url, price, total_price, mileage, fingerprint FROM listings WHERE site_id = :site_id AND is_sold_out = 0",
+        "site": "BDS",
+        "table": "listings",
+        "index": ["site_id", "is_sold_out"],
+    },
+    {
+        "collector": "common/listing_snapshot.py",
+        "label": "変更された出品の更新 (url_hash キー)",
+        "sql": "UPDATE listings SET updated_at = updated_at WHERE site_id = :site_id AND url_hash = :url_hash",
+        "site": "BDS",
+        "params": {"url_hash": SAMPLE_URL_HASH},
+        "table": "listings",
+        "index": ["site_id", "url_hash"],
+    },
+    {
+        "collector": "common/listing_snapshot.py (mark_sold_out)",
+        "label": "掲載終了判定: 巡回できた車種の販売中の出品の読み込み",
+        "sql": "SELECT id, source_url FROM listings WHERE site_id = :site_id AND bike_model_id IN (:bike_model_id) AND is_sold_out = 0",
+        "site": "BDS",
+        "params": {"bike_model_id": 0},
+        "table": "listings",
+        "index": ["site_id", "bike_model_id", "is_sold_out"],
+    },
+    {
+        "collector": "common/listing_snapshot.py (mark_sold_out)",
+        "label": "掲載終了（完売）の一括更新 (id IN ...)",
+        "sql": "UPDATE listings SET updated_at = updated_at WHERE id IN (:id)",
+        "site": "BDS",
+        "params": {"id": 0},
+        "table": "listings",
+        "index": ["id"],
+    },
+    {
+        "collector": "*/listing_collector.py, */category_collector.py",
+        "label": "車種識別番号キャッシュの構築",
+        "sql": "SELECT identifier, bike_model_id FROM bike_model_identifiers WHERE site_id = :site_id",
+        "site": "GooBike",
+        "table": "bike_model_identifiers",
+        "index": ["site_id"],
+    },
+    {
+        "collector": "*/listing_collector.py",
+        "label": "店舗識別番号キャッシュの構築",
+        "sql": "SELECT identifier, shop_id FROM shop_identifiers WHERE site_id = :site_id",
+        "site": "GooBike",
+        "table": "shop_identifiers",
+        "index": ["site_id"],
+    },
+    {
+        "collector": "bds/displacement_collector.py, */listing_collector.py, common/bike_model_displacement_fixer.py",
+        "label": "排気量が未設定の車種の読み込み",
+        "sql": "SELECT id, name FROM bike_models WHERE displacement IS NULL OR displacement = 0",
+        "table": "bike_models",
+        "index": ["displacement"],
+    },
+    {
+        "collector": "common/bike_model_displacement_fixer.py --stream",
+        "label": "排気量が未設定の車種のチャンク読み出し",
+        "sql": "SELECT id, name FROM bike_models WHERE (displacement IS NULL OR displacement = 0) AND id > :last_id ORDER BY id LIMIT 5000",
+        "params": {"last_id": 0},
+        "table": "bike_models",
+        "index": ["displacement"],
+    },
+    {
+        "collector": "*/category_collector.py",
+        "label": "カテゴリが未設定の車種の読み込み",
+        "sql": "SELECT id, name FROM bike_models WHERE category IS NULL OR category = '不明'",
+        "table": "bike_models",
+        "index": ["category"],
+    },
+    {
+        "collector": "common/listing_archiver.py",
+        "label": "退避対象（掲載終了から一定期間経過）の抽出",
+        "sql": "SELECT id FROM listings WHERE is_sold_out = 1 AND updated_at < :cutoff AND id > :last_id ORDER BY id LIMIT 1000",
+        "params": {"last_id": 0},
+        "table": "listings",
+        "index": ["is_sold_out", "updated_at"],
+    },
+    {
+        "collector": "common/listing_enricher.py",
+        "label": "詳細ページ未補完の新着出品の抽出",
+        "sql": "SELECT l.id, l.source_url FROM listings l LEFT JOIN listing_details d ON d.listing_id = l.id WHERE l.site_id = :site_id AND l.is_sold_out = 0 AND l.id > :last_id AND d.id IS NULL ORDER BY l.id LIMIT 500",
+        "site": "GooBike",
+        "params": {"last_id": 0},
+        "table": "listings",
+        "index": ["site_id", "is_sold_out"],
+    },
+    {
+        "collector": "common/image_downloader.py",
+        "label": "画像未取得の出品のチャンク読み出し",
+        "sql": "SELECT id, site_id, image_urls FROM listings WHERE image_urls IS NOT NULL AND local_image_paths IS NULL AND id > :last_id ORDER BY id LIMIT 500",
+        "params": {"last_id": 0},
+        "table": "listings",
+        "index": [],
+        "note": "JSON カラムには直接索引を張れません（主キーの範囲走査になります）。取得状態を表す生成列や状態カラムの追加を検討してください。",
+    },
+    {
+        "collector": "common/image_derivatives.py",
+        "label": "派生画像が未生成の出品のチャンク読み出し",
+        "sql": "SELECT id, local_image_paths FROM listings WHERE id > :last_id AND local_image_paths IS NOT NULL AND local_image_derivatives IS NULL ORDER BY id LIMIT 200",
+        "params": {"last_id": 0},
+        "table": "listings",
+        "index": [],
+        "note": "JSON カラムには直接索引を張れません（主キーの範囲走査になります）。生成状態を表す生成列や状態カラムの追加を検討してください。",
+    },
+    {
+        "collector": "backend ListingRepository::searchByKeyword",
+        "label": "販売中の新着順一覧",
+        "sql": "SELECT * FROM listings WHERE is_sold_out = 0 ORDER BY created_at DESC LIMIT 30",
+        "table": "listings",
+        "index": ["is_sold_out", "created_at"],
+    },
+]
+
+def resolve_site_ids(conn):
+    """sites.name -> id"""
+    return {name: site_id for site_id, name in conn.execute(text("SELECT id, name FROM sites")).all()}
+
+def existing_indexes(conn, table):
+    """テーブルの既存索引を (先頭からのカラム列) のリストで返す"""
+    indexes = {}
+    for row in conn.execute(text(f"SHOW INDEX FROM {table}")).mappings():
+        indexes.setdefault(row["Key_name"], []).append((row["Seq_in_index"], row["Column_name"]))
+    return [[col for _, col in sorted(cols)] for cols in indexes.values()]
+
+def suggest_index_ddl(table, columns, indexes):
+    """既存索引の先頭カラムで賄えない場合だけ、Laravel の命名規則に沿った索引DDLを返す"""
+    if not columns:
+        return None
+    for idx_cols in indexes:
+        if idx_cols[:len(columns)] == columns:
+            return None
+    index_name = f"{table}_{'_'.join(columns)}_index"
+    return f"ALTER TABLE {table} ADD INDEX {index_name} ({', '.join(columns)});"
+
+def explain(conn, query, site_ids):
+    """EXPLAIN を実行し、全表走査・ファイルソートなどの問題を洗い出す"""
+    params = dict(query.get("params", {}))
+    if "site" in query:
+        params["site_id"] = site_ids.get(query["site"], 0)
+    if ":cutoff" in query["sql"]:
+        params["cutoff"] = datetime.datetime.now() - datetime.timedelta(days=30)
+
+    rows = conn.execute(text("EXPLAIN " + query["sql"]), params).mappings().all()
+
+    problems = []
+    for row in rows:
+        access_type = row.get("type")
+        extra = row.get("Extra") or ""
+        est_rows = row.get("rows")
+        if access_type == "ALL":
+            problems.append(f"全表走査 ({row.get('table')}, 推定 {est_rows} 行)")
+        elif access_type == "index":
+            problems.append(f"索引の全走査 ({row.get('table')}, 推定 {est_rows} 行)")
+        if "Using filesort" in extra:
+            problems.append(f"ファイルソート ({row.get('table')}, 推定 {est_rows} 行)")
+        if "Using temporary" in extra:
+            problems.append(f"一時テーブル ({row.get('table')})")
+    return rows, problems
+
+def run(only=None):
+    print("スクレイパーのホットクエリの実行計画を確認します...\n")
+    suggestions = []
+
+    with engine.connect() as conn:
+        site_ids = resolve_site_ids(conn)
+        index_cache = {}
+        flagged = 0
+
+        for query in HOT_QUERIES:
+            if only and only not in query["collector"] and only not in query["table"]:
+                continue
+
+            print(f"--- {query['label']} ---")
+            print(f"  発行元: {query['collector']}")
+            print(f"  SQL   : {query['sql']}")
+            try:
+                rows, problems = explain(conn, query, site_ids)
+            except Exception as e:
+                print(f"  [エラー] EXPLAIN に失敗しました: {e}\n")
+                continue
+
+            for row in rows:
+                print(
+                    f"  計画  : table={row.get('table')} type={row.get('type')} key={row.get('key')} "
+                    f"rows={row.get('rows')} filtered={row.get('filtered')} extra={row.get('Extra') or '-'}"
+                )
+
+            if problems:
+                flagged += 1
+                for problem in problems:
+                    print(f"  [警告] {problem}")
+
+                table = query["table"]
+                if table not in index_cache:
+                    index_cache[table] = existing_indexes(conn, table)
+                ddl = suggest_index_ddl(table, query["index"], index_cache[table])
+                if ddl and ddl not in suggestions:
+                    suggestions.append(ddl)
+                    print(f"  [提案] {ddl}")
+            else:
+                print("  [OK] 索引を利用しています")
+
+            if query.get("note"):
+                print(f"  [メモ] {query['note']}")
+            print()
+
+    print(f"{flagged} 件のクエリで全表走査またはソートが検出されました。")
+    if suggestions:
+        print("\n--- 索引の追加提案 (DDL) ---")
+        for ddl in suggestions:
+            print(ddl)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="スクレイパーのホットクエリに EXPLAIN を実行し、索引の追加を提案する")
+    parser.add_argument("--only", default=None, help="発行元スクリプト名またはテーブル名で絞り込む (例: listings, category_collector)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(only=args.only)
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+SQLAlchemy のエンジンイベントによるSQLの計測と N+1 の検出 (--profile=sql)
+
+Engine クラスにイベントを登録するため、各スクリプトが作るエンジンを書き換えずに全ステートメントを計測できる。
+- ステートメントは値・IN句の要素数・複数行 VALUES の行数を畳んだ「形」に正規化して集計する
+- 集計の単位はステップ（run_all.py --in-process ではステップ名）とステージ。
+  ステージはコレクター内の処理の区切りで、stage() で名前を付ける（未指定は "main"）
+- 同じステージの中で同じ形の SELECT が N1_THRESHOLD 回以上実行されたものを N+1 の候補として報告する
+- SLOW_QUERY_ENV (既定 500ms) より遅いステートメントはその場で表示し、一覧にも残す
+"""
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from common import prom_metrics
+
+SLOW_QUERY_ENV = "SCRAPER_SLOW_QUERY_MS"
+DEFAULT_SLOW_QUERY_MS = 500
+# 同じステージで同じ形の SELECT がこの回数以上実行されたら N+1 の候補とする
+N1_THRESHOLD = 20
+MAX_SLOW_QUERIES = 200
+SUMMARY_TOP_N = 10
+
+current_stage = contextvars.ContextVar("query_stage", default="main")
+
+@contextmanager
+def stage(name):
+    """with ブロック内で実行されたSQLを name のステージとして集計する（計測していない時は何もしない）"""
+    token = current_stage.set(name)
+    try:
+        yield
+    finally:
+        current_stage.reset(token)
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s|\?|:\w+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES_ROWS = re.compile(r"(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize(statement):
+    """ステートメントを値に依存しない形にする（リテラルとプレースホルダは ?、IN句の並びと複数行 VALUES は1つに畳む）"""
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?+)", sql)
+    sql = _VALUES_ROWS.sub(r"\1, ...", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+class QueryStats:
+    """計測中のSQLをステップ・ステージ・ステートメントの形ごとに集計する（profiling.profile から使う）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.slow_ms = float(os.getenv(SLOW_QUERY_ENV, DEFAULT_SLOW_QUERY_MS))
+        self.lock = threading.Lock()
+        # (step, stage, 形) -> {"count", "rows", "total_ms", "max_ms", "executemany"}
+        self.statements = defaultdict(lambda: {"count": 0, "rows": 0, "total_ms": 0.0, "max_ms": 0.0, "executemany": False})
+        self.slow = []
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_stats_start = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_stats_start", None)
+        if started is None:
+            # 計測を始める前に実行が始まっていたステートメント
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        shape = normalize(statement)
+        key = (prom_metrics.step_name(), current_stage.get(), shape)
+        rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+
+        with self.lock:
+            entry = self.statements[key]
+            entry["count"] += 1
+            entry["rows"] += rows
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["executemany"] = entry["executemany"] or executemany
+            if elapsed_ms >= self.slow_ms and len(self.slow) < MAX_SLOW_QUERIES:
+                self.slow.append({"step": key[0], "stage": key[1], "ms": round(elapsed_ms, 1), "statement": shape})
+        if elapsed_ms >= self.slow_ms:
+            print(f"[遅いSQL] {elapsed_ms:.0f}ms ({key[0]} / {key[1]}): {shape[:200]}")
+
+    def start(self):
+        event.listen(Engine, "before_cursor_execute", self._before)
+        event.listen(Engine, "after_cursor_execute", self._after)
+
+    def n_plus_one_candidates(self):
+        """同じステージの中で繰り返し実行された SELECT（1件ずつの取得をループで回している箇所）"""
+        return sorted(
+            (
+                {"step": step, "stage": stage_name, "statement": shape, **entry}
+                for (step, stage_name, shape), entry in self.statements.items()
+                if entry["count"] >= N1_THRESHOLD and not entry["executemany"] and shape.upper().startswith("SELECT")
+            ),
+            key=lambda c: c["count"], reverse=True,
+        )
+
+    def stop(self):
+        event.remove(Engine, "before_cursor_execute", self._before)
+        event.remove(Engine, "after_cursor_execute", self._after)
+
+        stages = defaultdict(lambda: {"count": 0, "total_ms": 0.0})
+        for (step, stage_name, _), entry in self.statements.items():
+            stages[(step, stage_name)]["count"] += entry["count"]
+            stages[(step, stage_name)]["total_ms"] += entry["total_ms"]
+        candidates = self.n_plus_one_candidates()
+        statements = sorted(
+            ({"step": step, "stage": stage_name, "statement": shape, **entry} for (step, stage_name, shape), entry in self.statements.items()),
+            key=lambda s: s["total_ms"], reverse=True,
+        )
+        with open(f"{self.path}.sql.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "stages": [{"step": step, "stage": stage_name, **totals} for (step, stage_name), totals in stages.items()],
+                "statements": statements,
+                "n_plus_one_candidates": candidates,
+                "slow": self.slow,
+            }, f, ensure_ascii=False, indent=2)
+
+        total = sum(totals["count"] for totals in stages.values())
+        lines = [f"ステートメント数: {total} (形の種類 {len(self.statements)})", "ステージごとの件数:"]
+        lines += [
+            f"  {step} / {stage_name}: {totals['count']} 件, {totals['total_ms']:.0f}ms"
+            for (step, stage_name), totals in sorted(stages.items(), key=lambda item: item[1]["count"], reverse=True)
+        ]
+        lines.append("合計時間の長いステートメント:")
+        lines += [f"  {s['total_ms']:.0f}ms / {s['count']} 回 ({s['stage']}): {s['statement'][:120]}" for s in statements[:SUMMARY_TOP_N]]
+        if candidates:
+            lines.append(f"N+1 の候補 (同じステージで {N1_THRESHOLD} 回以上の SELECT):")
+            lines += [f"  {c['count']} 回 ({c['step']} / {c['stage']}): {c['statement'][:120]}" for c in candidates[:SUMMARY_TOP_N]]
+        lines.append(f"{self.slow_ms:.0f}ms 以上のステートメント: {len(self.slow)} 件")
+        return lines
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""
+ステップごとの実行メトリクス（取得ページ数・バイト数・登録/更新/掲載終了件数・エラー・リトライ・ピークRSS）
+
+コレクターや共通モジュールは count() で件数を加算するだけでよい。
+- 単体実行（run_all.py の子プロセスを含む）ではプロセス全体で1つのカウンタに集計し、
+  環境変数 SCRAPE_METRICS_FILE が指定されていれば終了時にそのファイルへ JSON で書き出す
+- run_all.py --in-process では、ステップごとに start_step() で新しいカウンタに切り替える
+  （contextvars を使うため、同時に動く他のステップの件数とは混ざらない）
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import resource
+import sys
+from collections import Counter
+
+METRICS_FILE_ENV = "SCRAPE_METRICS_FILE"
+
+# scrape_run_steps に記録する件数の項目
+FIELDS = ("pages_fetched", "bytes_fetched", "rows_inserted", "rows_updated", "rows_sold_out", "errors", "retries")
+
+_process_counters = Counter()
+_step_counters = contextvars.ContextVar("step_counters", default=None)
+
+def counters():
+    """現在のステップ（単体実行ではプロセス全体）のカウンタ"""
+    step = _step_counters.get()
+    return step if step is not None else _process_counters
+
+def count(name, value=1):
+    if name not in FIELDS:
+        raise ValueError(f"未定義のメトリクスです: {name}")
+    counters()[name] += value
+
+def page_fetched(body):
+    """取得したページ1枚分（HTML の str または bytes）を記録する"""
+    count("pages_fetched")
+    count("bytes_fetched", len(body.encode("utf-8") if isinstance(body, str) else body))
+
+def start_step():
+    """--in-process 用: 以降このタスク（とそこから起動したタスク・スレッド）の件数を新しいカウンタに集計する"""
+    step = Counter()
+    _step_counters.set(step)
+    return step
+
+def peak_rss_kb():
+    """このプロセスのピークRSS (KB)。macOS の ru_maxrss はバイト単位"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def snapshot(step=None):
+    """件数とピークRSSを辞書にまとめる"""
+    step = counters() if step is None else step
+    result = {name: step.get(name, 0) for name in FIELDS}
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+def read_file(path):
+    """子プロセスが書き出したメトリクスを読み込む（書き出される前に異常終了していれば None）"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+@atexit.register
+def _write_at_exit():
+    path = os.getenv(METRICS_FILE_ENV)
+    if not path:
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(_process_counters), f)
\ No newline at end of file
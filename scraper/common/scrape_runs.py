@@ -0,0 +1,210 @@
+"""
+パイプライン実行のメトリクスの記録と、性能劣化のレポート
+
+run_all.py は実行のたびに scrape_runs（1回の実行）と scrape_run_steps（ステップごとの所要時間・件数・ピークRSS）へ記録する。
+このスクリプトを単体で実行すると、直近の実行を過去の実行（既定は直近7回）の中央値と比べ、劣化したステップを報告する。
+劣化が見つかった場合は終了コード 1 で終わるため、cron などから通知に使える。
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import sys
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, Column, BigInteger, Integer, String, Float, DateTime, insert
+from sqlalchemy.orm import DeclarativeBase, sessionmaker
+
+# 1. 環境変数の読み込み
+# 実行ファイルからの相対パスで .env を探す
+current_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(current_dir, '..', '.env')
+load_dotenv(dotenv_path=env_path)
+
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.run_metrics import FIELDS
+
+def get_env_or_exit(key, default=None, required=True):
+    """
+    環境変数を取得する。
+    required=True の場合、値が取得できなければプログラムを終了させる（セキュリティ対策）。
+    """
+    val = os.getenv(key, default)
+    if required and val is None:
+        print(f"致命的エラー: 必須の環境変数 '{key}' が設定されていません。")
+        sys.exit(1)
+    return val
+
+# DB設定: セキュリティのため機密情報はデフォルト値を設定せず必須（required=True）とする
+DB_USER = get_env_or_exit("DB_USERNAME")
+DB_PASS = get_env_or_exit("DB_PASSWORD")
+DB_NAME = get_env_or_exit("DB_DATABASE")
+
+# 接続先やポートは、機密情報ではないため利便性のためにデフォルト値を残しても許容される
+DB_HOST = get_env_or_exit("DB_HOST", default="db")
+DB_PORT = get_env_or_exit("DB_PORT", default="3306")
+
+DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+engine = create_engine(DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class Base(DeclarativeBase):
+    pass
+
+class ScrapeRun(Base):
+    __tablename__ = "scrape_runs"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    mode = Column(String(20), nullable=False)
+    status = Column(String(20), nullable=False)
+    max_parallel = Column(Integer, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=False)
+    wall_seconds = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class ScrapeRunStep(Base):
+    __tablename__ = "scrape_run_steps"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    scrape_run_id = Column(BigInteger, nullable=False)
+    script = Column(String(100), nullable=False)
+    status = Column(String(20), nullable=False)
+    returncode = Column(Integer, nullable=True)
+    started_offset = Column(Float, nullable=True)
+    wall_seconds = Column(Float, nullable=True)
+    pages_fetched = Column(Integer, nullable=True)
+    bytes_fetched = Column(BigInteger, nullable=True)
+    rows_inserted = Column(Integer, nullable=True)
+    rows_updated = Column(Integer, nullable=True)
+    rows_sold_out = Column(Integer, nullable=True)
+    errors = Column(Integer, nullable=True)
+    retries = Column(Integer, nullable=True)
+    peak_rss_kb = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+# 2. レポートの設定
+DEFAULT_BASELINE_RUNS = 7
+DEFAULT_THRESHOLD = 1.5
+# 基準の算出に必要な過去の実行数（これ未満のステップは判定しない）
+MIN_BASELINE_RUNS = 3
+
+# (カラム, 表示名, 劣化の向き, 劣化とみなす最小の差)
+# 向きが "up" の項目は基準の threshold 倍を超えたら、"down" の項目は基準の 1/threshold を下回ったら劣化とする。
+# 取得ページ数の減少は、巡回が途中で打ち切られた（一部のメーカーを取りこぼした）可能性を示す。
+REPORT_METRICS = [
+    ("wall_seconds", "所要時間(秒)", "up", 30),
+    ("peak_rss_kb", "ピークRSS(KB)", "up", 50 * 1024),
+    ("errors", "エラー", "up", 5),
+    ("retries", "リトライ", "up", 10),
+    ("pages_fetched", "取得ページ数", "down", 10),
+]
+
+def record_run(mode, max_parallel, started_at, wall_seconds, steps, results, skipped, abort_code):
+    """run_all.py の実行結果を scrape_runs / scrape_run_steps に記録し、実行IDを返す"""
+    if abort_code is not None:
+        status = "aborted"
+    elif all(results.get(s["script"], {}).get("ok") for s in steps):
+        status = "completed"
+    else:
+        status = "failed"
+
+    now = datetime.datetime.now()
+    with engine.begin() as conn:
+        run_id = conn.execute(insert(ScrapeRun.__table__).values(
+            mode=mode, status=status, max_parallel=max_parallel,
+            started_at=started_at, finished_at=started_at + datetime.timedelta(seconds=wall_seconds),
+            wall_seconds=wall_seconds, created_at=now, updated_at=now,
+        )).inserted_primary_key[0]
+
+        rows = []
+        for step in steps:
+            name = step["script"]
+            row = {"scrape_run_id": run_id, "script": name, "created_at": now, "updated_at": now}
+            row.update({field: None for field in FIELDS}, peak_rss_kb=None, returncode=None, started_offset=None, wall_seconds=None)
+            if name in results:
+                r = results[name]
+                row.update(
+                    status="success" if r["ok"] else "failed",
+                    returncode=r["returncode"],
+                    started_offset=r["start"],
+                    wall_seconds=r["end"] - r["start"],
+                )
+                row.update(r.get("metrics") or {})
+            else:
+                row["status"] = "skipped" if name in skipped else "failed"
+            rows.append(row)
+        conn.execute(insert(ScrapeRunStep.__table__), rows)
+    return run_id
+
+def compare(latest, history, threshold):
+    """1ステップ分の直近値と過去の値を比べ、劣化した項目を (表示名, 直近値, 基準値) のリストで返す"""
+    regressions = []
+    for column, label, direction, min_delta in REPORT_METRICS:
+        value = latest.get(column)
+        past = [h[column] for h in history if h.get(column) is not None]
+        if value is None or len(past) < MIN_BASELINE_RUNS:
+            continue
+        baseline = statistics.median(past)
+        if direction == "up" and value > baseline * threshold and value - baseline >= min_delta:
+            regressions.append((label, value, baseline))
+        elif direction == "down" and value < baseline / threshold and baseline - value >= min_delta:
+            regressions.append((label, value, baseline))
+    return regressions
+
+def report(run_id=None, baseline_runs=DEFAULT_BASELINE_RUNS, threshold=DEFAULT_THRESHOLD):
+    """直近（または指定）の実行を、それ以前の baseline_runs 回の中央値と比べる。劣化の件数を返す"""
+    db = SessionLocal()
+    try:
+        query = db.query(ScrapeRun).order_by(ScrapeRun.id.desc())
+        latest_run = query.filter(ScrapeRun.id == run_id).first() if run_id else query.first()
+        if not latest_run:
+            print("記録された実行がありません。")
+            return 0
+
+        baseline_ids = [r.id for r in db.query(ScrapeRun.id).filter(ScrapeRun.id < latest_run.id)
+                        .order_by(ScrapeRun.id.desc()).limit(baseline_runs)]
+        columns = ["script", "status"] + [m[0] for m in REPORT_METRICS]
+
+        def load_steps(ids):
+            rows = db.query(ScrapeRunStep).filter(ScrapeRunStep.scrape_run_id.in_(ids)).all() if ids else []
+            return [{c: getattr(row, c) for c in columns} for row in rows]
+
+        latest_steps = load_steps([latest_run.id])
+        history = {}
+        for row in load_steps(baseline_ids):
+            history.setdefault(row["script"], []).append(row)
+
+        print(f"実行 #{latest_run.id} ({latest_run.started_at:%Y-%m-%d %H:%M}, {latest_run.mode}, {latest_run.status}, "
+              f"{latest_run.wall_seconds / 60:.1f}分) を直近 {len(baseline_ids)} 回の中央値と比較します（閾値 x{threshold}）。\n")
+
+        flagged = 0
+        for step in latest_steps:
+            past = history.get(step["script"], [])
+            problems = compare(step, [p for p in past if p["status"] == "success"], threshold)
+            if step["status"] != "success" and any(p["status"] == "success" for p in past):
+                problems.insert(0, ("結果", step["status"], "success"))
+
+            wall = f"{step['wall_seconds']:.1f}秒" if step["wall_seconds"] is not None else "-"
+            mark = "[劣化]" if problems else "  OK  "
+            print(f"{mark} {step['script']} ({step['status']}, {wall})")
+            for label, value, baseline in problems:
+                print(f"         {label}: {value} (基準 {baseline})")
+            flagged += bool(problems)
+
+        print(f"\n劣化したステップ: {flagged} / {len(latest_steps)}")
+        return flagged
+    finally:
+        db.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="直近のパイプライン実行を過去の実行と比べ、性能の劣化を報告する")
+    parser.add_argument("--run-id", type=int, default=None, help="比較する実行ID（省略時は直近の実行）")
+    parser.add_argument("--baseline", type=int, default=DEFAULT_BASELINE_RUNS, help="基準にする過去の実行数")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="基準の何倍（取得ページ数は何分の1）で劣化とみなすか")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(1 if report(run_id=args.run_id, baseline_runs=args.baseline, threshold=args.threshold) else 0)
\ No newline at end of file
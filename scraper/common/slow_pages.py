@@ -0,0 +1,148 @@
+"""
+遅いページ・失敗したページの記録 (--capture-slow-pages)
+
+ページの読み込みが閾値の秒数を超えた、または失敗した時に、原因を後から調べられるよう次のものを保存する。
+- waterfall.json: ページが出したリクエストの一覧（種類・開始順・Playwright の request.timing・ステータス・失敗理由・レスポンスヘッダー）
+- page.html: その時点のHTML
+- meta.json: URL・所要時間・エラー・ステップ名と、ドキュメント本体のレスポンスヘッダー
+保存先 (既定は scraper/slow_pages/) には新しいものから SLOW_PAGE_KEEP_ENV 件 (既定 50) だけを残す。
+閾値を設定していない時の goto() は page.goto() をそのまま呼ぶだけで、リクエストの記録もしない。
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import re
+import shutil
+import time
+
+from common import prom_metrics
+
+SLOW_PAGE_SECONDS_ENV = "SCRAPER_SLOW_PAGE_SECONDS"
+SLOW_PAGE_DIR_ENV = "SCRAPER_SLOW_PAGE_DIR"
+SLOW_PAGE_KEEP_ENV = "SCRAPER_SLOW_PAGE_KEEP"
+
+DEFAULT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "slow_pages"))
+DEFAULT_KEEP = 50
+# 記録時にHTMLやレスポンスを取り出す処理の上限（秒）。ページが固まっていても収集を止めない
+CAPTURE_TIMEOUT = 10
+
+def add_argument(parser):
+    """--capture-slow-pages を追加する（run_all.py から起動された場合は環境変数の閾値を既定にする）"""
+    default = os.getenv(SLOW_PAGE_SECONDS_ENV)
+    parser.add_argument(
+        "--capture-slow-pages", type=float, metavar="SECONDS", default=float(default) if default else None,
+        help="読み込みがこの秒数を超えた・失敗したページのリクエスト一覧・HTML・レスポンスヘッダーを scraper/slow_pages/ に保存する",
+    )
+
+def configure(threshold):
+    """閾値を設定する（子プロセス・--in-process の各ステップにも引き継ぐ）"""
+    if threshold:
+        os.environ[SLOW_PAGE_SECONDS_ENV] = str(threshold)
+
+def threshold():
+    value = os.getenv(SLOW_PAGE_SECONDS_ENV)
+    return float(value) if value else None
+
+def _slug(url):
+    return re.sub(r"[^0-9A-Za-z]+", "_", url.split("://", 1)[-1]).strip("_")[:80]
+
+def _prune(directory, keep):
+    """古い記録から削除し、最新の keep 件だけを残す（ディレクトリ名は日時で始まるため名前順が古い順）"""
+    entries = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    for name in entries[:max(0, len(entries) - keep)]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+async def _describe_request(request, response_received):
+    """
+    1リクエスト分の記録。レスポンスが届いていない（遮断・失敗・未完了）リクエストは、
+    応答を待たずにステータスとヘッダーを省く（タイムアウトしたページで記録が止まらないため）。
+    """
+    entry = {
+        "url": request.url,
+        "method": request.method,
+        "resource_type": request.resource_type,
+        "timing": request.timing,
+        "failure": request.failure,
+    }
+    response = None
+    if request in response_received:
+        try:
+            response = await asyncio.wait_for(request.response(), CAPTURE_TIMEOUT)
+        except Exception:
+            pass
+    if response is not None:
+        entry["status"] = response.status
+        try:
+            entry["headers"] = await asyncio.wait_for(response.all_headers(), CAPTURE_TIMEOUT)
+        except Exception:
+            entry["headers"] = None
+    return entry
+
+async def _save(page, url, elapsed, error, requests, response_received):
+    directory = os.getenv(SLOW_PAGE_DIR_ENV) or DEFAULT_DIR
+    keep = int(os.getenv(SLOW_PAGE_KEEP_ENV, DEFAULT_KEEP))
+    target = os.path.join(directory, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{_slug(url)}")
+    os.makedirs(target, exist_ok=True)
+
+    waterfall = list(await asyncio.gather(*(_describe_request(request, response_received) for request in requests)))
+    document = next((entry for entry in waterfall if entry["resource_type"] == "document"), None)
+    with open(os.path.join(target, "waterfall.json"), "w", encoding="utf-8") as f:
+        json.dump(waterfall, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(target, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "url": url,
+            "final_url": page.url,
+            "step": prom_metrics.step_name(),
+            "elapsed_seconds": round(elapsed, 3),
+            "error": error,
+            "requests": len(waterfall),
+            "document_status": document.get("status") if document else None,
+            "document_headers": document.get("headers") if document else None,
+        }, f, ensure_ascii=False, indent=2)
+    try:
+        html = await asyncio.wait_for(page.content(), CAPTURE_TIMEOUT)
+        with open(os.path.join(target, "page.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+    except Exception:
+        pass
+
+    _prune(directory, keep)
+    return target
+
+async def goto(page, url, **kwargs):
+    """page.goto() と同じ。閾値が設定されていれば、遅い・失敗した読み込みの記録を残す"""
+    limit = threshold()
+    if limit is None:
+        return await page.goto(url, **kwargs)
+
+    requests = []
+    response_received = set()
+
+    # Playwright はハンドラーに属性を付けるため、組み込みのメソッド (list.append など) は渡せない
+    def on_request(request):
+        requests.append(request)
+
+    def on_response(response):
+        response_received.add(response.request)
+
+    page.on("request", on_request)
+    page.on("response", on_response)
+    started = time.monotonic()
+    error = None
+    try:
+        return await page.goto(url, **kwargs)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        page.remove_listener("request", on_request)
+        page.remove_listener("response", on_response)
+        elapsed = time.monotonic() - started
+        if error or elapsed >= limit:
+            try:
+                saved = await _save(page, url, elapsed, error, requests, response_received)
+                print(f"  [記録] {'失敗' if error else f'{elapsed:.1f}秒'}のページを保存しました: {saved}")
+            except Exception as e:
+                print(f"  [記録] 遅いページを保存できませんでした ({url}): {e}")
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""
+作業単位ごとの軽量なトレース (--profile=trace)
+
+1ページの処理のような作業単位を親のスパンとし、その中の待ち (queue_wait)・取得 (fetch)・解析 (parse)・
+書き込み (persist) を子のスパンとして、所要時間と属性 (URL・バイト数・行数など) を記録する。
+- スパンは <名前>.trace.jsonl に1行1スパンで書き出す。外部のコレクターは不要
+- トレースを取っていない時の span() は何も記録しない（呼び出し側で分岐する必要はない）
+- 集計: python common/tracing.py <ファイルまたはディレクトリ> でステージごとの内訳と遅い作業単位を表示する
+"""
+
+import argparse
+import contextvars
+import glob
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+
+# 共通モジュール (scraper/common) を読み込めるようにする（集計コマンドとして直接実行する場合）
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from common import prom_metrics
+
+# 書き出し前に溜めるスパン数
+FLUSH_EVERY = 200
+SUMMARY_TOP_N = 10
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+_tracer = None
+_ids = itertools.count(1)
+
+class Span:
+    __slots__ = ("id", "parent", "unit", "name", "start", "attrs")
+
+    def __init__(self, name, parent, attrs):
+        self.id = next(_ids)
+        self.parent = parent.id if parent else None
+        self.unit = parent.unit if parent else self.id
+        self.name = name
+        self.start = time.time()
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class Tracer:
+    """スパンを JSONL に書き出す（profiling.profile から使う）"""
+
+    def __init__(self, path):
+        self.path = f"{path}.trace.jsonl"
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def record(self, span, end, error=None):
+        row = {
+            "id": span.id, "parent": span.parent, "unit": span.unit, "name": span.name,
+            "step": prom_metrics.step_name(), "start": round(span.start, 6),
+            "duration_ms": round((end - span.start) * 1000, 3), "attrs": span.attrs,
+        }
+        if error:
+            row["error"] = error
+        with self.lock:
+            self.pending.append(row)
+            if len(self.pending) >= FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        rows, self.pending = self.pending, []
+        with open(self.path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+
+    def start(self):
+        global _tracer
+        _tracer = self
+
+    def stop(self):
+        global _tracer
+        _tracer = None
+        with self.lock:
+            self._flush()
+        return format_summary(summarize(read_spans(self.path)))
+
+@contextmanager
+def span(name, **attrs):
+    """name のスパンを開始する。with の中で開始したスパンは子になり、外側がなければ新しい作業単位になる"""
+    tracer = _tracer
+    if tracer is None:
+        yield _NOOP
+        return
+    current = Span(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.record(current, time.time(), error)
+
+@asynccontextmanager
+async def acquire(semaphore, name):
+    """セマフォを取得する（待ち時間は queue_wait のスパンと prom_metrics の両方に記録する）"""
+    with span("queue_wait", semaphore=name):
+        started = time.perf_counter()
+        await semaphore.acquire()
+        prom_metrics.observe(prom_metrics.SEMAPHORE_WAIT_SECONDS, time.perf_counter() - started, name=name)
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+# --- 集計 ---
+
+def read_spans(path):
+    """ファイル、またはディレクトリ内の *.trace.jsonl からスパンを読み込む"""
+    paths = sorted(glob.glob(os.path.join(path, "*.trace.jsonl"))) if os.path.isdir(path) else [path]
+    spans = []
+    for p in paths:
+        if not os.path.exists(p):
+            continue
+        with open(p, encoding="utf-8") as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+def _error(span):
+    """スパンの失敗理由（例外で抜けた場合と、unit.set(error=...) で記録した場合のどちらも）"""
+    return span.get("error") or span["attrs"].get("error")
+
+def summarize(spans, top=SUMMARY_TOP_N):
+    """作業単位の種類ごとに子のスパンの時間の内訳を出し、遅い作業単位を挙げる"""
+    # プロセスをまたぐと id が重なるため、(step, unit) を作業単位のキーにする
+    roots = {(s["step"], s["unit"]): s for s in spans if s["parent"] is None}
+    # 内訳には作業単位の直下のスパンだけを使う（孫のスパンは親の時間に含まれている）
+    children = defaultdict(list)
+    for s in spans:
+        if s["parent"] is not None and s["parent"] == s["unit"]:
+            children[(s["step"], s["unit"])].append(s)
+
+    kinds = defaultdict(lambda: {"count": 0, "durations": [], "stages": defaultdict(list), "errors": 0})
+    for key, root in roots.items():
+        kind = kinds[(root["step"], root["name"])]
+        kind["count"] += 1
+        kind["durations"].append(root["duration_ms"])
+        kind["errors"] += 1 if _error(root) else 0
+        per_stage = defaultdict(float)
+        for child in children[key]:
+            per_stage[child["name"]] += child["duration_ms"]
+        for stage_name, ms in per_stage.items():
+            kind["stages"][stage_name].append(ms)
+
+    slowest = sorted(roots.items(), key=lambda item: item[1]["duration_ms"], reverse=True)[:top]
+    return {
+        "kinds": {
+            key: {
+                "count": kind["count"],
+                "errors": kind["errors"],
+                "total_ms": sum(kind["durations"]),
+                "p50_ms": _percentile(kind["durations"], 0.5),
+                "p95_ms": _percentile(kind["durations"], 0.95),
+                "stages": {name: {"total_ms": sum(values), "p95_ms": _percentile(values, 0.95)} for name, values in kind["stages"].items()},
+            }
+            for key, kind in kinds.items()
+        },
+        "slowest": [
+            {**root, "stages": {child["name"]: child["duration_ms"] for child in children[key]}}
+            for key, root in slowest
+        ],
+    }
+
+def format_summary(summary):
+    if not summary["kinds"]:
+        return ["記録されたスパンはありません"]
+    lines = []
+    for (step, name), kind in sorted(summary["kinds"].items(), key=lambda item: item[1]["total_ms"], reverse=True):
+        lines.append(
+            f"{step} / {name}: {kind['count']} 件 (失敗 {kind['errors']}), "
+            f"合計 {kind['total_ms'] / 1000:.1f}秒, p50 {kind['p50_ms']:.0f}ms, p95 {kind['p95_ms']:.0f}ms"
+        )
+        for stage_name, stage in sorted(kind["stages"].items(), key=lambda item: item[1]["total_ms"], reverse=True):
+            share = stage["total_ms"] / kind["total_ms"] * 100 if kind["total_ms"] else 0
+            lines.append(f"  {stage_name:<12} {stage['total_ms'] / 1000:8.1f}秒 ({share:4.1f}%)  p95 {stage['p95_ms']:.0f}ms")
+    lines.append("遅い作業単位:")
+    for root in summary["slowest"]:
+        stages = ", ".join(f"{name} {ms:.0f}ms" for name, ms in root["stages"].items())
+        label = root["attrs"].get("url") or root["attrs"]
+        lines.append(f"  {root['duration_ms']:.0f}ms {root['name']} {label} [{stages}]{' (' + _error(root) + ')' if _error(root) else ''}")
+    return lines
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="--profile=trace で書き出したスパンを集計し、ステージごとの内訳と遅い作業単位を表示する")
+    parser.add_argument("path", help="*.trace.jsonl、またはそれを含むプロファイルの出力ディレクトリ")
+    parser.add_argument("--top", type=int, default=SUMMARY_TOP_N, help="表示する遅い作業単位の件数")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    for line in format_summary(summarize(read_spans(args.path), top=args.top)):
+        print(line)
\ No newline at end of file
@@ -1,10 +1,10 @@
+import argparse
 import asyncio
 import os
 import datetime
 import re
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
 from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, or_
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
@@ -18,6 +18,11 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.browser import open_browser
+from common import profiling, query_stats, slow_pages
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -66,58 +71,58 @@ async def block_resources(route):
 async def process_genre(context, genre_id, base_url, model_cache):
     """特定のジャンルページを解析してカテゴリーを更新するタスク"""
     async with semaphore:
-        db = SessionLocal()
-        page = await context.new_page()
-        await page.route("**/*", block_resources)
+        with query_stats.stage("genre"):
+            db = SessionLocal()
+            page = await context.new_page()
+            await page.route("**/*", block_resources)
 
-        genre_str = str(genre_id).zfill(2)
-        genre_url = f"{base_url}/genre-{genre_str}/index.html"
+            genre_str = str(genre_id).zfill(2)
+            genre_url = f"{base_url}/genre-{genre_str}/index.html"
         
-        try:
-            print(f"  [開始] ジャンル {genre_str}")
-            await page.goto(genre_url, wait_until="domcontentloaded", timeout=60000)
+            try:
+                print(f"  [開始] ジャンル {genre_str}")
+                await slow_pages.goto(page, genre_url, wait_until="domcontentloaded", timeout=60000)
             
-            # スタイル名の取得
-            style_elem = await page.query_selector("li strong")
-            if not style_elem:
-                return
-            style_name = (await style_elem.inner_text()).strip()
+                # スタイル名の取得
+                style_elem = await page.query_selector("li strong")
+                if not style_elem:
+                    return
+                style_name = (await style_elem.inner_text()).strip()
             
-            # ページ内の車種名（bタグ）を一括取得
-            bike_elements = await page.query_selector_all("li.bike_list em b")
+                # ページ内の車種名（bタグ）を一括取得
+                bike_elements = await page.query_selector_all("li.bike_list em b")
             
-            update_count = 0
-            for bike_elem in bike_elements:
-                raw_name = await bike_elem.inner_text()
-                # 括弧内の排気量などを除去して車種名のみにする
-                model_name = re.sub(r'[\(\uff08].*?[\)\uff09]', '', raw_name).strip()
-                if not model_name:
-                    continue
+                update_count = 0
+                for bike_elem in bike_elements:
+                    raw_name = await bike_elem.inner_text()
+                    # 括弧内の排気量などを除去して車種名のみにする
+                    model_name = re.sub(r'[\(\uff08].*?[\)\uff09]', '', raw_name).strip()
+                    if not model_name:
+                        continue
                 
-                # キャッシュから車種レコードを取得（DBへのSELECTを回避）
-                targets = model_cache.get(model_name, [])
+                    # キャッシュから車種レコードを取得（DBへのSELECTを回避）
+                    targets = model_cache.get(model_name, [])
                 
-                for t_id in targets:
-                    # Sessionを介してオブジェクトを再取得して更新
-                    model_obj = db.query(BikeModel).get(t_id)
-                    if model_obj and (model_obj.category is None or model_obj.category == "不明"):
-                        model_obj.category = style_name
-                        update_count += 1
+                    for t_id in targets:
+                        # Sessionを介してオブジェクトを再取得して更新
+                        model_obj = db.query(BikeModel).get(t_id)
+                        if model_obj and (model_obj.category is None or model_obj.category == "不明"):
+                            model_obj.category = style_name
+                            update_count += 1
             
-            db.commit()
-            if update_count > 0:
-                print(f"  [完了] ジャンル {genre_str} ({style_name}): {update_count}件更新")
-        except Exception as e:
-            print(f"  [エラー] ジャンル {genre_str}: {e}")
-            db.rollback()
-        finally:
-            db.close()
-            await page.close()
+                db.commit()
+                if update_count > 0:
+                    print(f"  [完了] ジャンル {genre_str} ({style_name}): {update_count}件更新")
+            except Exception as e:
+                print(f"  [エラー] ジャンル {genre_str}: {e}")
+                db.rollback()
+            finally:
+                db.close()
+                await page.close()
 
 async def collect():
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("GooBikeカテゴリー同期（セキュア・高速版）を開始します...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -149,7 +154,16 @@ async def collect():
         await asyncio.gather(*tasks)
 
         print("\nGooBikeカテゴリー同期が完了しました。")
-        await browser.close()
+        await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GooBike の車種カテゴリを収集する")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect())
\ No newline at end of file
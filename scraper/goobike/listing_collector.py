@@ -1,11 +1,10 @@
+import argparse
 import asyncio
 import os
 import datetime
-import re
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
-from sqlalchemy import create_engine, Column, BigInteger, String, Numeric, Integer, Boolean, Text, JSON, DateTime, or_, update
+from sqlalchemy import create_engine, Column, BigInteger, String, Numeric, Integer, Boolean, Text, JSON, DateTime, or_
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
 # 1. 環境変数の読み込み
@@ -16,6 +15,15 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.listing_snapshot import ListingSnapshot, card_fingerprint, mark_sold_out, url_hash
+from common.crawl_state import CrawlState
+from common.model_signatures import DEFAULT_REFRESH_DAYS, ModelSignatures
+from common.parsers import goobike as goobike_parser
+from common import profiling, prom_metrics, run_metrics, tracing, slow_pages
+from common.browser import open_browser
+
 def get_env_or_exit(key, default=None, required=True):
     val = os.getenv(key, default)
     if required and val is None:
@@ -46,11 +54,13 @@ class Listing(Base):
     site_id = Column(BigInteger, nullable=False)
     title = Column(String(255), nullable=True)
     source_url = Column(Text, nullable=False)
+    url_hash = Column(String(40), nullable=True)
     price = Column(Numeric(12, 0))
     total_price = Column(Numeric(12, 0), nullable=True)
     model_year = Column(Integer, nullable=True)
     mileage = Column(Integer, nullable=True)
     image_urls = Column(JSON, nullable=True)
+    fingerprint = Column(String(40), nullable=True)
     is_sold_out = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.datetime.now)
     updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
@@ -85,110 +95,90 @@ async def block_resources(route):
     else:
         await route.continue_()
 
-async def process_model_page(context, base_url, model_path, bike_model_id, site_id, shop_cache, known_urls, found_urls):
-    """車種ごとの出品一覧ページを解析"""
-    async with semaphore:
-        db = SessionLocal()
-        page = await context.new_page()
-        await page.route("**/*", block_resources)
+async def process_model_page(context, entry, bike_model_id, site_id, shop_cache, known_urls, found_urls, snapshot, crawl, signatures):
+    """車種ごとの出品一覧ページを解析。既知の車両はカード内容の変化だけを snapshot に記録する。
+    ページを最後まで処理できた場合は車種の完了を crawl に、在庫台数と先頭URLを signatures に記録し、True を返す。
+    在庫があるはずなのに車両カードが1件も取れなかったページは、取得失敗として扱う。"""
+    model_path = entry.url
+    with tracing.span("model_page", url=model_path, bike_model_id=bike_model_id) as unit:
+        async with tracing.acquire(semaphore, "model_pages"):
+            db = SessionLocal()
+            page = await context.new_page()
+            await page.route("**/*", block_resources)
         
-        try:
-            target_url = base_url + model_path
-            await page.goto(target_url, wait_until="domcontentloaded", timeout=60000)
+            try:
+                with tracing.span("fetch") as fetch_span:
+                    with prom_metrics.timed(prom_metrics.PAGE_FETCH_SECONDS, site="goobike", page_type="model"):
+                        await slow_pages.goto(page, model_path, wait_until="domcontentloaded", timeout=60000)
             
-            vehicle_elements = await page.query_selector_all(".bike_sec")
-            new_records = 0
+                    # 取得したHTMLは共通パーサー (common/parsers/goobike.py) で解析する
+                    html = await page.content()
+                    fetch_span.set(bytes=len(html.encode("utf-8")))
+                run_metrics.page_fetched(html)
+                with tracing.span("parse") as parse_span:
+                    with prom_metrics.timed(prom_metrics.PARSE_SECONDS, site="goobike", page_type="model"):
+                        listing_page = goobike_parser.parse_listing_page(html, page.url)
+                    parse_span.set(cards=len(listing_page.cards))
+                if not listing_page.cards and entry.stock_count:
+                    raise ValueError(f"在庫 {entry.stock_count} 台の車種で車両カードが見つかりません")
+                with tracing.span("persist") as persist_span:
+                    new_records = 0
+                    page_urls = set()
             
-            for v_el in vehicle_elements:
-                try:
-                    v_link_el = await v_el.query_selector("h4 span a")
-                    if not v_link_el: continue
-                    v_url = base_url + (await v_link_el.get_attribute("href"))
-
-                    # 今回の実行で見つかったURLとして記録（掲載終了判定用）
-                    found_urls.add(v_url)
-
-                    # 重複スキップ処理
-                    if v_url in known_urls:
-                        continue
-
-                    v_title = (await v_link_el.inner_text()).strip()
-
-                    # 価格の抽出
-                    price_val, total_price_val = 0, None
-                    price_td = await v_el.query_selector("td.num_td")
-                    if price_td:
-                        p_text = await price_td.inner_text()
-                        p_match = re.search(r'(\d+\.?\d*)', p_text.replace(',', ''))
-                        if p_match: price_val = int(float(p_match.group(1)) * 10000)
-
-                    total_span = await v_el.query_selector("span.total")
-                    if total_span:
-                        t_text = await total_span.inner_text()
-                        t_match = re.search(r'(\d+\.?\d*)', t_text.replace(',', ''))
-                        if t_match: total_price_val = int(float(t_match.group(1)) * 10000)
-
-                    # 年式・走行距離
-                    year, mile = None, None
-                    spec_lis = await v_el.query_selector_all(".cont01 ul li")
-                    for li in spec_lis:
-                        li_text = await li.inner_text()
-                        if "年式" in li_text:
-                            y_m = re.search(r'(\d{4})', li_text)
-                            if y_m: year = int(y_m.group(1))
-                        elif "走行" in li_text:
-                            m_m = re.search(r'(\d+,?\d*)', li_text.replace('Km', '').replace('km', ''))
-                            if m_m: mile = int(m_m.group(1).replace(',', ''))
-
-                    # 画像
-                    img_elem = await v_el.query_selector(".bike_img img")
-                    images = []
-                    if img_elem:
-                        img_url = await img_elem.get_attribute("real-url") or await img_elem.get_attribute("src")
-                        if img_url: images.append(base_url + img_url if img_url.startswith('/') else img_url)
-
-                    # 販売店特定
-                    shop_id = None
-                    shop_name_el = await v_el.query_selector(".shop_name a")
-                    if shop_name_el:
-                        shop_href = await shop_name_el.get_attribute("href")
-                        if shop_href:
-                            s_match = re.search(r'client_(\d+)', shop_href)
-                            if s_match:
-                                shop_id = shop_cache.get(s_match.group(1))
-
-                    # 新規登録
-                    new_listing = Listing(
-                        bike_model_id=bike_model_id,
-                        shop_id=shop_id,
-                        site_id=site_id,
-                        title=v_title,
-                        source_url=v_url,
-                        price=price_val,
-                        total_price=total_price_val,
-                        model_year=year,
-                        mileage=mile,
-                        image_urls=images,
-                        is_sold_out=False
-                    )
-                    db.add(new_listing)
-                    db.commit()
-                    known_urls.add(v_url)
-                    new_records += 1
+                    for parsed in listing_page.cards:
+                        try:
+                            v_url = parsed.url
+
+                            # 今回の実行で見つかったURLとして記録（掲載終了判定用）
+                            found_urls.add(v_url)
+                            page_urls.add(v_url)
+
+                            card = parsed.to_card(shop_cache.get(parsed.shop_identifier))
+
+                            # 既知の車両はカード内容の変化（価格履歴・フィンガープリント）だけを記録してスキップ
+                            if v_url in known_urls:
+                                snapshot.observe(v_url, card)
+                                continue
+
+                            # 新規登録
+                            new_listing = Listing(
+                                bike_model_id=bike_model_id,
+                                site_id=site_id,
+                                source_url=v_url,
+                                url_hash=url_hash(v_url),
+                                fingerprint=card_fingerprint(card),
+                                is_sold_out=False,
+                                **card
+                            )
+                            db.add(new_listing)
+                            db.commit()
+                            known_urls.add(v_url)
+                            snapshot.track(v_url, new_listing.id, card)
+                            new_records += 1
                     
-                except Exception:
-                    db.rollback()
+                        except Exception:
+                            db.rollback()
             
-            if new_records > 0:
-                print(f"  [完了] {model_path}: {new_records}件の新着車両を登録")
+                    if new_records > 0:
+                        print(f"  [完了] {model_path}: {new_records}件の新着車両を登録")
+
+                    # 車種の完了を記録。価格履歴と変更された出品の更新は、バッチサイズに達した時点でまとめて書き込む
+                    crawl.mark_done("model", model_path, page_urls)
+                    crawl.checkpoint(db, snapshot)
+                    signatures.record(entry, listing_page.cards[0].url if listing_page.cards else None)
+                    persist_span.set(rows=new_records)
+                return True
                         
-        except Exception as e:
-            print(f"  [エラー] ページ取得失敗 ({model_path}): {e}")
-        finally:
-            db.close()
-            await page.close()
-
-async def collect():
+            except Exception as e:
+                print(f"  [エラー] ページ取得失敗 ({model_path}): {e}")
+                run_metrics.count("errors")
+                unit.set(error=f"{type(e).__name__}: {e}")
+                return False
+            finally:
+                db.close()
+                await page.close()
+
+async def collect(resume=False, run_id=None, incremental=False, refresh_days=DEFAULT_REFRESH_DAYS):
     db = SessionLocal()
     site = db.query(Site).filter(Site.name == "GooBike").first()
     if not site:
@@ -200,18 +190,32 @@ async def collect():
     model_ident_cache = {i.identifier: i.bike_model_id for i in db.query(BikeModelIdentifier).filter(BikeModelIdentifier.site_id == site_id).all()}
     shop_cache = {i.identifier: i.shop_id for i in db.query(ShopIdentifier).filter(ShopIdentifier.site_id == site_id).all()}
     
-    # URLキャッシュの構築（現在DBにあるすべてのURL）
-    known_urls = {l.source_url for l in db.query(Listing.source_url).filter(Listing.site_id == site_id).all()}
+    # URLキャッシュとスナップショットの構築（現在DBにあるすべてのURL）
+    snapshot = ListingSnapshot(site_id)
+    known_urls = snapshot.load(db, include_sold_out=True)
     
-    # 今回の実行で見つかったURLを格納するセット
-    found_urls_in_this_run = set()
+    # 巡回の進捗（--resume 時は前回の未完了の巡回を引き継ぐ）
+    crawl = CrawlState(site_id, "goobike/listing_collector")
+    crawl.start(db, resume=resume, run_id=run_id)
+    if crawl.resumed:
+        print(f"巡回 #{crawl.run_id} を再開します（完了済み {len(crawl.done)} 単位、引き継いだURL {len(crawl.found_urls)} 件）。")
+    else:
+        print(f"巡回 #{crawl.run_id} を開始します。")
+
+    # 今回の実行で見つかったURLを格納するセット（再開時は完了済みの単位で見つかったURLを含む）
+    found_urls_in_this_run = set(crawl.found_urls)
+
+    # 車種ごとの在庫台数と先頭URL（差分巡回時は台数が変わらない車種を飛ばす）
+    signatures = ModelSignatures(site_id, refresh_days=refresh_days)
+    signatures.load(db)
+    if incremental:
+        print(f"差分巡回: 在庫台数が前回と同じ車種を飛ばします（{refresh_days}日ごとに再巡回）。")
     
     print(f"既知のURLを {len(known_urls)} 件ロードしました。")
     db.close()
 
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("GooBike出品情報コレクター（掲載終了判定機能付き）を起動しています...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -221,73 +225,113 @@ async def collect():
         try:
             main_page = await context.new_page()
             await main_page.route("**/*", block_resources)
-            await main_page.goto(f"{base_url}/maker-top/index.html", wait_until="domcontentloaded")
+            await slow_pages.goto(main_page, f"{base_url}/maker-top/index.html", wait_until="domcontentloaded")
             maker_links = await main_page.query_selector_all(".makerlist .mj a")
             maker_urls = [base_url + (await link.get_attribute("href")) for link in maker_links]
             await main_page.close()
 
             # 各メーカーの車種をスキャン
             for m_url in maker_urls:
+                # 前回の巡回で完了済みのメーカーは飛ばす
+                if crawl.is_done("maker", m_url):
+                    continue
+
                 temp_page = await context.new_page()
                 await temp_page.route("**/*", block_resources)
-                await temp_page.goto(m_url, wait_until="domcontentloaded")
-                
-                bike_list_items = await temp_page.query_selector_all("li.bike_list")
-                process_tasks = []
-                
-                for item in bike_list_items:
-                    input_elem = await item.query_selector("input[name='model']")
-                    identifier = await input_elem.get_attribute("value") if input_elem else None
-                    link_elem = await item.query_selector("a")
-                    model_path = await link_elem.get_attribute("href") if link_elem else None
-
-                    if identifier and model_path:
-                        bike_model_id = model_ident_cache.get(identifier)
-                        if bike_model_id:
-                            process_tasks.append(
-                                process_model_page(context, base_url, model_path, bike_model_id, site_id, shop_cache, known_urls, found_urls_in_this_run)
-                            )
-                
-                if process_tasks:
-                    await asyncio.gather(*process_tasks)
-                
-                await temp_page.close()
-                await asyncio.sleep(1)
+
+                try:
+                    with prom_metrics.timed(prom_metrics.PAGE_FETCH_SECONDS, site="goobike", page_type="maker"):
+                        await slow_pages.goto(temp_page, m_url, wait_until="domcontentloaded")
+                    
+                    # 車種一覧 (li.bike_list) と在庫台数は共通パーサーで解析する
+                    maker_html = await temp_page.content()
+                    run_metrics.page_fetched(maker_html)
+                    with prom_metrics.timed(prom_metrics.PARSE_SECONDS, site="goobike", page_type="maker"):
+                        model_entries = goobike_parser.parse_maker_page(maker_html, temp_page.url)
+                    process_tasks = []
+                    task_model_ids = []
+                    
+                    for entry in model_entries:
+                        bike_model_id = model_ident_cache.get(entry.identifier)
+                        if not bike_model_id or crawl.is_done("model", entry.url):
+                            continue
+
+                        # 差分巡回: 在庫台数が前回と同じ車種は一覧ページを開かない（掲載終了判定の対象からも外れる）
+                        if incremental and signatures.is_unchanged(entry):
+                            continue
+
+                        task_model_ids.append(bike_model_id)
+                        process_tasks.append(
+                            process_model_page(context, entry, bike_model_id, site_id, shop_cache, known_urls, found_urls_in_this_run, snapshot, crawl, signatures)
+                        )
+                    
+                    results = await asyncio.gather(*process_tasks) if process_tasks else []
+
+                    # 車種ごとの成否を記録し、掲載終了判定の対象を最後まで巡回できた車種に絞る
+                    for bike_model_id, ok in zip(task_model_ids, results):
+                        crawl.model_crawled(bike_model_id, ok)
+
+                    # すべての車種を処理できたメーカーだけを完了とする（失敗した車種は再開時にやり直す）
+                    if all(results):
+                        crawl.mark_done("maker", m_url)
+                        db = SessionLocal()
+                        crawl.checkpoint(db, snapshot)
+                        db.close()
+
+                except Exception as e:
+                    # メーカーページを取れなかった場合、そのメーカーの車種は掲載終了判定の対象にならない
+                    print(f"  メーカーページ巡回エラー ({m_url}): {e}")
+                    run_metrics.count("errors")
+                finally:
+                    await temp_page.close()
+                    await asyncio.sleep(1)
+
+            db = SessionLocal()
+
+            # --- 価格履歴・変更された出品の書き込み ---
+            snapshot.flush(db)
+            crawl.flush(db)
+            print(f"\n{snapshot.recorded_count} 件の価格変化を履歴に記録し、{snapshot.updated_count} 件の変更された出品を更新しました。")
+
+            # --- 車種シグネチャの保存（価格変化の書き込み後に保存し、中断時に飛ばされる車種が出ないようにする） ---
+            signatures.flush(db)
+            if incremental:
+                print(f"差分巡回: {signatures.skipped_count} 車種の一覧ページを省略しました"
+                      f"（台数が同じまま先頭の出品が入れ替わっていた車種: {signatures.silent_change_count}）。")
 
             # --- 掲載終了（完売）判定フェーズ ---
             print("\n掲載終了車両の判定を行っています...")
-            db = SessionLocal()
             
-            # DBにあって、今回の巡回で見つからなかったURLを特定
-            # ※ 1メーカーだけ回した時に他のメーカーを消さないよう、site_id で絞り込む
-            missing_urls = known_urls - found_urls_in_this_run
+            # 一覧ページを最後まで巡回できた車種に限り、DBにあって今回見つからなかった出品を掲載終了にする
+            # ※ 取得に失敗したメーカー・車種や、差分巡回で飛ばした車種の出品には触れない
+            scope = crawl.reconciliation_scope()
+            print(f"  対象: {len(scope)} 車種（取得失敗で対象外: {len(crawl.failed_models)} 車種）")
+            total_updated = mark_sold_out(db, site_id, scope, found_urls_in_this_run)
             
-            if missing_urls:
-                # 大量のURLを一度に処理すると重いため、100件ずつ更新
-                missing_list = list(missing_urls)
-                chunk_size = 100
-                total_updated = 0
-                
-                for i in range(0, len(missing_list), chunk_size):
-                    chunk = missing_list[i:i + chunk_size]
-                    db.execute(
-                        update(Listing)
-                        .where(Listing.source_url.in_(chunk))
-                        .where(Listing.site_id == site_id)
-                        .values(is_sold_out=True, updated_at=datetime.datetime.now())
-                    )
-                    total_updated += len(chunk)
-                
-                db.commit()
+            if total_updated:
                 print(f"  -> {total_updated} 件の車両を「掲載終了（完売）」として更新しました。")
             else:
                 print("  -> 掲載終了した車両はありませんでした。")
 
+            crawl.finish(db)
             print("\nすべての同期処理が完了しました。")
             db.close()
 
         finally:
-            await browser.close()
+            await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GooBike の出品情報を収集し、掲載終了を判定する")
+    parser.add_argument("--resume", action="store_true", help="直近の未完了の巡回を再開する（完了済みのメーカー・車種を飛ばす）")
+    parser.add_argument("--run-id", type=int, help="再開する巡回ID (crawl_runs.id)")
+    parser.add_argument("--incremental", action="store_true", help="メーカーページの在庫台数が前回と同じ車種の一覧ページを飛ばす")
+    parser.add_argument("--refresh-days", type=int, default=DEFAULT_REFRESH_DAYS, help="差分巡回でも、この日数が経った車種は一覧ページを開き直す")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect(resume=args.resume, run_id=args.run_id, incremental=args.incremental, refresh_days=args.refresh_days))
\ No newline at end of file
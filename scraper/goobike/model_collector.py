@@ -1,11 +1,12 @@
+import argparse
 import asyncio
 import os
 import datetime
 import re
 import sys
+import unicodedata
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
-from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, ForeignKey, UniqueConstraint, bindparam, or_, update
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
 # 1. 環境変数の読み込み
@@ -18,6 +19,11 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.browser import open_browser
+from common import profiling, query_stats, slow_pages
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -74,10 +80,33 @@ class BikeModelIdentifier(Base):
     
     __table_args__ = (UniqueConstraint('site_id', 'identifier', name='_site_identifier_uc'),)
 
+# 車種名の括弧内に排気量だけが書かれている表記 (例: "ＣＢ４００ＳＦ（400cc）")
+PAREN_DISPLACEMENT_PATTERN = re.compile(r'\(\s*(\d{2,4})\s*cc\s*\)', re.IGNORECASE)
+
+def extract_paren_displacement(raw_name):
+    """車種名の括弧書きから排気量を取り出す（記載がなければ None）"""
+    if not raw_name:
+        return None
+    match = PAREN_DISPLACEMENT_PATTERN.search(unicodedata.normalize('NFKC', raw_name))
+    return int(match.group(1)) if match else None
+
+def apply_displacements(db, displacement_updates):
+    """収集した排気量を、未設定 (NULL または 0) の車種にだけまとめて反映する"""
+    if not displacement_updates:
+        return 0
+    table = BikeModel.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam('b_id'))
+        .where(or_(table.c.displacement == None, table.c.displacement == 0))
+        .values(displacement=bindparam('b_displacement'))
+    )
+    db.execute(stmt, [{"b_id": model_id, "b_displacement": disp} for model_id, disp in displacement_updates.items()])
+    return len(displacement_updates)
+
 async def collect():
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("GooBikeモデルコレクター（セキュア版）を起動しています...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -93,66 +122,96 @@ async def collect():
 
         try:
             print(f"メーカー一覧を取得中...")
-            await page.goto(f"{base_url}/maker-top/index.html", wait_until="domcontentloaded", timeout=60000)
+            await slow_pages.goto(page, f"{base_url}/maker-top/index.html", wait_until="domcontentloaded", timeout=60000)
             country_elements = await page.query_selector_all("p.title")
             maker_targets = []
 
-            for country_el in country_elements:
-                country_name = (await country_el.inner_text()).strip()
-                # JSコンテキストで隣接するテーブルからメーカーリンクを抽出
-                makers = await page.evaluate("(el) => { let table = el.nextElementSibling; while(table && table.tagName !== 'TABLE') { table = table.nextElementSibling; } if (!table) return []; const links = table.querySelectorAll('span.mj a'); return Array.from(links).map(a => ({ name: a.innerText, href: a.getAttribute('href') })); }", country_el)
-
-                for link_info in makers:
-                    # 全角括弧などを除去
-                    clean_name = re.sub(r'[\(\uff08].*?[\)\uff09]', '', link_info['name']).strip()
-                    if clean_name:
-                        maker_targets.append({"name": clean_name, "country": country_name, "url": base_url + link_info['href']})
-                        m_record = db.query(Manufacturer).filter(Manufacturer.name == clean_name).first()
-                        if not m_record:
-                            m_record = Manufacturer(name=clean_name, country=country_name)
-                            db.add(m_record)
-                            db.flush()
+            with query_stats.stage("makers"):
+                for country_el in country_elements:
+                    country_name = (await country_el.inner_text()).strip()
+                    # JSコンテキストで隣接するテーブルからメーカーリンクを抽出
+                    makers = await page.evaluate("(el) => { let table = el.nextElementSibling; while(table && table.tagName !== 'TABLE') { table = table.nextElementSibling; } if (!table) return []; const links = table.querySelectorAll('span.mj a'); return Array.from(links).map(a => ({ name: a.innerText, href: a.getAttribute('href') })); }", country_el)
+
+                    for link_info in makers:
+                        # 全角括弧などを除去
+                        clean_name = re.sub(r'[\(\uff08].*?[\)\uff09]', '', link_info['name']).strip()
+                        if clean_name:
+                            maker_targets.append({"name": clean_name, "country": country_name, "url": base_url + link_info['href']})
+                            m_record = db.query(Manufacturer).filter(Manufacturer.name == clean_name).first()
+                            if not m_record:
+                                m_record = Manufacturer(name=clean_name, country=country_name)
+                                db.add(m_record)
+                                db.flush()
             db.commit()
 
-            for target in maker_targets:
-                print(f"--- {target['name']} の車種を取得中 ---")
-                m_record = db.query(Manufacturer).filter(Manufacturer.name == target['name']).first()
-                try:
-                    await page.goto(target['url'], wait_until="domcontentloaded", timeout=60000)
-                    list_items = await page.query_selector_all("li.bike_list")
-                    for item in list_items:
-                        name_elem = await item.query_selector("em b")
-                        if not name_elem: continue
-                        model_name = re.sub(r'[\(\uff08].*?[\)\uff09]', '', await name_elem.inner_text()).strip()
-                        input_elem = await item.query_selector("input[name='model']")
-                        identifier_val = await input_elem.get_attribute("value") if input_elem else None
-
-                        if not model_name: continue
+            # 排気量が未設定の既存車種（一覧ページの括弧書きから補完する対象）
+            displacement_targets = {
+                m.id for m in db.query(BikeModel.id).filter(
+                    or_(BikeModel.displacement == None, BikeModel.displacement == 0)
+                ).all()
+            }
+            total_displacements = 0
+
+            with query_stats.stage("maker_models"):
+                for target in maker_targets:
+                    print(f"--- {target['name']} の車種を取得中 ---")
+                    m_record = db.query(Manufacturer).filter(Manufacturer.name == target['name']).first()
+                    try:
+                        await slow_pages.goto(page, target['url'], wait_until="domcontentloaded", timeout=60000)
+                        list_items = await page.query_selector_all("li.bike_list")
+                        displacement_updates = {}
+                        for item in list_items:
+                            name_elem = await item.query_selector("em b")
+                            if not name_elem: continue
+                            raw_model_name = await name_elem.inner_text()
+                            model_name = re.sub(r'[\(\uff08].*?[\)\uff09]', '', raw_model_name).strip()
+                            displacement = extract_paren_displacement(raw_model_name)
+                            input_elem = await item.query_selector("input[name='model']")
+                            identifier_val = await input_elem.get_attribute("value") if input_elem else None
+
+                            if not model_name: continue
                         
-                        existing_model = db.query(BikeModel).filter(BikeModel.name == model_name).first()
-                        if not existing_model:
-                            existing_model = BikeModel(
-                                name=model_name, 
-                                manufacturer_id=m_record.id, 
-                                category="不明",
-                                displacement=None
-                            )
-                            db.add(existing_model)
-                            db.flush()
-
-                        if identifier_val:
-                            existing_idnt = db.query(BikeModelIdentifier).filter(BikeModelIdentifier.site_id == site_id, BikeModelIdentifier.identifier == identifier_val).first()
-                            if not existing_idnt:
-                                db.add(BikeModelIdentifier(bike_model_id=existing_model.id, site_id=site_id, identifier=identifier_val))
-                    db.commit()
-                except Exception as e:
-                    print(f"エラー ({target['name']}): {e}")
-                    db.rollback()
-
+                            existing_model = db.query(BikeModel).filter(BikeModel.name == model_name).first()
+                            if not existing_model:
+                                existing_model = BikeModel(
+                                    name=model_name, 
+                                    manufacturer_id=m_record.id, 
+                                    category="不明",
+                                    displacement=displacement
+                                )
+                                db.add(existing_model)
+                                db.flush()
+                            elif displacement and existing_model.id in displacement_targets:
+                                displacement_updates[existing_model.id] = displacement
+
+                            if identifier_val:
+                                existing_idnt = db.query(BikeModelIdentifier).filter(BikeModelIdentifier.site_id == site_id, BikeModelIdentifier.identifier == identifier_val).first()
+                                if not existing_idnt:
+                                    db.add(BikeModelIdentifier(bike_model_id=existing_model.id, site_id=site_id, identifier=identifier_val))
+
+                        # 括弧書きから得た排気量はメーカー単位でまとめて更新
+                        total_displacements += apply_displacements(db, displacement_updates)
+                        db.commit()
+                        displacement_targets.difference_update(displacement_updates)
+                    except Exception as e:
+                        print(f"エラー ({target['name']}): {e}")
+                        db.rollback()
+
+            if total_displacements > 0:
+                print(f"車種名から {total_displacements} 件の排気量を補完しました。")
             print("\nGooBike車種マスタ同期が完了しました。")
         finally:
             db.close()
-            await browser.close()
+            await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GooBike のメーカー・車種マスタを収集する")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect())
\ No newline at end of file
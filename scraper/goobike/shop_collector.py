@@ -1,13 +1,13 @@
+import argparse
 import asyncio
 import os
 import datetime
 import re
 import sys
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
-from sqlalchemy import create_engine, Column, BigInteger, String, Text, DateTime, ForeignKey, UniqueConstraint, or_
+from sqlalchemy import create_engine, Column, BigInteger, String, Text, DateTime, ForeignKey, UniqueConstraint, or_, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
-from sqlalchemy.exc import IntegrityError
 
 # 1. 環境変数の読み込み
 # 現在のファイル位置 (scraper/goobike/) から見て、1つ上の階層 (scraper/) にある .env を探す
@@ -19,6 +19,11 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common.browser import open_browser
+from common import profiling, query_stats, slow_pages
+
 def get_env_or_exit(key, default=None, required=True):
     """
     環境変数を取得する。
@@ -84,76 +89,112 @@ async def block_resources(route):
     else:
         await route.continue_()
 
+def flush_shop_page(db, site_id, pending_shops, pending_idents, shop_cache, ident_cache):
+    """
+    1ページ分の新規店舗と識別番号を、複数行の upsert でまとめて書き込む。
+    店舗は一意な住所、識別番号は (site_id, identifier) をキーとし、既存行はそのまま残す。
+    """
+    if pending_shops:
+        shop_table = Shop.__table__
+        stmt = mysql_insert(shop_table).values(list(pending_shops.values()))
+        # shops は店名・住所のどちらも一意のため、店名で衝突した場合に住所を書き換えないよう何も更新しない
+        db.execute(stmt.on_duplicate_key_update(id=shop_table.c.id))
+
+        # 住所から店舗IDを一括で解決し、キャッシュと同じ (店名, 住所) が一致するものだけを採用する
+        addresses = [address for _, address in pending_shops]
+        for s_id, s_name, s_address in db.execute(
+            select(shop_table.c.id, shop_table.c.name, shop_table.c.address).where(shop_table.c.address.in_(addresses))
+        ).all():
+            if (s_name, s_address) in pending_shops:
+                shop_cache[(s_name, s_address)] = s_id
+
+    ident_rows = {}
+    for identifier, key in pending_idents:
+        shop_id = shop_cache.get(key)
+        if shop_id and (site_id, identifier) not in ident_cache:
+            ident_rows.setdefault(identifier, {"shop_id": shop_id, "site_id": site_id, "identifier": identifier})
+
+    if ident_rows:
+        ident_table = ShopIdentifier.__table__
+        stmt = mysql_insert(ident_table).values(list(ident_rows.values()))
+        db.execute(stmt.on_duplicate_key_update(shop_id=ident_table.c.shop_id))
+
+    db.commit()
+    ident_cache.update((site_id, identifier) for identifier in ident_rows)
+
 async def process_prefecture(context, pref, site_id, shop_cache, ident_cache):
     """1つの都道府県の店舗情報を収集するタスク"""
     async with semaphore:
-        db = SessionLocal()
-        page = await context.new_page()
-        await page.route("**/*", block_resources)
+        with query_stats.stage("prefecture"):
+            db = SessionLocal()
+            page = await context.new_page()
+            await page.route("**/*", block_resources)
 
-        base_url = "https://www.goobike.com"
-        current_page_url = pref['url']
+            base_url = "https://www.goobike.com"
+            current_page_url = pref['url']
         
-        try:
-            print(f"  [開始] {pref['name']}")
-            while current_page_url:
-                await page.goto(current_page_url, wait_until="domcontentloaded", timeout=60000)
-                shop_elements = await page.query_selector_all(".shop_header")
+            try:
+                print(f"  [開始] {pref['name']}")
+                while current_page_url:
+                    await slow_pages.goto(page, current_page_url, wait_until="domcontentloaded", timeout=60000)
+                    shop_elements = await page.query_selector_all(".shop_header")
+
+                    # ページ単位で書き込む新規店舗（(店名, 住所) -> 行）と識別番号（識別番号, (店名, 住所)）
+                    pending_shops = {}
+                    pending_idents = []
                 
-                for shop_el in shop_elements:
-                    try:
-                        name_link_el = await shop_el.query_selector(".shop_name a")
-                        if not name_link_el: continue
-                        name = (await name_link_el.inner_text()).strip()
-                        href = await name_link_el.get_attribute("href")
-                        
-                        identifier = None
-                        if href:
-                            match = re.search(r'client_(\d+)', href)
-                            if match: identifier = match.group(1)
-
-                        # JSでDOMから住所を取得
-                        address = await page.evaluate("(el) => { const addr = el.parentElement.querySelector('.shop_address'); return addr ? addr.innerText : ''; }", shop_el)
-                        address = address.strip()
-
-                        # キャッシュによる重複チェック (名前+住所)
-                        shop_id = shop_cache.get((name, address))
-                        if not shop_id:
-                            shop_record = Shop(
-                                name=name, 
-                                prefecture=pref['name'], 
-                                address=address, 
-                                website_url=base_url + href if href else None
-                            )
-                            db.add(shop_record)
-                            db.flush()
-                            shop_id = shop_record.id
-                            shop_cache[(name, address)] = shop_id
+                    for shop_el in shop_elements:
+                        try:
+                            name_link_el = await shop_el.query_selector(".shop_name a")
+                            if not name_link_el: continue
+                            name = (await name_link_el.inner_text()).strip()
+                            href = await name_link_el.get_attribute("href")
                         
-                        # 識別番号の登録
-                        if identifier:
-                            if (site_id, identifier) not in ident_cache:
-                                db.add(ShopIdentifier(shop_id=shop_id, site_id=site_id, identifier=identifier))
-                                ident_cache.add((site_id, identifier))
+                            identifier = None
+                            if href:
+                                match = re.search(r'client_(\d+)', href)
+                                if match: identifier = match.group(1)
+
+                            # JSでDOMから住所を取得
+                            address = await page.evaluate("(el) => { const addr = el.parentElement.querySelector('.shop_address'); return addr ? addr.innerText : ''; }", shop_el)
+                            address = address.strip()
+
+                            # キャッシュによる重複チェック (名前+住所)。未登録ならページ単位の新規登録候補に追加
+                            key = (name, address)
+                            if key not in shop_cache and key not in pending_shops:
+                                pending_shops[key] = {
+                                    "name": name,
+                                    "prefecture": pref['name'],
+                                    "address": address,
+                                    "website_url": base_url + href if href else None,
+                                }
                         
-                        db.commit()
-                    except Exception:
+                            # 識別番号の登録候補（新規店舗の場合は書き込み時に店舗IDを解決）
+                            if identifier and (site_id, identifier) not in ident_cache:
+                                pending_idents.append((identifier, key))
+                        except Exception:
+                            pass
+
+                    # ページ分をまとめて書き込み
+                    try:
+                        flush_shop_page(db, site_id, pending_shops, pending_idents, shop_cache, ident_cache)
+                    except Exception as e:
                         db.rollback()
+                        print(f"      書き込みエラー ({pref['name']}): {e}")
 
-                # ページネーション処理
-                next_button = await page.query_selector(".pager_next a")
-                current_page_url = base_url + (await next_button.get_attribute("href")) if next_button else None
+                    # ページネーション処理
+                    next_button = await page.query_selector(".pager_next a")
+                    current_page_url = base_url + (await next_button.get_attribute("href")) if next_button else None
                 
-        except Exception as e:
-            print(f"  [エラー] {pref['name']}: {e}")
-        finally:
-            db.close()
-            await page.close()
+            except Exception as e:
+                print(f"  [エラー] {pref['name']}: {e}")
+            finally:
+                db.close()
+                await page.close()
 
 async def collect():
-    async with async_playwright() as p:
+    async with open_browser() as browser:
         print("GooBikeショップコレクター（セキュア・高速版）を起動しています...")
-        browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
@@ -174,7 +215,7 @@ async def collect():
             # 都道府県一覧の取得
             temp_page = await context.new_page()
             await temp_page.route("**/*", block_resources)
-            await temp_page.goto("https://www.goobike.com/shop/", wait_until="domcontentloaded")
+            await slow_pages.goto(temp_page, "https://www.goobike.com/shop/", wait_until="domcontentloaded")
             
             pref_links = await temp_page.query_selector_all(".mapBox li a")
             pref_urls = []
@@ -200,7 +241,16 @@ async def collect():
             print("\nGooBike販売店データの収集が完了しました。")
         finally:
             db.close()
-            await browser.close()
+            await context.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GooBike の販売店情報を収集する")
+    profiling.add_argument(parser)
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(collect())
\ No newline at end of file
+    args = parse_args()
+    slow_pages.configure(args.capture_slow_pages)
+    with profiling.profile(args.profile):
+        asyncio.run(collect())
\ No newline at end of file
@@ -1,78 +1,411 @@
+import argparse
+import asyncio
+import contextvars
+import datetime
+import importlib.util
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import traceback
 import os
 
-def run_script(script_name):
-    """指定したスクリプトを外部プロセスとして実行する"""
-    print(f"\n{'='*60}")
-    print(f" 実行中: {script_name}")
-    print(f"{'='*60}")
-    
+from common import profiling, prom_metrics, run_metrics, slow_pages
+
+# 同時に実行するステップ数の上限（ブラウザを起動するコレクターが多いため控えめにする）
+DEFAULT_MAX_PARALLEL = 3
+
+# 実行するスクリプトと依存関係
+# deps のステップがすべて終わったものから順に、上限の範囲で並行して実行する。
+# GooBike と BDS の系統は共有のマスタテーブル (manufacturers, bike_models, shops) でのみ交わるため、
+# 同じテーブルに書き込むステップ同士だけを直列にしている。
+# entry は --in-process で呼び出す関数。master はマスタ作成のステップ（失敗時はパイプライン全体を中断する）。
+STEPS = [
+    # --- STEP 1: マスタデータの作成 (bike_models を共有するため GooBike -> BDS の順) ---
+    {"script": "goobike/model_collector.py", "deps": [], "entry": "collect", "master": True},
+    {"script": "bds/model_collector.py", "deps": ["goobike/model_collector.py"], "entry": "collect", "master": True},
+
+    # --- STEP 2: マスタの補完・修正 ---
+    {"script": "common/bike_model_displacement_fixer.py", "deps": ["goobike/model_collector.py", "bds/model_collector.py"], "entry": "fix_displacements"},
+    {"script": "goobike/category_collector.py", "deps": ["goobike/model_collector.py"], "entry": "collect", "master": True},
+    {"script": "bds/category_collector.py", "deps": ["bds/model_collector.py"], "entry": "collect", "master": True},
+
+    # --- STEP 3: 販売店情報の収集と地理情報の付与 (shops を共有するため GooBike -> BDS の順) ---
+    {"script": "goobike/shop_collector.py", "deps": [], "entry": "collect", "master": True},
+    {"script": "bds/shop_collector.py", "deps": ["goobike/shop_collector.py"], "entry": "collect", "master": True},
+    # {"script": "common/geocoding_service.py", "deps": ["goobike/shop_collector.py", "bds/shop_collector.py"]}, # APIキー取得後に有効化を推奨
+
+    # --- STEP 4: 出品情報の収集 (一覧カードから排気量も補完) ---
+    {"script": "goobike/listing_collector.py", "deps": ["goobike/model_collector.py", "goobike/shop_collector.py"], "entry": "collect"},
+    {"script": "bds/listing_collector.py", "deps": ["bds/model_collector.py", "bds/shop_collector.py"], "entry": "collect"},
+
+    # --- STEP 5: 詳細スペックの深掘り収集 (一覧で補完できなかった車種のみ) ---
+    {"script": "bds/displacement_collector.py", "deps": ["bds/listing_collector.py", "common/bike_model_displacement_fixer.py"], "entry": "collect"},
+
+    # --- STEP 6: 新着出品の詳細ページ補完 (前回の補完位置以降に登録された出品のみ) ---
+    {"script": "common/listing_enricher.py", "deps": ["goobike/listing_collector.py", "bds/listing_collector.py"], "entry": "run"},
+
+    # --- STEP 7: 画像のローカル同期 (UIに必須) ---
+    {"script": "common/image_downloader.py", "deps": ["goobike/listing_collector.py", "bds/listing_collector.py"], "entry": "run"},
+    # 一覧用サムネイル・WebP 版の生成 (新しく保存した画像のみ)
+    {"script": "common/image_derivatives.py", "deps": ["common/image_downloader.py"], "entry": "generate"},
+
+    # --- STEP 8: 掲載終了から一定期間が経過した出品をアーカイブへ退避 ---
+    # 出品を読み書きするステップがすべて終わってから行う（処理中の出品を退避すると、その結果や画像の参照数が失われる）
+    {"script": "common/listing_archiver.py", "deps": [
+        "goobike/listing_collector.py", "bds/listing_collector.py",
+        "common/listing_enricher.py", "common/image_downloader.py", "common/image_derivatives.py",
+    ], "entry": "archive"},
+]
+
+# 並行実行時に出力行が混ざらないようにする
+print_lock = threading.RLock()
+
+# --in-process で実行中のステップ名（出力の行頭に付ける）
+current_step = contextvars.ContextVar("current_step", default=None)
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+def is_master_step(step):
+    """重要なマスタ作成ステップかどうか（失敗時はパイプライン全体を中断する）"""
+    return step.get("master", False)
+
+def validate_steps(steps):
+    """依存先の記述漏れと循環がないことを確認し、依存順に並べたスクリプト名を返す"""
+    by_name = {s["script"]: s for s in steps}
+    for step in steps:
+        for dep in step["deps"]:
+            if dep not in by_name:
+                raise ValueError(f"{step['script']} の依存先 {dep} が STEPS にありません。")
+
+    order, state = [], {}
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"依存関係が循環しています: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dep in by_name[name]["deps"]:
+            visit(dep, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for step in steps:
+        visit(step["script"], [])
+    return order
+
+def run_script(script_name, pipeline_start):
+    """指定したスクリプトを外部プロセスとして実行し、結果と開始・終了時刻を返す"""
     start_time = time.time()
-    
+    result = {"ok": False, "returncode": None, "start": start_time - pipeline_start, "end": start_time - pipeline_start}
+
     # ファイルが存在するか確認
     if not os.path.exists(script_name):
-        print(f"エラー: {script_name} が見つかりません。スキップします。")
-        return False
+        log(f"エラー: {script_name} が見つかりません。スキップします。")
+        return result
+
+    log(f"\n{'='*60}\n 実行中: {script_name}\n{'='*60}")
 
-    # 外部プロセスとして実行
+    # 子プロセスが終了時に件数を書き出すファイル (common/run_metrics.py)
+    metrics_path = os.path.join(tempfile.gettempdir(), f"scrape_metrics_{os.getpid()}_{script_name.replace('/', '_')}.json")
+    # Prometheus のメトリクス (common/prom_metrics.py) にはステップ名を付けて書き出させる
+    env = dict(os.environ, **{run_metrics.METRICS_FILE_ENV: metrics_path, prom_metrics.STEP_ENV: script_name})
+
+    # 外部プロセスとして実行し、どのステップの出力か分かるよう行頭にスクリプト名を付ける
     process = subprocess.Popen(
-        [sys.executable, script_name],
-        stdout=sys.stdout,
-        stderr=sys.stderr
+        [sys.executable, "-u", script_name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        env=env,
     )
-    process.wait()
-    
+    for line in process.stdout:
+        log(f"[{script_name}] {line.rstrip()}")
+    # wait4 で終了を待ち、子プロセスのピークRSSも受け取る
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    metrics = run_metrics.read_file(metrics_path) or {}
+    metrics["peak_rss_kb"] = rusage.ru_maxrss
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+
     end_time = time.time()
     duration = end_time - start_time
-    
-    if process.returncode == 0:
-        print(f"\n成功: {script_name} (所要時間: {duration:.2f}秒)")
-        return True
+    result.update(ok=process.returncode == 0, returncode=process.returncode, end=end_time - pipeline_start, metrics=metrics)
+
+    if result["ok"]:
+        log(f"\n成功: {script_name} (所要時間: {duration:.2f}秒)")
     else:
-        print(f"\n失敗: {script_name} (エラーコード: {process.returncode})")
-        # 重要なマスタ作成ステップで失敗した場合は、後続のデータ不整合を防ぐため停止させる
-        if "collector" in script_name and "listing" not in script_name:
-            print("マスタデータの収集に失敗したため、プロセスを中断します。")
-            sys.exit(process.returncode)
-        return False
+        log(f"\n失敗: {script_name} (エラーコード: {process.returncode})")
+    return result
+
+def critical_path(steps, results):
+    """各ステップの所要時間から、全体の所要時間を決めた最長の依存経路を求める"""
+    by_name = {s["script"]: s for s in steps}
+    longest = {}
+    for name in validate_steps(steps):
+        if name not in results:
+            continue
+        duration = results[name]["end"] - results[name]["start"]
+        prev = max((longest[d] for d in by_name[name]["deps"] if d in longest), key=lambda p: p[0], default=(0, []))
+        longest[name] = (prev[0] + duration, prev[1] + [name])
+    if not longest:
+        return 0, []
+    return max(longest.values(), key=lambda p: p[0])
+
+def run_subprocess_step(step, pipeline_start):
+    return asyncio.to_thread(run_script, step["script"], pipeline_start)
+
+class StepOutput:
+    """--in-process 実行時の標準出力。どのステップの出力か分かるよう、行単位で行頭にスクリプト名を付ける"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text):
+        step = current_step.get()
+        if step is None:
+            return self.stream.write(text)
+        with print_lock:
+            *lines, rest = (self.buffers.get(step, "") + text).split("\n")
+            self.buffers[step] = rest
+            for line in lines:
+                self.stream.write(f"[{step}] {line}\n")
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def flush_step(self, step):
+        with print_lock:
+            rest = self.buffers.pop(step, "")
+            if rest:
+                self.stream.write(f"[{step}] {rest}\n")
+
+class InProcessRunner:
+    """
+    各ステップのモジュールを同じインタープリタに読み込み、entry の関数を直接呼び出す。
+    DBエンジン・ブラウザはステップ間で共有し、例外や sys.exit はステップ単位で受け止める。
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.engine = None
+
+    def load(self, script_name):
+        module_name = "pipeline_" + script_name[:-3].replace("/", "_")
+        spec = importlib.util.spec_from_file_location(module_name, os.path.abspath(script_name))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        # モジュールが読み込み時に作ったエンジンを捨て、共有のエンジンに差し替える
+        if hasattr(module, "engine"):
+            from sqlalchemy import create_engine
+            from sqlalchemy.orm import sessionmaker
+            if self.engine is None:
+                self.engine = create_engine(module.engine.url, pool_size=10, max_overflow=20, pool_pre_ping=True)
+            if module.engine is not self.engine:
+                module.engine.dispose()
+                module.engine = self.engine
+            if hasattr(module, "SessionLocal"):
+                module.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        return module
+
+    async def run_step(self, step, pipeline_start):
+        script_name = step["script"]
+        start_time = time.time()
+        result = {"ok": False, "returncode": None, "start": start_time - pipeline_start, "end": start_time - pipeline_start}
+        if not os.path.exists(script_name):
+            log(f"エラー: {script_name} が見つかりません。スキップします。")
+            return result
+
+        log(f"\n{'='*60}\n 実行中: {script_name} (in-process)\n{'='*60}")
+        token = current_step.set(script_name)
+        prom_token = prom_metrics.current_step.set(script_name)
+        # このステップ（とそこから起動したタスク・スレッド）の件数を別のカウンタに集計する
+        step_counters = run_metrics.start_step()
+        try:
+            entry = getattr(self.load(script_name), step["entry"])
+            if asyncio.iscoroutinefunction(entry):
+                await entry()
+            else:
+                # 同期処理はイベントループを止めないよう別スレッドで実行する
+                await asyncio.to_thread(entry)
+            returncode = 0
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            returncode = 1
+        finally:
+            self.output.flush_step(script_name)
+            current_step.reset(token)
+            prom_metrics.current_step.reset(prom_token)
+
+        end_time = time.time()
+        # ピークRSSはプロセス全体の値（同時に動いた他のステップを含む）
+        result.update(ok=returncode == 0, returncode=returncode, end=end_time - pipeline_start, metrics=run_metrics.snapshot(step_counters))
+        if result["ok"]:
+            log(f"\n成功: {script_name} (所要時間: {end_time - start_time:.2f}秒)")
+        else:
+            log(f"\n失敗: {script_name} (エラーコード: {returncode})")
+        return result
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.dispose()
+
+async def run_pipeline(steps, max_parallel, start_step):
+    """依存関係を満たしたステップから並行して実行する。マスタ作成の失敗時は新たなステップを起動せずに中断する"""
+    validate_steps(steps)
+    pipeline_start = time.time()
+    steps_by_name = {s["script"]: s for s in steps}
+    pending = dict(steps_by_name)
+    results = {}
+    running = {}
+    abort_code = None
+
+    while pending or running:
+        if abort_code is None:
+            for name, step in list(pending.items()):
+                if len(running) >= max_parallel:
+                    break
+                if all(dep in results for dep in step["deps"]):
+                    del pending[name]
+                    running[asyncio.ensure_future(start_step(step, pipeline_start))] = name
+
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            name = running.pop(task)
+            results[name] = task.result()
+            # 重要なマスタ作成ステップで失敗した場合は、後続のデータ不整合を防ぐため停止させる
+            if not results[name]["ok"] and results[name]["returncode"] is not None and is_master_step(steps_by_name[name]) and abort_code is None:
+                log("マスタデータの収集に失敗したため、実行中のステップの終了を待って中断します。")
+                abort_code = results[name]["returncode"]
+
+    return results, list(pending), abort_code
+
+async def run_in_process(steps, max_parallel):
+    """すべてのステップを1つのインタープリタ・1つのイベントループで実行する"""
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from common.browser import start_shared_browser, stop_shared_browser
+
+    output = StepOutput(sys.stdout)
+    runner = InProcessRunner(output)
+    sys.stdout = output
+    try:
+        await start_shared_browser()
+        return await run_pipeline(steps, max_parallel, runner.run_step)
+    finally:
+        await stop_shared_browser()
+        runner.close()
+        sys.stdout = output.stream
+
+def print_summary(steps, results, skipped, total_duration):
+    log(f"\n{'='*60}")
+    log(" 実行結果")
+    log(f"{'='*60}")
+    for step in steps:
+        name = step["script"]
+        if name in results:
+            r = results[name]
+            status = "成功" if r["ok"] else "失敗"
+            log(f"  {status}  {name}  ({r['start']:.1f}s -> {r['end']:.1f}s, {r['end'] - r['start']:.2f}秒)")
+            m = r.get("metrics") or {}
+            if m.get("pages_fetched") or m.get("rows_inserted") or m.get("rows_updated") or m.get("rows_sold_out"):
+                log(f"        取得 {m.get('pages_fetched', 0)} ページ ({m.get('bytes_fetched', 0) / 1024 / 1024:.1f}MB) / "
+                    f"登録 {m.get('rows_inserted', 0)} / 更新 {m.get('rows_updated', 0)} / 掲載終了 {m.get('rows_sold_out', 0)} / "
+                    f"エラー {m.get('errors', 0)} / リトライ {m.get('retries', 0)}")
+        elif name in skipped:
+            log(f"  未実行 {name}")
+
+    length, path = critical_path(steps, results)
+    if path:
+        log(f"\nクリティカルパス ({length/60:.2f}分 / 全体 {total_duration/60:.2f}分):")
+        for name in path:
+            log(f"  -> {name} ({results[name]['end'] - results[name]['start']:.2f}秒)")
+
+def record_metrics(mode, max_parallel, started_at, wall_seconds, results, skipped, abort_code):
+    """実行とステップのメトリクスを scrape_runs / scrape_run_steps に記録する（DBに書けなくてもパイプラインは失敗にしない）"""
+    try:
+        from common import scrape_runs
+        run_id = scrape_runs.record_run(mode, max_parallel, started_at, wall_seconds, STEPS, results, skipped, abort_code)
+        log(f"\n実行メトリクスを記録しました (scrape_runs #{run_id})。過去の実行との比較: python common/scrape_runs.py")
+    except (Exception, SystemExit) as e:
+        log(f"\n警告: 実行メトリクスを記録できませんでした: {e}")
+
+def print_profile_outputs():
+    """この実行で書き出したプロファイルの一覧を表示する"""
+    directory = os.environ.get(profiling.PROFILE_DIR_ENV)
+    if not directory or not os.path.isdir(directory):
+        return
+    print(f"\nプロファイルの出力 ({directory}):")
+    for name in sorted(os.listdir(directory)):
+        print(f"  {name} ({os.path.getsize(os.path.join(directory, name)) / 1024:.1f}KB)")
+
+def start_metrics(port, directory):
+    """Prometheus 形式のメトリクスの書き出しと /metrics の公開を始める"""
+    if port and not directory:
+        # 子プロセスの値を集めるための受け渡し場所
+        directory = tempfile.mkdtemp(prefix="scraper_metrics_")
+    if directory:
+        prom_metrics.start_textfile(directory)
+        log(f"メトリクスの書き出し先: {directory}")
+    if port:
+        prom_metrics.serve(port, directory)
+        log(f"メトリクスを公開しています: http://localhost:{port}/metrics")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MotoHub データ収集パイプラインを依存関係に沿って実行する")
+    parser.add_argument("--max-parallel", type=int, default=DEFAULT_MAX_PARALLEL, help="同時に実行するステップ数の上限 (1 で従来どおりの直列実行)")
+    parser.add_argument("--in-process", action="store_true", help="ステップごとにプロセスを起動せず、同じインタープリタでエンジン・ブラウザを共有して実行する")
+    parser.add_argument("--metrics-port", type=int, help="実行中、Prometheus 形式のメトリクスを http://localhost:<port>/metrics で公開する")
+    parser.add_argument("--profile", choices=profiling.PROFILE_MODES, help="各ステップをプロファイルする (cpu / mem / async / sql / trace)。出力は scraper/profiles/<日時>/ にまとめる")
+    parser.add_argument("--metrics-dir", help="各ステップのメトリクスを <ステップ名>.prom として書き出すディレクトリ (node_exporter の textfile collector 向け)")
+    slow_pages.add_argument(parser)
+    return parser.parse_args()
 
 def main():
-    # 実行するスクリプトの最適な順番
-    scripts = [
-        # --- STEP 1: マスタデータの作成 ---
-        "goobike/model_collector.py",
-        "bds/model_collector.py",
-        
-        # --- STEP 2: マスタの補完・修正 ---
-        "common/bike_model_displacement_fixer.py",
-        "goobike/category_collector.py",
-        "bds/category_collector.py",
-        
-        # --- STEP 3: 販売店情報の収集と地理情報の付与 ---
-        "goobike/shop_collector.py",
-        "bds/shop_collector.py",
-        # "common/geocoding_service.py", # APIキー取得後に有効化を推奨
-        
-        # --- STEP 4: 詳細スペックの深掘り収集 ---
-        "bds/displacement_fixer.py", 
-        
-        # --- STEP 5: 出品情報の収集 ---
-        "goobike/listing_collector.py",
-        "bds/listing_collector.py",
-        
-        # --- STEP 6: 画像のローカル同期 (UIに必須) ---
-        "common/image_downloader.py",
-    ]
+    args = parse_args()
 
     print("MotoHub データ収集パイプラインを開始します...")
     total_start = time.time()
+    started_at = datetime.datetime.now()
 
-    for script in scripts:
-        run_script(script)
+    max_parallel = max(1, args.max_parallel)
+    start_metrics(args.metrics_port, args.metrics_dir)
+    # 子プロセスには環境変数で、--in-process の各ステップには同じプロセスの設定として引き継がれる
+    slow_pages.configure(args.capture_slow_pages)
+    if args.in_process:
+        # 同じプロセスで動くため、パイプライン全体を1つのプロファイルとして取る
+        with profiling.profile(args.profile, "run_all"):
+            results, skipped, abort_code = asyncio.run(run_in_process(STEPS, max_parallel))
+    else:
+        if args.profile:
+            # 各ステップのプロセスが同じモード・同じ出力先でプロファイルを取る
+            os.environ[profiling.PROFILE_ENV] = args.profile
+            log(f"プロファイル ({args.profile}) の出力先: {profiling.run_directory()}")
+        results, skipped, abort_code = asyncio.run(run_pipeline(STEPS, max_parallel, run_subprocess_step))
 
     total_end = time.time()
+    print_summary(STEPS, results, skipped, total_end - total_start)
+    if args.profile:
+        print_profile_outputs()
+    record_metrics("in-process" if args.in_process else "subprocess", max_parallel, started_at, total_end - total_start, results, skipped, abort_code)
+
+    if abort_code is not None:
+        print("マスタデータの収集に失敗したため、プロセスを中断しました。")
+        sys.exit(abort_code)
+
     print(f"\n{'='*60}")
     print(f" 全プロセス完了！ 合計所要時間: {(total_end - total_start)/60:.2f}分")
     print(f"{'='*60}")
@@ -1,14 +1,14 @@
+import argparse
 import scrapy
 from scrapy.crawler import CrawlerProcess
 from scrapy.signalmanager import dispatcher
 from scrapy import signals
 import os
-import re
 import datetime
 import sys
 import random
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, BigInteger, String, Numeric, Integer, Boolean, Text, JSON, DateTime, update
+from sqlalchemy import create_engine, Column, BigInteger, String, Numeric, Integer, Boolean, Text, JSON, DateTime, update, bindparam, or_
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
 # 1. 環境変数の読み込み
@@ -19,6 +19,13 @@ load_dotenv(dotenv_path=env_path)
 if not os.getenv("DB_DATABASE"):
     load_dotenv()
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(current_dir, '..'))
+from common import profiling, prom_metrics, run_metrics
+from common.listing_snapshot import ListingSnapshot, card_fingerprint, mark_sold_out, url_hash
+from common.parse_pool import ParsePool, default_workers
+from common.parsers.records import parse_stock_count
+
 def get_env_or_exit(key, default=None, required=True):
     val = os.getenv(key, default)
     if required and val is None:
@@ -49,11 +56,13 @@ class Listing(Base):
     site_id = Column(BigInteger, nullable=False)
     title = Column(String(255), nullable=True)
     source_url = Column(Text, nullable=False)
+    url_hash = Column(String(40), nullable=True)
     price = Column(Numeric(12, 0))
     total_price = Column(Numeric(12, 0), nullable=True)
     model_year = Column(Integer, nullable=True)
     mileage = Column(Integer, nullable=True)
     image_urls = Column(JSON, nullable=True)
+    fingerprint = Column(String(40), nullable=True)
     is_sold_out = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.datetime.now)
     updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
@@ -77,6 +86,11 @@ class Site(Base):
     id = Column(BigInteger, primary_key=True)
     name = Column(String(50))
 
+class BikeModel(Base):
+    __tablename__ = "bike_models"
+    id = Column(BigInteger, primary_key=True)
+    displacement = Column(Integer, nullable=True)
+
 # 2. Scrapy Spiderの定義
 class BDSListingSpider(scrapy.Spider):
     name = "bds_listings"
@@ -120,9 +134,11 @@ class BDSListingSpider(scrapy.Spider):
         'DOWNLOAD_DELAY': 0.5,
         'COOKIES_ENABLED': False,
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        # 解析をプロセスプールに任せ、コールバックから await できるよう asyncio のリアクターを使う
+        'TWISTED_REACTOR': 'twisted.internet.asyncioreactor.AsyncioSelectorReactor',
     }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, parse_workers=None, *args, **kwargs):
         super(BDSListingSpider, self).__init__(*args, **kwargs)
         self.db = SessionLocal()
         
@@ -134,9 +150,31 @@ class BDSListingSpider(scrapy.Spider):
         self.model_ident_cache = {i.identifier: i.bike_model_id for i in self.db.query(BikeModelIdentifier).filter(BikeModelIdentifier.site_id == self.site_id).all()}
         self.shop_cache = {i.identifier: i.shop_id for i in self.db.query(ShopIdentifier).filter(ShopIdentifier.site_id == self.site_id).all()}
         
-        # DBにある「販売中」のURLをロード
-        self.known_urls = {l.source_url for l in self.db.query(Listing.source_url).filter(Listing.site_id == self.site_id, Listing.is_sold_out == False).all()}
+        # DBにある「販売中」のURLとスナップショットをロード
+        self.snapshot = ListingSnapshot(self.site_id)
+        self.known_urls = self.snapshot.load(self.db)
         self.found_urls = set()
+        # 一覧ページを最後まで処理できた車種 / 取得に失敗した車種（掲載終了判定の対象を絞る）
+        self.crawled_models = set()
+        self.failed_models = set()
+        # 販売中の出品がある車種（車両カードが1件も取れなかった一覧ページを取得失敗とみなす判定に使う）
+        self.listed_models = {
+            row.bike_model_id for row in self.db.query(Listing.bike_model_id).filter(
+                Listing.site_id == self.site_id, Listing.is_sold_out == False
+            ).distinct()
+        }
+
+        # 一覧ページの解析プール（巡回する車種が少なければインラインで解析）
+        self.parse_pool = ParsePool("bds", workers=parse_workers, expected_pages=len(self.model_ident_cache))
+        print(self.parse_pool.describe())
+
+        # 排気量が未設定の車種（一覧カードから補完し、排気量コレクターの巡回対象から外す）
+        self.displacement_targets = {
+            m.id for m in self.db.query(BikeModel.id).filter(
+                or_(BikeModel.displacement == None, BikeModel.displacement == 0)
+            ).all()
+        }
+        self.displacement_updates = {}
 
         # 終了時処理
         dispatcher.connect(self.spider_closed, signals.spider_closed)
@@ -159,130 +197,131 @@ class BDSListingSpider(scrapy.Spider):
                     yield response.follow(
                         href, 
                         callback=self.parse_listings, 
-                        meta={'bike_model_id': bike_model_id}
+                        errback=self.listing_page_failed,
+                        meta={'bike_model_id': bike_model_id, 'stock_count': parse_stock_count(item.xpath("string()").get() or ""), 'cards': 0}
                     )
 
-    def parse_listings(self, response):
+    async def parse_listings(self, response):
         """出品一覧ページから車両データを抽出"""
         bike_model_id = response.meta['bike_model_id']
-        bike_blocks = response.css("li.type_bike, li.type_bike_sp")
+        # レスポンスのHTMLは共通パーサー (common/parsers/bds.py) でワーカープロセスに解析させ、結果だけを受け取る
+        run_metrics.page_fetched(response.body)
+        prom_metrics.observe(prom_metrics.PAGE_FETCH_SECONDS, response.meta.get("download_latency", 0), site="bds", page_type="model")
+        listing_page = await self.parse_pool.parse(response.body, response.url)
+
+        # 在庫があるはずの車種（または前のページに車両があった車種）で車両カードが1件も取れなかったページは、
+        # 取得失敗として掲載終了判定の対象から外す
+        stock_count = response.meta.get('stock_count')
+        if not listing_page.cards and (response.meta.get('cards') or stock_count or bike_model_id in self.listed_models):
+            self.failed_models.add(bike_model_id)
+            run_metrics.count("errors")
+            self.logger.error(f"在庫 {stock_count} 台の車種で車両カードが見つかりません: {response.url}")
+            return
         
-        for bike in bike_blocks:
+        for parsed in listing_page.cards:
             try:
-                # URLとタイトル
-                title_el = bike.css(".c-search_block_title a, .c-search_block_title02 a")
-                if not title_el: continue
-                
-                v_url = response.urljoin(title_el.css("::attr(href)").get())
-                v_title = title_el.css("::text").get().strip()
+                v_url = parsed.url
 
                 # 今回見つかったURLとして記録
                 self.found_urls.add(v_url)
 
-                # 重複スキップ
+                # 排気量の副次収集（既知の車両カードからも拾う）
+                if bike_model_id in self.displacement_targets and parsed.displacement:
+                    self.displacement_updates[bike_model_id] = parsed.displacement
+                    self.displacement_targets.discard(bike_model_id)
+
+                card = parsed.to_card(self.shop_cache.get(parsed.shop_identifier))
+
+                # 既知の車両はカード内容の変化（価格履歴・フィンガープリント）だけを記録してスキップ
                 if v_url in self.known_urls:
+                    self.snapshot.observe(v_url, card)
                     continue
 
-                # 価格取得
-                price_val, total_price_val = 0, None
-                price_items = bike.css(".c-search_block_price")
-                for p_item in price_items:
-                    l_text = p_item.css(".c-search_block_price_title::text").get()
-                    v_text = "".join(p_item.css(".c-search_block_price_text *::text").getall()).replace(',', '').replace('\n', '').strip()
-                    
-                    match = re.search(r'(\d+\.?\d*)', v_text)
-                    if match:
-                        num = int(float(match.group(1)) * 10000)
-                        if l_text and "本体価格" in l_text: price_val = num
-                        elif l_text and "支払総額" in l_text: total_price_val = num
-
-                # スペック取得 (年式・距離)
-                year, mile = None, None
-                status_cols = bike.css(".c-search_status_col")
-                for col in status_cols:
-                    h_txt = col.css(".c-search_status_head::text").get()
-                    v_txt = "".join(col.css(".c-search_status_title01 *::text").getall())
-                    
-                    if h_txt and "モデル年" in h_txt and "不明" not in v_txt:
-                        y_m = re.search(r'(\d{4})', v_txt)
-                        if y_m: year = int(y_m.group(1))
-                    elif h_txt and "距離" in h_txt:
-                        m_m = re.search(r'(\d+)', v_txt.replace(',', ''))
-                        if m_m: mile = int(m_m.group(1))
-
-                # 画像
-                img_url = bike.css(".c-bike_image figure.c-img_cover::attr(data-src)").get() or \
-                          bike.css(".c-bike_image figure.c-img_cover::attr(src)").get()
-                images = [response.urljoin(img_url)] if img_url and "blank" not in img_url else []
-
-                # 販売店特定
-                shop_id = None
-                shop_href = bike.css(".c-search_block_bottom_lead a::attr(href)").get()
-                if shop_href:
-                    id_match = re.search(r'client/(\d+)', shop_href)
-                    if id_match:
-                        shop_id = self.shop_cache.get(id_match.group(1))
-
-                # 保存
+                # 新規登録
                 new_listing = Listing(
                     bike_model_id=bike_model_id,
-                    shop_id=shop_id,
                     site_id=self.site_id,
-                    title=v_title,
                     source_url=v_url,
-                    price=price_val,
-                    total_price=total_price_val,
-                    model_year=year,
-                    mileage=mile,
-                    image_urls=images,
-                    is_sold_out=False
+                    url_hash=url_hash(v_url),
+                    fingerprint=card_fingerprint(card),
+                    is_sold_out=False,
+                    **card
                 )
                 self.db.add(new_listing)
                 self.db.commit()
                 self.known_urls.add(v_url)
+                self.snapshot.track(v_url, new_listing.id, card)
 
             except Exception as e:
                 self.db.rollback()
                 self.logger.error(f"車両解析エラー: {e}")
 
-        # ページネーション (もし存在すれば)
-        next_page = response.css("div.c-pager a.c-btn_next::attr(href)").get()
-        if next_page:
-            yield response.follow(next_page, callback=self.parse_listings, meta=response.meta)
+        # 価格履歴と変更された出品の更新は、バッチサイズに達した時点でまとめて書き込む
+        self.snapshot.flush_if_full(self.db)
+
+        # ページネーション (もし存在すれば)。最後のページまで処理できた時点で車種の巡回は完了
+        if listing_page.next_url:
+            meta = {**response.meta, 'cards': response.meta.get('cards', 0) + len(listing_page.cards)}
+            yield response.follow(listing_page.next_url, callback=self.parse_listings, errback=self.listing_page_failed, meta=meta)
+        else:
+            self.crawled_models.add(bike_model_id)
+
+    def listing_page_failed(self, failure):
+        """一覧ページの取得に失敗した車種は、掲載終了判定の対象から外す"""
+        self.failed_models.add(failure.request.meta['bike_model_id'])
+        run_metrics.count("errors")
+        self.logger.error(f"一覧ページ取得失敗: {failure.request.url} ({failure.value})")
+
+    def apply_displacements(self):
+        """収集した排気量を、未設定 (NULL または 0) の車種にだけまとめて反映する"""
+        if not self.displacement_updates:
+            return
+        table = BikeModel.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam('b_id'))
+            .where(or_(table.c.displacement == None, table.c.displacement == 0))
+            .values(displacement=bindparam('b_displacement'))
+        )
+        self.db.execute(stmt, [{"b_id": model_id, "b_displacement": disp} for model_id, disp in self.displacement_updates.items()])
+        self.db.commit()
+        print(f"\n一覧カードから {len(self.displacement_updates)} 車種の排気量を補完しました。")
 
     def spider_closed(self, spider):
-        """スパイダー終了時に掲載終了（完売）を判定"""
+        """スパイダー終了時に排気量を一括反映し、掲載終了（完売）を判定"""
+        self.apply_displacements()
+
+        self.snapshot.flush(self.db)
+        print(f"\n{self.snapshot.recorded_count} 件の価格変化を履歴に記録し、{self.snapshot.updated_count} 件の変更された出品を更新しました。")
+
         print("\n掲載終了車両の判定を行っています...")
-        missing_urls = self.known_urls - self.found_urls
+        # 一覧ページを最後まで巡回できた車種に限り、DBにあって今回見つからなかった出品を掲載終了にする
+        scope = self.crawled_models - self.failed_models
+        print(f"  対象: {len(scope)} 車種（取得失敗で対象外: {len(self.failed_models)} 車種）")
+        total_updated = mark_sold_out(self.db, self.site_id, scope, self.found_urls)
         
-        if missing_urls:
-            missing_list = list(missing_urls)
-            chunk_size = 100
-            total_updated = 0
-            
-            for i in range(0, len(missing_list), chunk_size):
-                chunk = missing_list[i:i + chunk_size]
-                self.db.execute(
-                    update(Listing)
-                    .where(Listing.source_url.in_(chunk))
-                    .where(Listing.site_id == self.site_id)
-                    .values(is_sold_out=True, updated_at=datetime.datetime.now())
-                )
-                total_updated += len(chunk)
-            
-            self.db.commit()
+        if total_updated:
             print(f"  -> {total_updated} 件を「掲載終了（完売）」に更新しました。")
         else:
             print("  -> 新たな掲載終了車両はありません。")
 
+        self.parse_pool.close()
         self.db.close()
 
 # 実行用
+def parse_args():
+    parser = argparse.ArgumentParser(description="BDSの出品情報を Scrapy で収集する")
+    parser.add_argument("--parse-workers", type=int, default=default_workers(), help="一覧ページを解析するワーカープロセス数（1 以下でインライン解析）")
+    profiling.add_argument(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print("BDS出品情報コレクター (Scrapy版) を起動しています...")
-    process = CrawlerProcess()
-    process.crawl(BDSListingSpider)
-    process.start()
+    with profiling.profile(args.profile):
+        process = CrawlerProcess()
+        process.crawl(BDSListingSpider, parse_workers=args.parse_workers)
+        process.start()
     print("すべての同期処理が完了しました。")
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
+import argparse
 import scrapy
 from scrapy.crawler import CrawlerProcess
 import os
+import sys
 import re
 import datetime
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import profiling
+
 # 1. 環境変数の読み込み
 current_dir = os.path.dirname(os.path.abspath(__file__))
 env_path = os.path.join(current_dir, '..', '..', '.env')
@@ -199,11 +205,18 @@ class BDSModelSpider(scrapy.Spider):
             self.logger.info(f"Registered {new_count} new models for {maker_name}")
 
 # 実行用メイン関数
+def parse_args():
+    parser = argparse.ArgumentParser(description="BDS のメーカー・車種マスタを Scrapy で収集する")
+    profiling.add_argument(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print("BDSモデルコレクター (Scrapy版) を実行中...")
-    process = CrawlerProcess()
-    process.crawl(BDSModelSpider)
-    process.start()
+    with profiling.profile(args.profile):
+        process = CrawlerProcess()
+        process.crawl(BDSModelSpider)
+        process.start()
     print("収集が完了しました。")
 
 if __name__ == "__main__":
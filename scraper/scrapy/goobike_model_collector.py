@@ -1,11 +1,18 @@
+import argparse
 import scrapy
 from scrapy.crawler import CrawlerProcess
 import os
+import sys
 import re
+import unicodedata
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import create_engine, Column, BigInteger, String, Integer, DateTime, ForeignKey, UniqueConstraint, bindparam, or_, update
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
+# 共通モジュール (scraper/common) を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import profiling
+
 # 環境変数の読み込み
 load_dotenv()
 if not os.getenv("DB_DATABASE"):
@@ -53,6 +60,16 @@ class BikeModelIdentifier(Base):
     identifier = Column(String(100), nullable=False)
     __table_args__ = (UniqueConstraint('site_id', 'identifier', name='_site_identifier_uc'),)
 
+# 車種名の括弧内に排気量だけが書かれている表記 (例: "ＣＢ４００ＳＦ（400cc）")
+PAREN_DISPLACEMENT_PATTERN = re.compile(r'\(\s*(\d{2,4})\s*cc\s*\)', re.IGNORECASE)
+
+def extract_paren_displacement(raw_name):
+    """車種名の括弧書きから排気量を取り出す（記載がなければ None）"""
+    if not raw_name:
+        return None
+    match = PAREN_DISPLACEMENT_PATTERN.search(unicodedata.normalize('NFKC', raw_name))
+    return int(match.group(1)) if match else None
+
 # --- Scrapy Spider ---
 class GooBikeModelSpider(scrapy.Spider):
     name = "goobike_models"
@@ -74,10 +91,30 @@ class GooBikeModelSpider(scrapy.Spider):
         self.site_id = site.id if site else None
         self.manufacturer_cache = {m.name: m.id for m in self.db.query(Manufacturer).all()}
         self.existing_models = {m.name: m.id for m in self.db.query(BikeModel).all()}
+        # 排気量が未設定の既存車種（一覧ページの括弧書きから補完する対象）
+        self.displacement_targets = {
+            m.id for m in self.db.query(BikeModel.id).filter(
+                or_(BikeModel.displacement == None, BikeModel.displacement == 0)
+            ).all()
+        }
 
     def closed(self, reason):
         self.db.close()
 
+    def apply_displacements(self, displacement_updates):
+        """収集した排気量を、未設定 (NULL または 0) の車種にだけまとめて反映する"""
+        if not displacement_updates:
+            return
+        table = BikeModel.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam('b_id'))
+            .where(or_(table.c.displacement == None, table.c.displacement == 0))
+            .values(displacement=bindparam('b_displacement'))
+        )
+        self.db.execute(stmt, [{"b_id": model_id, "b_displacement": disp} for model_id, disp in displacement_updates.items()])
+        self.displacement_targets.difference_update(displacement_updates)
+
     def parse(self, response):
         """メーカー一覧ページから各メーカーURLを取得"""
         # セレクターをより汎用的なものに変更
@@ -120,6 +157,7 @@ class GooBikeModelSpider(scrapy.Spider):
         bike_list = response.css('li.bike_list')
         
         new_count = 0
+        displacement_updates = {}
         for bike in bike_list:
             raw_model_name = bike.css('em b::text').get()
             identifier_val = bike.css('input[name="model"]::attr(value)').get()
@@ -128,16 +166,19 @@ class GooBikeModelSpider(scrapy.Spider):
                 continue
 
             model_name = re.sub(r'[\(\uff08].*?[\)\uff09]', '', raw_model_name).strip()
+            displacement = extract_paren_displacement(raw_model_name)
             
             # 車種登録
             model_id = self.existing_models.get(model_name)
             if not model_id:
-                new_model = BikeModel(name=model_name, manufacturer_id=maker_id, category="不明")
+                new_model = BikeModel(name=model_name, manufacturer_id=maker_id, category="不明", displacement=displacement)
                 self.db.add(new_model)
                 self.db.flush()
                 model_id = new_model.id
                 self.existing_models[model_name] = model_id
                 new_count += 1
+            elif displacement and model_id in self.displacement_targets:
+                displacement_updates[model_id] = displacement
 
             if self.site_id and identifier_val:
                 exists = self.db.query(BikeModelIdentifier).filter(
@@ -147,14 +188,23 @@ class GooBikeModelSpider(scrapy.Spider):
                 if not exists:
                     self.db.add(BikeModelIdentifier(bike_model_id=model_id, site_id=self.site_id, identifier=identifier_val))
         
+        # 括弧書きから得た排気量はページ単位でまとめて更新
+        self.apply_displacements(displacement_updates)
         self.db.commit()
         if new_count > 0:
             self.logger.info(f"Registered {new_count} new models for {maker_name}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="GooBike のメーカー・車種マスタを Scrapy で収集する")
+    profiling.add_argument(parser)
+    return parser.parse_args()
+
 def main():
-    process = CrawlerProcess()
-    process.crawl(GooBikeModelSpider)
-    process.start()
+    args = parse_args()
+    with profiling.profile(args.profile):
+        process = CrawlerProcess()
+        process.crawl(GooBikeModelSpider)
+        process.start()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# テストから共通モジュール (scraper/common) を読み込めるようにする
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+
+FIXTURES_DIR = os.path.join(current_dir, "fixtures")
+
+def pytest_addoption(parser):
+    parser.addoption("--update-golden", action="store_true", help="パーサーの出力でゴールデンファイル (*.json) を書き換える")
+
+@pytest.fixture
+def update_golden(request):
+    return request.config.getoption("--update-golden")
+
+def read_fixture(name):
+    """フィクスチャのHTMLを、コレクターが受け取るのと同じ bytes で読み込む"""
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
\ No newline at end of file
@@ -0,0 +1,33 @@
+from common.crawl_state import CrawlState, UNIT_KEY_LENGTH
+
+class FakeSnapshot:
+    def __init__(self, events):
+        self.events = events
+
+    def flush_if_full(self, db):
+        pass
+
+    def flush(self, db):
+        self.events.append("snapshot")
+
+def test_long_unit_keys_are_matched_after_mark_done():
+    crawl = CrawlState(1, "test")
+    base = "https://example.com/models/" + "a" * 300
+    crawl.mark_done("model", base + "1")
+    assert crawl.is_done("model", base + "1")
+    # 先頭の255文字が同じでも別の単位として扱う
+    assert not crawl.is_done("model", base + "2")
+    assert len(crawl.pending[0]["unit_key"]) == UNIT_KEY_LENGTH
+
+def test_checkpoint_flushes_snapshot_before_units():
+    events = []
+    crawl = CrawlState(1, "test", checkpoint_units=2)
+    crawl.flush = lambda db: events.append(f"units:{len(crawl.pending)}")
+    snapshot = FakeSnapshot(events)
+
+    crawl.mark_done("model", "a")
+    crawl.checkpoint(None, snapshot)
+    assert events == []
+    crawl.mark_done("model", "b")
+    crawl.checkpoint(None, snapshot)
+    assert events == ["snapshot", "units:2"]
\ No newline at end of file
@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+pytest.importorskip("PIL")
+from PIL import Image
+
+from common import image_files
+
+SCRAPER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+@pytest.fixture
+def derivatives(tmp_path, monkeypatch):
+    """run_all.py --in-process と同じ読み込み方で image_derivatives を読み込み、DBを SQLite に差し替える"""
+    for key in ("DB_USERNAME", "DB_PASSWORD", "DB_DATABASE"):
+        monkeypatch.setenv(key, "test")
+    monkeypatch.chdir(SCRAPER_DIR)
+    import run_all
+    module = run_all.InProcessRunner(output=None).load("common/image_derivatives.py")
+    module.engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    module.STORAGE_BASE_PATH = str(tmp_path)
+    with module.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE listings (id INTEGER PRIMARY KEY, local_image_paths TEXT, local_image_derivatives TEXT)"))
+        conn.execute(text("CREATE TABLE image_objects (sha256 TEXT PRIMARY KEY, derivative_failures INTEGER NOT NULL DEFAULT 0)"))
+    return module
+
+def store(tmp_path, name, content=None):
+    if content is None:
+        Image.new("RGB", (2000, 1000), "red").save(tmp_path / name)
+    else:
+        (tmp_path / name).write_bytes(content)
+    rel_path, sha256, _, _ = image_files.store_file(str(tmp_path / name), str(tmp_path))
+    return rel_path, sha256
+
+def derivatives_of(module, listing_id):
+    with module.engine.connect() as conn:
+        value = conn.execute(text("SELECT local_image_derivatives FROM listings WHERE id = :id"), {"id": listing_id}).scalar()
+    return json.loads(value) if value is not None else None
+
+def test_generate_runs_in_spawned_workers_when_loaded_in_process(derivatives, tmp_path):
+    rel_path, _ = store(tmp_path, "a.jpg")
+    with derivatives.engine.begin() as conn:
+        conn.execute(text("INSERT INTO listings VALUES (1, :paths, NULL)"), {"paths": json.dumps([rel_path])})
+
+    derivatives.generate(batch_size=10, workers=1)
+
+    [entry] = derivatives_of(derivatives, 1)
+    assert entry == image_files.derivative_paths(rel_path)
+    with Image.open(tmp_path / entry["thumb"]) as thumb:
+        assert thumb.size == (480, 360)
+
+def test_broken_image_is_retried_then_recorded_as_null(derivatives, tmp_path, monkeypatch):
+    monkeypatch.setattr(derivatives, "MAX_RENDER_ATTEMPTS", 2)
+    good, _ = store(tmp_path, "a.jpg")
+    broken, sha256 = store(tmp_path, "b.jpg", b"\xff\xd8\xffbroken")
+    with derivatives.engine.begin() as conn:
+        conn.execute(text("INSERT INTO image_objects (sha256) VALUES (:sha256)"), {"sha256": sha256})
+        # SQLite は JSON を文字列として比べるため、JSON_EXTRACT の出力と同じ区切りで保存する
+        conn.execute(text("INSERT INTO listings VALUES (1, :paths, NULL)"), {"paths": json.dumps([good, broken], separators=(",", ":"))})
+
+    derivatives.generate(batch_size=10, workers=1)
+    assert derivatives_of(derivatives, 1) is None
+
+    derivatives.generate(batch_size=10, workers=1)
+    assert derivatives_of(derivatives, 1) == [image_files.derivative_paths(good), None]
+
+def test_listing_whose_images_changed_is_not_overwritten(derivatives, tmp_path, monkeypatch):
+    old, _ = store(tmp_path, "a.jpg")
+    with derivatives.engine.begin() as conn:
+        conn.execute(text("INSERT INTO listings VALUES (1, :paths, NULL)"), {"paths": json.dumps([old])})
+
+    # 読み込んだ後に出品の画像が取り直しになった
+    targets = derivatives.iter_targets
+    def iter_targets(batch_size, limit):
+        for rows in targets(batch_size, limit):
+            with derivatives.engine.begin() as conn:
+                conn.execute(text("UPDATE listings SET local_image_paths = NULL"))
+            yield rows
+    monkeypatch.setattr(derivatives, "iter_targets", iter_targets)
+
+    derivatives.generate(batch_size=10, workers=1)
+    assert derivatives_of(derivatives, 1) is None
\ No newline at end of file
@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import os
+
+import httpx
+import pytest
+
+from common import image_files
+from common.image_files import ImageRejected, object_path, save_stream, sniff_extension, store_file
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\0" * 200_000 + b"\xff\xd9"
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+
+def handler(request):
+    if request.url.path == "/photo":
+        return httpx.Response(200, headers={"Content-Type": "image/jpeg"}, content=JPEG)
+    if request.url.path == "/untyped":
+        return httpx.Response(200, headers={"Content-Type": "application/octet-stream"}, content=PNG)
+    if request.url.path == "/html":
+        return httpx.Response(200, headers={"Content-Type": "text/html"}, content=b"<html></html>")
+    # Content-Type だけ画像を名乗るエラーページ
+    return httpx.Response(200, headers={"Content-Type": "image/jpeg"}, content=b"<html>not found</html>")
+
+def download(directory, path, max_bytes=1024 * 1024):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            async with client.stream("GET", f"https://img.example.com{path}") as resp:
+                return await save_stream(resp, str(directory), max_bytes)
+    return asyncio.run(run())
+
+def test_sniff_extension():
+    assert sniff_extension(JPEG[:12]) == ".jpg"
+    assert sniff_extension(PNG[:12]) == ".png"
+    assert sniff_extension(b"RIFF\0\0\0\0WEBPVP8 ") == ".webp"
+    assert sniff_extension(b"<!DOCTYPE html>") is None
+
+def test_streams_to_content_addressed_path(tmp_path, monkeypatch):
+    # 小さなチャンクでも先頭のバイト列を溜めて判定できること
+    monkeypatch.setattr(image_files, "CHUNK_SIZE", 5)
+    sha256 = hashlib.sha256(JPEG).hexdigest()
+    assert download(tmp_path, "/photo") == (f"objects/{sha256[:2]}/{sha256[2:4]}/{sha256}.jpg", sha256, len(JPEG), True)
+    assert (tmp_path / object_path(sha256, ".jpg")).read_bytes() == JPEG
+    # 同じ内容は書き込まない
+    assert download(tmp_path, "/photo")[3] is False
+    assert download(tmp_path, "/untyped")[0].endswith(".png")
+    assert not list((tmp_path / "objects").glob("*.part"))
+
+def test_store_file_keeps_the_source(tmp_path):
+    legacy = tmp_path / "goobike" / "01" / "1" / "0.jpeg"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(JPEG)
+    rel_path, sha256, size, created = store_file(str(legacy), str(tmp_path))
+    assert (rel_path, size, created) == (object_path(hashlib.sha256(JPEG).hexdigest(), ".jpg"), len(JPEG), True)
+    assert (tmp_path / rel_path).read_bytes() == JPEG and legacy.exists()
+    assert store_file(str(legacy), str(tmp_path))[3] is False
+
+def test_store_file_refreshes_mtime_of_linked_object(tmp_path):
+    legacy = tmp_path / "goobike" / "01" / "1" / "0.jpeg"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(JPEG)
+    # 何年も前に保存された画像でも、取り込んだ直後の objects/ のファイルは --gc の猶予の内側に入る
+    os.utime(legacy, (0, 0))
+    rel_path = store_file(str(legacy), str(tmp_path))[0]
+    assert os.path.getmtime(tmp_path / rel_path) > 0
+
+@pytest.mark.parametrize("path, max_bytes", [("/html", 1024), ("/fake", 1024), ("/photo", 100_000)])
+def test_rejected_responses_leave_no_files(tmp_path, path, max_bytes):
+    with pytest.raises(ImageRejected):
+        download(tmp_path, path, max_bytes)
+    assert [name for _, _, names in os.walk(tmp_path) for name in names] == []
\ No newline at end of file
@@ -0,0 +1,31 @@
+import asyncio
+
+from common.parse_pool import ParsePool
+from common.parsers import goobike
+from conftest import read_fixture
+
+PAGE_URL = "https://www.goobike.com/maker-honda/car-cb400super_four/index.html"
+
+def parse_all(pool, pages):
+    async def run():
+        try:
+            return await asyncio.gather(*(pool.parse(html, PAGE_URL) for html in pages))
+        finally:
+            pool.close()
+    return asyncio.run(run())
+
+def test_small_runs_parse_inline():
+    assert ParsePool("goobike", workers=8, expected_pages=3).inline
+    assert ParsePool("goobike", workers=1).inline
+    assert not ParsePool("goobike", workers=2, expected_pages=1000).inline
+
+def test_process_pool_matches_inline_parsing():
+    html = read_fixture("goobike_listing.html")
+    expected = goobike.parse_listing_page(html, PAGE_URL)
+
+    pool = ParsePool("goobike", workers=2, max_in_flight=3)
+    results = parse_all(pool, [html] * 10)
+
+    assert not pool.inline
+    assert pool.parsed_count == 10
+    assert all(result == expected for result in results)
\ No newline at end of file
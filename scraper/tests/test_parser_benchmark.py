@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from common.parsers import bds, goobike
+from conftest import read_fixture
+
+# 1ページあたりのカード数を実際の一覧ページに近づけるため、フィクスチャのカード群を複製する
+REPEAT = 20
+ROUNDS = 50
+
+def build_page(html, card_open, container_close):
+    """フィクスチャのカード群（最初のカードからリストの終わりまで）を REPEAT 回繰り返したページを作る"""
+    start = html.index(card_open)
+    end = html.index(container_close, start)
+    return html[:start] + html[start:end] * REPEAT + html[end:]
+
+@pytest.mark.parametrize("parser, html_name, card_open, container_close", [
+    (goobike, "goobike_listing.html", b'<div class="bike_sec">', b'</div>\n</body>'),
+    (bds, "bds_listing.html", b'<li class="type_bike">', b'</ul>'),
+])
+def test_parse_cards_per_sec(parser, html_name, card_open, container_close, record_property):
+    fixture = read_fixture(html_name)
+    html = build_page(fixture, card_open, container_close)
+    cards_in_fixture = len(parser.parse_listing_page(fixture, "https://example.com/").cards)
+    assert len(parser.parse_listing_page(html, "https://example.com/").cards) == cards_in_fixture * REPEAT
+
+    started = time.perf_counter()
+    total_cards = 0
+    for _ in range(ROUNDS):
+        total_cards += len(parser.parse_listing_page(html, "https://example.com/").cards)
+    elapsed = time.perf_counter() - started
+
+    cards_per_sec = total_cards / elapsed
+    record_property("cards_per_sec", round(cards_per_sec))
+    print(f"\n[ベンチマーク] {parser.__name__}: {total_cards} 件 / {elapsed:.3f} 秒 = {cards_per_sec:,.0f} cards/sec")
\ No newline at end of file
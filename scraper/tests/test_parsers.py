@@ -0,0 +1,71 @@
+import dataclasses
+import json
+import os
+
+import pytest
+
+from common.parsers import bds, goobike
+from conftest import FIXTURES_DIR, read_fixture
+
+# (パーサー, フィクスチャHTML, ページURL, ゴールデンファイル)
+CASES = [
+    (goobike, "goobike_listing.html", "https://www.goobike.com/maker-honda/car-cb400super_four/index.html", "goobike_listing.json"),
+    (bds, "bds_listing.html", "https://www.bds-bikesensor.net/bike/search/model/123?page=2", "bds_listing.json"),
+]
+
+DETAIL_CASES = [
+    (goobike, "goobike_detail.html", "https://www.goobike.com/spread/8500123/index.html", "goobike_detail.json"),
+    (bds, "bds_detail.html", "https://www.bds-bikesensor.net/bike/detail/2000111", "bds_detail.json"),
+]
+
+MAKER_CASES = [
+    (goobike, "goobike_maker.html", "https://www.goobike.com/maker-honda/index.html", "goobike_maker.json"),
+    (bds, "bds_maker.html", "https://www.bds-bikesensor.net/bike/maker/honda", "bds_maker.json"),
+]
+
+def assert_matches_golden(record, golden_name, update_golden):
+    if isinstance(record, list):
+        result = [dataclasses.asdict(r) for r in record]
+    else:
+        result = dataclasses.asdict(record)
+
+    golden_path = os.path.join(FIXTURES_DIR, golden_name)
+    if update_golden:
+        with open(golden_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+    with open(golden_path, encoding="utf-8") as f:
+        assert result == json.load(f)
+
+@pytest.mark.parametrize("parser, html_name, page_url, golden_name", CASES)
+def test_listing_page_matches_golden(parser, html_name, page_url, golden_name, update_golden):
+    assert_matches_golden(parser.parse_listing_page(read_fixture(html_name), page_url), golden_name, update_golden)
+
+@pytest.mark.parametrize("parser, html_name, page_url, golden_name", DETAIL_CASES)
+def test_detail_page_matches_golden(parser, html_name, page_url, golden_name, update_golden):
+    assert_matches_golden(parser.parse_detail_page(read_fixture(html_name), page_url), golden_name, update_golden)
+
+@pytest.mark.parametrize("parser, html_name, page_url, golden_name", MAKER_CASES)
+def test_maker_page_matches_golden(parser, html_name, page_url, golden_name, update_golden):
+    assert_matches_golden(parser.parse_maker_page(read_fixture(html_name), page_url), golden_name, update_golden)
+
+@pytest.mark.parametrize("parser, html_name, page_url, golden_name", CASES)
+def test_str_and_bytes_give_same_result(parser, html_name, page_url, golden_name):
+    # Playwright の page.content() は str、Scrapy の response.body は bytes を渡す
+    html = read_fixture(html_name)
+    assert parser.parse_listing_page(html.decode("utf-8"), page_url) == parser.parse_listing_page(html, page_url)
+
+@pytest.mark.parametrize("parser", [goobike, bds])
+def test_empty_page(parser):
+    page = parser.parse_listing_page(b"", "https://example.com/")
+    assert page.cards == []
+    assert page.next_url is None
+
+def test_to_card_matches_snapshot_fields():
+    from common.listing_snapshot import CARD_FIELDS
+
+    page = goobike.parse_listing_page(read_fixture("goobike_listing.html"), CASES[0][2])
+    card = page.cards[0].to_card(shop_id=42)
+    assert tuple(card) == CARD_FIELDS
+    assert card["shop_id"] == 42
\ No newline at end of file
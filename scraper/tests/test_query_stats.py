@@ -0,0 +1,35 @@
+import json
+
+from sqlalchemy import create_engine, text
+
+from common import query_stats
+from common.query_stats import QueryStats, normalize
+
+def test_normalize_folds_values_and_in_lists():
+    assert normalize("SELECT id FROM bike_models WHERE name = %(name_1)s LIMIT %(param_1)s") == \
+        normalize("SELECT id FROM bike_models  WHERE name = 'CB400'\n LIMIT 1")
+    assert normalize("SELECT id FROM listings WHERE id IN (%s, %s, %s)") == normalize("SELECT id FROM listings WHERE id IN (%s)")
+    assert normalize("INSERT INTO shops (name) VALUES (%s), (%s), (%s)") == "INSERT INTO shops (name) VALUES (?+), ..."
+
+def test_repeated_selects_in_a_stage_are_n_plus_one_candidates(tmp_path):
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE bike_models (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("INSERT INTO bike_models (id, name) VALUES (1, 'CB400'), (2, 'SR400')"))
+
+    stats = QueryStats(str(tmp_path / "collector"))
+    stats.start()
+    with engine.connect() as conn:
+        with query_stats.stage("maker_models"):
+            for i in range(query_stats.N1_THRESHOLD):
+                conn.execute(text("SELECT name FROM bike_models WHERE id = :id"), {"id": i % 2 + 1}).all()
+        with query_stats.stage("makers"):
+            conn.execute(text("SELECT name FROM bike_models")).all()
+    summary = stats.stop()
+
+    candidates = stats.n_plus_one_candidates()
+    assert [(c["stage"], c["count"]) for c in candidates] == [("maker_models", query_stats.N1_THRESHOLD)]
+    assert any("N+1" in line for line in summary)
+
+    report = json.loads((tmp_path / "collector.sql.json").read_text(encoding="utf-8"))
+    assert {s["stage"]: s["count"] for s in report["stages"]} == {"maker_models": query_stats.N1_THRESHOLD, "makers": 1}
\ No newline at end of file
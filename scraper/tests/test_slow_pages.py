@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from common import slow_pages
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, request):
+        self.request = request
+
+    async def all_headers(self):
+        return {"content-type": "text/html"}
+
+class FakeRequest:
+    method = "GET"
+    timing = {"startTime": 0}
+    failure = None
+
+    def __init__(self, url, resource_type, answered):
+        self.url = url
+        self.resource_type = resource_type
+        self.answered = answered
+
+    async def response(self):
+        if not self.answered:
+            # 応答が来ないリクエスト（記録時に待ってはいけない）
+            await asyncio.sleep(3600)
+        return FakeResponse(self)
+
+class FakePage:
+    """Playwright の Page と同じく、登録したハンドラーに属性を付ける"""
+
+    url = "https://example.com/list"
+
+    def __init__(self, delay, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.handlers = {}
+
+    def on(self, event, handler):
+        setattr(handler, "_pw_impl_instance_", self)
+        self.handlers.setdefault(event, []).append(handler)
+
+    def remove_listener(self, event, handler):
+        self.handlers[event].remove(handler)
+
+    def emit(self, event, value):
+        for handler in list(self.handlers.get(event, [])):
+            handler(value)
+
+    async def goto(self, url, **kwargs):
+        document = FakeRequest(url, "document", answered=True)
+        self.emit("request", document)
+        self.emit("response", FakeResponse(document))
+        self.emit("request", FakeRequest(f"{url}/pending.js", "script", answered=False))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise TimeoutError("Timeout 60000ms exceeded")
+        return "response"
+
+    async def content(self):
+        return "<html></html>"
+
+@pytest.fixture
+def capture_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(slow_pages.SLOW_PAGE_SECONDS_ENV, "0.05")
+    monkeypatch.setenv(slow_pages.SLOW_PAGE_DIR_ENV, str(tmp_path))
+    monkeypatch.setenv(slow_pages.SLOW_PAGE_KEEP_ENV, "2")
+    return tmp_path
+
+def captures(directory):
+    return sorted(os.listdir(directory))
+
+def test_fast_page_is_not_captured(capture_dir):
+    page = FakePage(delay=0)
+    assert asyncio.run(slow_pages.goto(page, "https://example.com/fast")) == "response"
+    assert captures(capture_dir) == []
+    assert all(not handlers for handlers in page.handlers.values())
+
+def test_slow_and_failed_pages_are_captured(capture_dir):
+    assert asyncio.run(slow_pages.goto(FakePage(delay=0.1), "https://example.com/slow")) == "response"
+    with pytest.raises(TimeoutError):
+        asyncio.run(slow_pages.goto(FakePage(delay=0, fail=True), "https://example.com/failed"))
+
+    slow, failed = captures(capture_dir)
+    with open(os.path.join(capture_dir, failed, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["error"].startswith("TimeoutError")
+    assert meta["document_status"] == 200
+    with open(os.path.join(capture_dir, slow, "waterfall.json"), encoding="utf-8") as f:
+        waterfall = json.load(f)
+    # 応答の無いリクエストは待たずに、ステータスなしで記録される
+    assert [entry.get("status") for entry in waterfall] == [200, None]
+    assert os.path.exists(os.path.join(capture_dir, slow, "page.html"))
+
+    # 保存件数の上限を超えた古い記録は消える
+    asyncio.run(slow_pages.goto(FakePage(delay=0.1), "https://example.com/third"))
+    assert len(captures(capture_dir)) == 2 and slow not in captures(capture_dir)
\ No newline at end of file
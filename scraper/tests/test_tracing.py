@@ -0,0 +1,46 @@
+import asyncio
+
+from common import tracing
+from common.tracing import Tracer, read_spans, summarize
+
+async def work_unit(semaphore, url, slow, error=None):
+    with tracing.span("model_page", url=url) as unit:
+        async with tracing.acquire(semaphore, "model_pages"):
+            with tracing.span("fetch") as fetch_span:
+                await asyncio.sleep(0.05 if slow else 0.01)
+                fetch_span.set(bytes=100)
+            with tracing.span("parse"):
+                with tracing.span("cards"):
+                    pass
+            with tracing.span("persist", rows=1):
+                pass
+        if error:
+            # 再試行を使い切った作業単位は例外で抜けずに失敗理由だけを記録する
+            unit.set(error=error)
+
+def test_spans_are_nested_per_unit_and_summarized(tmp_path):
+    tracer = Tracer(str(tmp_path / "collector"))
+    tracer.start()
+
+    async def run():
+        semaphore = asyncio.Semaphore(1)
+        await asyncio.gather(*(work_unit(semaphore, f"https://example.com/{i}", i == 2, "TimeoutError: timeout" if i == 1 else None) for i in range(3)))
+    asyncio.run(run())
+    tracer.stop()
+
+    spans = read_spans(str(tmp_path))
+    units = {s["unit"] for s in spans}
+    assert len(units) == 3
+    assert all(s["parent"] is None for s in spans if s["name"] == "model_page")
+
+    summary = summarize(spans, top=1)
+    [(key, kind)] = summary["kinds"].items()
+    assert key[1] == "model_page" and kind["count"] == 3 and kind["errors"] == 1
+    # 孫のスパン (cards) は内訳に含めない
+    assert set(kind["stages"]) == {"queue_wait", "fetch", "parse", "persist"}
+    assert summary["slowest"][0]["attrs"]["url"] == "https://example.com/2"
+    assert any("TimeoutError: timeout" in line for line in tracing.format_summary(summarize(spans)))
+
+def test_span_is_noop_without_tracer():
+    with tracing.span("model_page", url="https://example.com") as unit:
+        unit.set(rows=1)
\ No newline at end of file